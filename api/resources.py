@@ -8,10 +8,41 @@ import sys, os
 
 sys.path.append("/opt")
 
+try:
+    # Defer the packages marked as "lazy" in the layer until first use.
+    import silvaengine_lazy_imports
+except ImportError:
+    pass
+
 from silvaengine_base import Resources
+
+try:
+    # Keep the endpoint, function and setting lookups in the warm container.
+    import silvaengine_routing_cache
+
+    silvaengine_routing_cache.install()
+except ImportError:
+    pass
+
+try:
+    # Serve persisted queries by hash and keep the validated GraphQL documents.
+    import silvaengine_graphql_registry
+
+    silvaengine_graphql_registry.install()
+except ImportError:
+    pass
+
 import logging
 
 logger = logging.getLogger()
 logger.setLevel(eval(os.environ["LOGGINGLEVEL"]))
 
 handler = Resources.get_handler(logger)  # input values for args and/or kwargs
+
+try:
+    # One Embedded Metric Format line per invocation.
+    import silvaengine_metrics
+
+    handler = silvaengine_metrics.instrument(handler)
+except ImportError:
+    pass
@@ -9,16 +9,36 @@ import sys
 
 sys.path.append("/opt")
 
+try:
+    # Defer the packages marked as "lazy" in the layer until first use.
+    import silvaengine_lazy_imports
+except ImportError:
+    pass
+
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(eval(os.environ["LOGGINGLEVEL"]))
+
 EFS_MOUNT_POINT = os.environ.get("EFSMOUNTPOINT")
 PYTHON_PACKAGES_PATH = os.environ.get("PYTHONPACKAGESPATH")
 if EFS_MOUNT_POINT is not None and PYTHON_PACKAGES_PATH is not None:
-    sys.path.append(f"{EFS_MOUNT_POINT}/{PYTHON_PACKAGES_PATH}")
+    try:
+        # Import from a copy in /tmp instead of EFS when PACKAGEMIRROR is set.
+        import silvaengine_package_mirror
 
-import logging
+        silvaengine_package_mirror.install(f"{EFS_MOUNT_POINT}/{PYTHON_PACKAGES_PATH}")
+    except ImportError:
+        sys.path.append(f"{EFS_MOUNT_POINT}/{PYTHON_PACKAGES_PATH}")
 
 from silvaengine_base import Worker
 
-logger = logging.getLogger()
-logger.setLevel(eval(os.environ["LOGGINGLEVEL"]))
-
 handler = Worker.get_handler(logger)  # input values for args and/or kwargs
+
+try:
+    # One Embedded Metric Format line per invocation.
+    import silvaengine_metrics
+
+    handler = silvaengine_metrics.instrument(handler)
+except ImportError:
+    pass
@@ -4,19 +4,22 @@ from __future__ import print_function
 
 __author__ = "bibow"
 
-import importlib
 import json
 import os
 import sys
-import zipfile
-from datetime import date, datetime
-from decimal import Decimal
-from time import sleep
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from time import perf_counter, time
 
 import boto3
 import dotenv
-from botocore.configloader import load_config
-from botocore.exceptions import ClientError
+import dynamodb_codec
+import hook_engine
+import lambda_packager
+import layer_slimmer
+import s3_uploader
+import stack_monitor
+from botocore.exceptions import ClientError, WaiterError
 
 # Look for a .env file
 if len(sys.argv) == 3:
@@ -44,138 +47,138 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
-
-def execute_hook(lambda_function_name, function_config, hook_function_name):
-    if not function_config.get("hooks") or not function_config.get("endpoint_id"):
-        return
-
-    packages = function_config.get("hooks", {}).get("packages")
-    if type(packages) is not list or len(packages) < 1:
-        return
-    print(packages)
-    events = function_config.get("hooks", {}).get("events")
-    if type(events) is not dict or len(events) < 1:
-        return
-
-    hooks = events.get(hook_function_name)
-    if type(hooks) is not list or len(hooks) < 1:
-        return
-
-    requires = ["package_name", "function_name"]
-    for hook in hooks:
-        if requires != [v for v in requires if v in hook.keys()]:
-            continue
-
-        print(hook.get("package_name"))
-        spec = importlib.util.find_spec(hook.get("package_name"))
-
-        if spec is None:
-            continue
-
-        agent = importlib.import_module(hook.get("package_name"))
-        if hook.get("class_name"):
-            agent = getattr(agent, hook.get("class_name"))
-
-        agent = getattr(agent, hook.get("function_name"))
-        if callable(agent):
-            agent(
-                str(lambda_function_name).strip(),
-                str(function_config.get("endpoint_id")).strip(),
-                str(function_config.get("area", "core")).strip(),
-                packages,
-            )
-    logger.info(f"Execute {hook_function_name} hooks.")
+# The S3 object version of a changed package that a plan has not uploaded.
+PENDING_VERSION = "pending-upload"
+# The reasons of a change set that has nothing to change.
+NO_CHANGES_REASONS = [
+    "The submitted information didn't contain changes.",
+    "No updates are to be performed.",
+]
 
 
-# Helper class to convert a DynamoDB item to JSON.
-class JSONEncoder(json.JSONEncoder):
-    def default(self, o):  # pylint: disable=method-hidden
-        if isinstance(o, Decimal):
-            if o % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        elif isinstance(o, (datetime, date)):
-            return o.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(o, (bytes, bytearray)):
-            return str(o)
-        else:
-            return super(JSONEncoder, self).default(o)
+# Hook callables are imported once and shared by every stack of the deploy.
+hook_runner = hook_engine.HookEngine(
+    max_workers=int(os.getenv("hook_max_workers", 4)),
+    timeout=float(os.getenv("hook_timeout", 300)),
+)
 
 
 class CloudformationStack(object):
-    def __init__(self):
+    def __init__(self, region_name=None, bucket=None):
+        self.region_name = region_name or os.getenv("region_name")
+        self.bucket = bucket or os.getenv("bucket")
         self.aws_cloudformation = boto3.client(
             "cloudformation",
-            region_name=os.getenv("region_name"),
+            region_name=self.region_name,
             aws_access_key_id=os.getenv("aws_access_key_id"),
             aws_secret_access_key=os.getenv("aws_secret_access_key"),
         )
         self.aws_s3 = boto3.resource(
             "s3",
-            region_name=os.getenv("region_name"),
+            region_name=self.region_name,
             aws_access_key_id=os.getenv("aws_access_key_id"),
             aws_secret_access_key=os.getenv("aws_secret_access_key"),
         )
         self.aws_lambda = boto3.client(
             "lambda",
-            region_name=os.getenv("region_name"),
+            region_name=self.region_name,
             aws_access_key_id=os.getenv("aws_access_key_id"),
             aws_secret_access_key=os.getenv("aws_secret_access_key"),
         )
-
-    @staticmethod
-    def zip_dir(dirpath, fzip, is_package=True):
-        basedir = os.path.dirname(dirpath) + "/"
-        for root, dirs, files in os.walk(dirpath):
-            # if os.path.basename(root)[0] == '.':
-            # continue  # skip hidden directories
-            dirname = root.replace(basedir, "")
-            for f in files:
-                # if f[-1] == '~' or (f[0] == '.' and f != '.htaccess'):
-                # skip backup files and all hidden files except .htaccess
-                # continue
-                if not is_package:
-                    dirname = ""
-                fzip.write(root + "/" + f, dirname + "/" + f)
-
-    def pack_aws_lambda(self, lambda_file, base, packages, package_files=[], files={}):
-        fzip = zipfile.ZipFile(lambda_file, "w", zipfile.ZIP_DEFLATED)
-        base = f"{root_path}/{base}"
-        self.zip_dir(base, fzip, is_package=False)
-        for package in packages:
-            self.zip_dir(
-                f"{site_packages}/{package}",
-                fzip,
-            )
-        for f in package_files:
-            fzip.write(
-                f"{site_packages}/{f}",
-                f,
-            )
-        for f, path in files.items():
-            fzip.write(f"{path}/{f}", f)
-        fzip.close()
-
-    def pack_aws_lambda_layer(self, layer_file, packages, package_files=[], files={}):
-        fzip = zipfile.ZipFile(layer_file, "w", zipfile.ZIP_DEFLATED)
-        for package in packages:
-            self.zip_dir(
-                f"{site_packages}/{package}",
-                fzip,
-            )
-        for f in package_files:
-            fzip.write(
-                f"{site_packages}/{f}",
-                f,
-            )
-        for f, path in files.items():
-            fzip.write(f"{path}/{f}", f)
-        fzip.close()
+        self.build_cache = lambda_packager.BuildCache(
+            os.getenv("build_cache_dir", ".build_cache")
+        )
+        self.object_versions = {}
+        self.layer_version_arns = {}
+        self.lookup_calls = 0
+        self.lookup_lock = threading.Lock()
+        self.pending_records = {}
+        self.uploader = s3_uploader.MultipartUploader(
+            self.aws_s3.meta.client,
+            part_size=int(os.getenv("upload_part_size_mb", 16)) * s3_uploader.MB,
+            max_concurrency=int(os.getenv("upload_max_concurrency", 8)),
+            state_dir=self.build_cache.cache_dir,
+        )
 
     def upload_aws_s3_bucket(self, lambda_file, bucket):
-        f = open(lambda_file, "rb")
-        self.aws_s3.Bucket(bucket).put_object(Key=lambda_file, Body=f)
+        record = self.pending_records.pop(lambda_file, None)
+        version_id = self.uploader.upload(
+            lambda_file,
+            bucket,
+            lambda_file,
+            digest=record["digest"] if record is not None else None,
+        )
+        self.object_versions[lambda_file] = version_id
+        if record is not None:
+            self.build_cache.commit(lambda_file, record, bucket, version_id)
+        return version_id
+
+    def pack_and_upload(self, packages, bucket, upload=True):
+        """Build all packages in a process pool and upload each one as soon as
+        its zip is finished.
+
+        packages maps the zip file name to the keyword arguments of
+        lambda_packager.collect_entries. Returns the timing summary per package.
+        With upload=False changed packages are only built and get the version
+        PENDING_VERSION, so that a plan can render the template.
+        """
+        max_workers = int(os.getenv("max_workers", os.cpu_count() or 1))
+        summary = {}
+        uploads = {}
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(max_workers, len(packages)))
+        ) as pack_pool, ThreadPoolExecutor(max_workers=max_workers) as upload_pool:
+            builds = [
+                pack_pool.submit(
+                    lambda_packager.build_package,
+                    self.build_cache.cache_dir,
+                    package_file,
+                    bucket,
+                    site_packages,
+                    **kwargs,
+                )
+                for package_file, kwargs in packages.items()
+            ]
+            for future in as_completed(builds):
+                package_file, changed, record, pack_time, report = future.result()
+                if report is not None:
+                    logger.info(layer_slimmer.format_report(package_file, report))
+                summary[package_file] = {
+                    "status": "uploaded" if changed else "skipped",
+                    "pack": pack_time,
+                    "upload": 0.0,
+                    "size": (
+                        os.path.getsize(package_file)
+                        if os.path.exists(package_file)
+                        else 0
+                    ),
+                }
+                if not changed:
+                    self.object_versions[package_file] = self.build_cache.version_of(
+                        record, bucket
+                    )
+                    logger.info(f"Skipped the unchanged package ({package_file}).")
+                    continue
+                if not upload:
+                    summary[package_file]["status"] = "changed"
+                    self.object_versions[package_file] = PENDING_VERSION
+                    continue
+
+                self.pending_records[package_file] = record
+                uploads[
+                    upload_pool.submit(self._timed_upload, package_file, bucket)
+                ] = package_file
+
+            for future in as_completed(uploads):
+                summary[uploads[future]]["upload"] = future.result()
+                logger.info(f"Uploaded the package ({uploads[future]}).")
+
+        return summary
+
+    def _timed_upload(self, package_file, bucket):
+        started = perf_counter()
+        self.upload_aws_s3_bucket(package_file, bucket)
+        return perf_counter() - started
 
     # Check if the stack exists.
     def _stack_exists(self, stack_name):
@@ -195,54 +198,148 @@ class CloudformationStack(object):
                 return False
             raise
 
+    # Retrieve the version of the object, preferring the env override and the
+    # version uploaded, reused or resolved in this deploy over a lookup in the
+    # S3 bucket.
+    def _get_object_version(self, s3_key, version_env):
+        if os.getenv(version_env):
+            return os.getenv(version_env)
+        if s3_key not in self.object_versions:
+            self.object_versions[s3_key] = self._get_object_last_version(s3_key)
+        return self.object_versions[s3_key]
+
     # Retrieve the last version of the object in a S3 bucket.
     def _get_object_last_version(self, s3_key):
-        object_summary = self.aws_s3.ObjectSummary(os.getenv("bucket"), s3_key)
-        return object_summary.get()["VersionId"]
+        self._count_lookup()
+        return self.aws_s3.meta.client.head_object(
+            Bucket=self.bucket, Key=s3_key
+        )["VersionId"]
 
     def _get_layer_version_arn(self, layer_name):
-        response = self.aws_lambda.list_layer_versions(LayerName=layer_name)
+        if layer_name in self.layer_version_arns:
+            return self.layer_version_arns[layer_name]
+
+        self._count_lookup()
+        response = self.aws_lambda.list_layer_versions(
+            LayerName=layer_name, MaxItems=1
+        )
         assert (
             len(response["LayerVersions"]) > 0
         ), f"Cannot find the lambda layer ({layer_name})."
 
-        return response["LayerVersions"][0]["LayerVersionArn"]
+        self.layer_version_arns[layer_name] = response["LayerVersions"][0][
+            "LayerVersionArn"
+        ]
+        return self.layer_version_arns[layer_name]
+
+    def _count_lookup(self):
+        with self.lookup_lock:
+            self.lookup_calls += 1
+
+    # Resolve every layer ARN and object version the template needs at once,
+    # concurrently, skipping the ones overridden by env or already known.
+    def _resolve_template_lookups(self, template):
+        layer_names = set()
+        s3_keys = set()
+        for key, value in template["Resources"].items():
+            properties = value["Properties"]
+            if value["Type"] == "AWS::Lambda::Function":
+                name = properties["FunctionName"]
+                layer_names.update(
+                    layer
+                    for layer in properties.get("Layers", [])
+                    if not isinstance(layer, dict)
+                )
+            elif value["Type"] == "AWS::Lambda::LayerVersion":
+                name = properties["LayerName"]
+            else:
+                continue
+            if not os.getenv(f"{name}_version"):
+                s3_keys.add(f"{name}.zip")
+
+        layer_names -= set(self.layer_version_arns.keys())
+        s3_keys -= set(self.object_versions.keys())
+        if not layer_names and not s3_keys:
+            return
+
+        max_workers = int(os.getenv("max_workers", os.cpu_count() or 1))
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(layer_names) + len(s3_keys)))
+        ) as executor:
+            layer_arns = {
+                layer_name: executor.submit(self._get_layer_version_arn, layer_name)
+                for layer_name in layer_names
+            }
+            versions = {
+                s3_key: executor.submit(self._get_object_last_version, s3_key)
+                for s3_key in s3_keys
+            }
+        for layer_name, future in layer_arns.items():
+            self.layer_version_arns[layer_name] = future.result()
+        for s3_key, future in versions.items():
+            self.object_versions[s3_key] = future.result()
 
     @classmethod
     def deploy(cls):
         cf = cls()
         stack_name = sys.argv[-1]
-        template_path = f"{stack_name}.json"
 
         # Load the CloudFormation template
-        with open(template_path, "r") as file:
-            template = json.load(file)
+        template = cls._load_template(stack_name)
 
         # Collect Lambda functions and layers from the template
         functions, layers = cls._collect_resources(template)
 
-        # Package and upload Lambda functions
-        cls._process_lambda_functions(cf, functions)
+        # With plan_only=true nothing is uploaded or applied, the changes are
+        # only reported.
+        plan_only = os.getenv("plan_only", "false").lower() == "true"
+
+        # Package Lambda functions and layers in parallel and upload them
+        cls._process_lambda_packages(
+            cf,
+            functions,
+            layers,
+            runtime=os.getenv("runtime") or cls._collect_runtime(template),
+            upload=not plan_only,
+        )
 
-        # Package and upload Lambda layers
-        cls._process_lambda_layers(cf, layers)
+        return cls._apply_stack(cf, stack_name, template, plan_only=plan_only)
 
-        # Update the CloudFormation stack
-        cls._update_cloudformation_stack(cf, stack_name, template)
+    @staticmethod
+    def _load_template(stack_name):
+        with open(f"{stack_name}.json", "r") as file:
+            return json.load(file)
 
-        # Monitor the stack status until it is no longer "IN_PROGRESS"
-        cls._monitor_stack_status(cf, stack_name)
+    # Update the stack with a template whose packages are uploaded, follow
+    # the update and run the deploy hooks. Returns the final stack status.
+    @classmethod
+    def _apply_stack(cls, cf, stack_name, template, plan_only=False):
+        functions, layers = cls._collect_resources(template)
 
-        # Execute hooks on deploy
-        for name, function_config in lambda_config["functions"].items():
-            if name not in functions:
-                continue
+        # Update the CloudFormation stack through a change set
+        monitor = cls._update_cloudformation_stack(
+            cf, stack_name, template, plan_only=plan_only
+        )
+        if plan_only:
+            return "PLANNED"
+        if monitor is None:
+            status = "UP_TO_DATE"
+        else:
+            # Follow the stack events until the update is no longer "IN_PROGRESS"
+            status = cls._monitor_stack_status(monitor)
 
-            execute_hook(
-                lambda_function_name=name,
-                function_config=function_config,
-                hook_function_name=sys._getframe().f_code.co_name,
-            )
+        # Execute hooks on deploy
+        jobs = hook_runner.run(
+            "deploy",
+            {
+                name: function_config
+                for name, function_config in lambda_config["functions"].items()
+                if name in functions
+            },
+        )
+        if jobs:
+            logger.info(hook_engine.HookEngine.format_summary("deploy", jobs))
+        return status
 
     @staticmethod
     def _collect_resources(template):
@@ -258,63 +355,183 @@ class CloudformationStack(object):
                 layers.append(properties["LayerName"])
         return functions, layers
 
+    # The runtime the layers are built for, taken from the Lambda functions.
+    @staticmethod
+    def _collect_runtime(template):
+        for key, value in template["Resources"].items():
+            if value["Type"] == "AWS::Lambda::Function":
+                return value["Properties"].get("Runtime")
+        return None
+
     @classmethod
-    def _process_lambda_functions(cls, cf, functions):
+    def _process_lambda_packages(
+        cls, cf, functions, layers, runtime=None, upload=True
+    ):
+        packages = cls._collect_packages(functions, layers, runtime=runtime)
+        if len(packages) == 0:
+            return {}
+
+        started = perf_counter()
+        summary = cf.pack_and_upload(packages, cf.bucket, upload=upload)
+        for package_file, timing in sorted(summary.items()):
+            logger.info(
+                f"{package_file:<45} {timing['status']:<9}"
+                f" pack {timing['pack']:8.2f}s upload {timing['upload']:8.2f}s"
+                f" {timing['size'] / 1048576:9.2f} MB"
+            )
+        logger.info(
+            f"Packaged {len(packages)} packages in {perf_counter() - started:.2f}s."
+        )
+        return summary
+
+    # The keyword arguments of lambda_packager.build_package for each package.
+    @staticmethod
+    def _collect_packages(functions, layers, runtime=None):
+        packages = {}
         for name, funct in lambda_config["functions"].items():
             if name not in functions:
                 continue
 
-            lambda_file = f"{name}.zip"
-            cf.pack_aws_lambda(
-                lambda_file,
-                funct["base"],
-                funct["packages"],
-                package_files=funct["package_files"],
-                files=funct["files"],
-            )
-            cf.upload_aws_s3_bucket(lambda_file, os.getenv("bucket"))
-            logger.info(f"Uploaded the Lambda package ({name}).")
+            packages[f"{name}.zip"] = {
+                "base": f"{root_path}/{funct['base']}",
+                "packages": funct["packages"],
+                "package_files": funct["package_files"],
+                "files": funct["files"],
+            }
 
-    @classmethod
-    def _process_lambda_layers(cls, cf, layers):
         for name, layer in lambda_config["layers"].items():
             if name not in layers:
                 continue
 
-            layer_file = f"{name}.zip"
-            cf.pack_aws_lambda_layer(
-                layer_file,
-                layer["packages"],
-                package_files=layer["package_files"],
-                files=layer["files"],
-            )
-            cf.upload_aws_s3_bucket(layer_file, os.getenv("bucket"))
-            logger.info(f"Uploaded the Lambda layer package ({name}).")
+            packages[f"{name}.zip"] = {
+                "packages": layer["packages"],
+                "package_files": layer["package_files"],
+                "files": layer["files"],
+                "slim": layer.get("slim"),
+                "runtime": runtime,
+                "lazy": layer.get("lazy"),
+            }
+        return packages
 
     @classmethod
-    def _update_cloudformation_stack(cls, cf, stack_name, template):
+    def _update_cloudformation_stack(cls, cf, stack_name, template, plan_only=False):
         # Update properties for resources in the template
         cls._update_template_properties(cf, template)
 
-        # Prepare stack parameters
-        params = {
-            "StackName": stack_name,
-            "TemplateBody": json.dumps(template, indent=4),
-            "Capabilities": ["CAPABILITY_NAMED_IAM"],
-            "Tags": [{"Key": "autostack", "Value": "true"}],
-            "Parameters": [],
-        }
-
-        # Create or update the stack
-        if cf._stack_exists(stack_name):
-            response = cf.aws_cloudformation.update_stack(**params)
-        else:
-            response = cf.aws_cloudformation.create_stack(**params)
+        # Compare the rendered template with the deployed one and plan the
+        # update with a change set
+        change_set = cf._plan_stack_update(stack_name, template)
+        if change_set is None:
+            logger.info(f"{stack_name} is up to date, skip the stack update.")
+            return None
+        if plan_only:
+            cf._delete_change_set(change_set)
+            return None
+
+        monitor = stack_monitor.StackMonitor(
+            cf.aws_cloudformation,
+            stack_name,
+            label=f"{stack_name}@{cf.region_name}",
+            min_interval=float(os.getenv("monitor_min_interval", 1)),
+            max_interval=float(os.getenv("monitor_max_interval", 15)),
+        )
+        monitor.mark()
+        response = cf.aws_cloudformation.execute_change_set(
+            ChangeSetName=change_set["ChangeSetId"], StackName=stack_name
+        )
+        logger.info(
+            json.dumps(
+                response, indent=4, cls=dynamodb_codec.JSONEncoder, ensure_ascii=False
+            )
+        )
+        return monitor
+
+    def _get_deployed_template(self, stack_name):
+        template = self.aws_cloudformation.get_template(
+            StackName=stack_name, TemplateStage="Original"
+        )["TemplateBody"]
+        return json.loads(template) if isinstance(template, str) else template
+
+    # Return the change set of the update, or None when nothing would change.
+    def _plan_stack_update(self, stack_name, template):
+        stack_exists = self._stack_exists(stack_name)
+        if stack_exists and self._get_deployed_template(stack_name) == template:
+            return None
+
+        response = self.aws_cloudformation.create_change_set(
+            StackName=stack_name,
+            ChangeSetName=f"{stack_name}-{int(time())}",
+            ChangeSetType="UPDATE" if stack_exists else "CREATE",
+            TemplateBody=json.dumps(template, indent=4),
+            Capabilities=["CAPABILITY_NAMED_IAM"],
+            Tags=[{"Key": "autostack", "Value": "true"}],
+            Parameters=[],
+        )
+        change_set = {"ChangeSetId": response["Id"], "StackName": stack_name}
+        try:
+            self.aws_cloudformation.get_waiter("change_set_create_complete").wait(
+                ChangeSetName=change_set["ChangeSetId"],
+                StackName=stack_name,
+                WaiterConfig={"Delay": 2, "MaxAttempts": 300},
+            )
+        except WaiterError:
+            description = self.aws_cloudformation.describe_change_set(
+                ChangeSetName=change_set["ChangeSetId"], StackName=stack_name
+            )
+            if description.get("StatusReason") in NO_CHANGES_REASONS:
+                self._delete_change_set(change_set)
+                return None
+            raise Exception(
+                f"Cannot plan the update of {stack_name}:"
+                f" {description.get('StatusReason')}"
+            )
 
-        logger.info(json.dumps(response, indent=4, cls=JSONEncoder, ensure_ascii=False))
+        changes = []
+        kwargs = {}
+        while True:
+            description = self.aws_cloudformation.describe_change_set(
+                ChangeSetName=change_set["ChangeSetId"], StackName=stack_name, **kwargs
+            )
+            changes.extend(
+                change["ResourceChange"] for change in description["Changes"]
+            )
+            if not description.get("NextToken"):
+                break
+            kwargs["NextToken"] = description["NextToken"]
+
+        logger.info(f"{len(changes)} resources of {stack_name} will change:")
+        for change in changes:
+            logger.info(
+                f"{change['Action']:<8} {change['LogicalResourceId']:<40}"
+                f" {change['ResourceType']:<35}"
+                f" {change.get('Replacement', '')}"
+            )
+        change_set["Changes"] = changes
+        return change_set
+
+    def _delete_change_set(self, change_set):
+        self.aws_cloudformation.delete_change_set(
+            ChangeSetName=change_set["ChangeSetId"],
+            StackName=change_set["StackName"],
+        )
+        if not self._stack_exists(change_set["StackName"]):
+            return
+        # A change set of a new stack leaves the stack in REVIEW_IN_PROGRESS.
+        stack = self.aws_cloudformation.describe_stacks(
+            StackName=change_set["StackName"]
+        )["Stacks"][0]
+        if stack["StackStatus"] == "REVIEW_IN_PROGRESS":
+            self.aws_cloudformation.delete_stack(StackName=change_set["StackName"])
 
     @staticmethod
     def _update_template_properties(cf, template):
+        lookup_calls = cf.lookup_calls
+        cf._resolve_template_lookups(template)
+        logger.info(
+            f"Resolved the layer ARNs and object versions with"
+            f" {cf.lookup_calls - lookup_calls} API calls."
+        )
+
         for key, value in template["Resources"].items():
             resource_type = value["Type"]
             properties = value["Properties"]
@@ -333,9 +550,9 @@ class CloudformationStack(object):
                     for layer in properties["Layers"]
                 ]
                 properties["Code"] = {
-                    "S3Bucket": os.getenv("bucket"),
-                    "S3ObjectVersion": os.getenv(
-                        function_version, cf._get_object_last_version(function_file)
+                    "S3Bucket": cf.bucket,
+                    "S3ObjectVersion": cf._get_object_version(
+                        function_file, function_version
                     ),
                     "S3Key": function_file,
                 }
@@ -343,6 +560,12 @@ class CloudformationStack(object):
                     k: os.getenv(k, v)
                     for k, v in properties["Environment"]["Variables"].items()
                 }
+                # Set by power_tuning.py.
+                function_config = lambda_config["functions"].get(function_name, {})
+                if function_config.get("memory_size"):
+                    properties["MemorySize"] = function_config["memory_size"]
+                if function_config.get("timeout"):
+                    properties["Timeout"] = str(function_config["timeout"])
                 if os.getenv("runtime"):
                     properties["Runtime"] = os.getenv("runtime")
                 if os.getenv("security_group_ids") and os.getenv("subnet_ids"):
@@ -367,9 +590,9 @@ class CloudformationStack(object):
                 layer_file = f"{layer_name}.zip"
                 layer_version = f"{layer_name}_version"
                 properties["Content"] = {
-                    "S3Bucket": os.getenv("bucket"),
-                    "S3ObjectVersion": os.getenv(
-                        layer_version, cf._get_object_last_version(layer_file)
+                    "S3Bucket": cf.bucket,
+                    "S3ObjectVersion": cf._get_object_version(
+                        layer_file, layer_version
                     ),
                     "S3Key": layer_file,
                 }
@@ -383,25 +606,14 @@ class CloudformationStack(object):
                 ):
                     properties["RoleName"] = os.getenv("microcore_iam_role_name")
 
-    @classmethod
-    def _monitor_stack_status(cls, cf, stack_name):
-        stack = cf.aws_cloudformation.describe_stacks(StackName=stack_name)["Stacks"][0]
-        while "IN_PROGRESS" in stack["StackStatus"]:
-            logger.info(
-                json.dumps(
-                    stack["StackStatus"], indent=4, cls=JSONEncoder, ensure_ascii=False
-                )
-            )
-            sleep(5)
-            stack = cf.aws_cloudformation.describe_stacks(StackName=stack_name)[
-                "Stacks"
-            ][0]
-
-        logger.info(
-            json.dumps(
-                stack["StackStatus"], indent=4, cls=JSONEncoder, ensure_ascii=False
-            )
-        )
+    @staticmethod
+    def _monitor_stack_status(monitor):
+        status = monitor.wait()
+        logger.info(monitor.timeline())
+        for name, resource_status, reason in monitor.failures():
+            logger.error(f"{name} {resource_status}: {reason}")
+        logger.info(f"{monitor.label}: {status}")
+        return status
 
 
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Deploy several stacks into several regions in one run.
+
+    python deploy_targets.py -targets deploy_targets.json [-env .env]
+        [-output deploy_report.json]
+
+deploy_targets.json lists the targets; bucket is the deployment bucket of
+the region (default: the bucket of .env), depends_on the stacks of the same
+region that must be deployed first:
+
+    {
+        "targets": [
+            {"stack": "silvaengine", "region_name": "us-west-2", "bucket": "..."},
+            {"stack": "silvaengine-microcore", "region_name": "us-west-2",
+             "bucket": "...", "depends_on": ["silvaengine"]},
+            {"stack": "silvaengine", "region_name": "us-east-1", "bucket": "..."}
+        ]
+    }
+
+A stack that uses a layer by name (e.g. "silvaengine_layer") also depends on
+the stack of the same region that creates that layer. Every package of all
+targets is built once, uploaded to all the regional buckets in parallel, and
+the stacks are then updated and monitored concurrently, each one as soon as
+its dependencies are deployed.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import copy
+import json
+import os
+import sys
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from time import perf_counter
+
+import dotenv
+
+
+def getopts(argv):
+    opts = {}  # Empty dictionary to store key-value pairs.
+    while argv:  # While there are arguments left to parse...
+        if argv[0][0] == "-":  # Found a "-name value" pair.
+            opts[argv[0]] = argv[1]  # Add key and value to the dictionary.
+        argv = argv[1:]  # Reduce the argument list by copying it starting from index 1.
+    return opts
+
+
+args = getopts(sys.argv)
+
+# Look for a .env file; it has to be loaded before cloudformation_stack reads it.
+dotenv.load_dotenv(args.get("-env", ".env"))
+
+import logging
+
+import cloudformation_stack
+import lambda_packager
+from cloudformation_stack import CloudformationStack
+
+logger = logging.getLogger()
+
+# The final statuses after which the dependent stacks can go ahead.
+SUCCEEDED = ["CREATE_COMPLETE", "UPDATE_COMPLETE", "UP_TO_DATE", "PLANNED"]
+
+
+class Target(object):
+    def __init__(self, stack, region_name, bucket, depends_on=None):
+        self.stack = stack
+        self.region_name = region_name
+        self.bucket = bucket
+        self.depends_on = set(depends_on or [])
+        self.template = CloudformationStack._load_template(stack)
+        self.functions, self.layers = CloudformationStack._collect_resources(
+            self.template
+        )
+        self.status = "PENDING"
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def name(self):
+        return f"{self.stack}@{self.region_name}"
+
+    def used_layers(self):
+        return set(
+            layer
+            for value in self.template["Resources"].values()
+            if value["Type"] == "AWS::Lambda::Function"
+            for layer in value["Properties"].get("Layers", [])
+            if not isinstance(layer, dict)
+        )
+
+
+def load_targets(file_name):
+    with open(file_name, "r") as f:
+        targets = [
+            Target(
+                target["stack"],
+                target.get("region_name") or os.getenv("region_name"),
+                target.get("bucket") or os.getenv("bucket"),
+                target.get("depends_on"),
+            )
+            for target in json.load(f)["targets"]
+        ]
+
+    # A named layer comes from the stack of the region that creates it.
+    for target in targets:
+        for other in targets:
+            if (
+                other is not target
+                and other.region_name == target.region_name
+                and target.used_layers() & set(other.layers)
+            ):
+                target.depends_on.add(other.stack)
+    return targets
+
+
+def build_packages(packages, buckets):
+    """Build every package once; returns {package_file: (changed, record)}."""
+    cache_dir = os.getenv("build_cache_dir", ".build_cache")
+    max_workers = int(os.getenv("max_workers", os.cpu_count() or 1))
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(max_workers, len(packages)))
+    ) as executor:
+        futures = [
+            executor.submit(
+                lambda_packager.build_package,
+                cache_dir,
+                package_file,
+                buckets,
+                cloudformation_stack.site_packages,
+                **kwargs,
+            )
+            for package_file, kwargs in packages.items()
+        ]
+        for future in futures:
+            package_file, changed, record, seconds, report = future.result()
+            results[package_file] = (changed, record)
+            logger.info(
+                f"{package_file:<45} {'changed' if changed else 'unchanged':<9}"
+                f" pack {seconds:8.2f}s"
+            )
+    return results
+
+
+def upload_packages(deployers, packages, builds, plan_only=False):
+    """Upload each package to every regional bucket that does not have it."""
+    max_workers = int(os.getenv("max_workers", os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        uploads = {}
+        for region_name, cf in deployers.items():
+            for package_file in packages[region_name]:
+                changed, record = builds[package_file]
+                version_id = cf.build_cache.version_of(record, cf.bucket)
+                if version_id is not None:
+                    cf.object_versions[package_file] = version_id
+                elif plan_only:
+                    cf.object_versions[package_file] = (
+                        cloudformation_stack.PENDING_VERSION
+                    )
+                else:
+                    cf.pending_records[package_file] = record
+                    uploads[
+                        executor.submit(cf._timed_upload, package_file, cf.bucket)
+                    ] = (package_file, cf.bucket)
+
+        for future, (package_file, bucket) in uploads.items():
+            logger.info(
+                f"Uploaded the package ({package_file}) to {bucket}"
+                f" in {future.result():.2f}s."
+            )
+
+
+def deploy_target(target, cf, plan_only=False):
+    started = perf_counter()
+    try:
+        target.status = CloudformationStack._apply_stack(
+            cf, target.stack, copy.deepcopy(target.template), plan_only=plan_only
+        )
+    except Exception as e:
+        target.status = "ERROR"
+        target.error = str(e)
+        logger.exception(f"{target.name} failed.")
+    target.seconds = perf_counter() - started
+    return target
+
+
+def deploy_targets(targets, deployers, plan_only=False):
+    """Run every target as soon as the targets it depends on succeeded."""
+    by_name = {(target.stack, target.region_name): target for target in targets}
+    pending = list(targets)
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        while pending or running:
+            for target in list(pending):
+                dependencies = [
+                    by_name.get((stack, target.region_name))
+                    for stack in target.depends_on
+                ]
+                dependencies = [d for d in dependencies if d is not None]
+                if any(
+                    d.status not in SUCCEEDED + ["PENDING", "RUNNING"]
+                    for d in dependencies
+                ):
+                    target.status = "SKIPPED"
+                    target.error = "A stack it depends on failed."
+                    pending.remove(target)
+                elif all(d.status in SUCCEEDED for d in dependencies):
+                    target.status = "RUNNING"
+                    pending.remove(target)
+                    running[
+                        executor.submit(
+                            deploy_target,
+                            target,
+                            deployers[target.region_name],
+                            plan_only,
+                        )
+                    ] = target
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                target = running.pop(future)
+                future.result()
+                logger.info(
+                    f"{target.name}: {target.status} in {target.seconds:.0f}s."
+                )
+
+    for target in pending:
+        target.status = "SKIPPED"
+        target.error = "Its dependencies cannot be resolved."
+
+
+def format_report(targets, seconds):
+    lines = [f"{'target':<45} {'status':<28} {'seconds':>8}"]
+    for target in targets:
+        lines.append(
+            f"{target.name:<45} {target.status:<28} {target.seconds:8.0f}"
+            + (f" {target.error}" if target.error else "")
+        )
+    lines.append(
+        f"Deployed {len(targets)} targets in {seconds:.0f}s"
+        f" (slowest target {max(t.seconds for t in targets):.0f}s,"
+        f" sum {sum(t.seconds for t in targets):.0f}s)."
+    )
+    return "\n".join(lines)
+
+
+def main():
+    if "-targets" not in args.keys():
+        logger.error("Please input a targets file (deploy_targets.json).")
+        sys.exit()
+
+    started = perf_counter()
+    targets = load_targets(args["-targets"])
+    plan_only = os.getenv("plan_only", "false").lower() == "true"
+
+    deployers = {}
+    packages = {}
+    runtime = os.getenv("runtime") or CloudformationStack._collect_runtime(
+        targets[0].template
+    )
+    all_packages = {}
+    for target in targets:
+        cf = deployers.get(target.region_name)
+        if cf is None:
+            cf = deployers[target.region_name] = CloudformationStack(
+                region_name=target.region_name, bucket=target.bucket
+            )
+        elif cf.bucket != target.bucket:
+            logger.error(
+                f"The targets of {target.region_name} use different buckets."
+            )
+            sys.exit()
+        target_packages = CloudformationStack._collect_packages(
+            target.functions, target.layers, runtime=runtime
+        )
+        all_packages.update(target_packages)
+        packages.setdefault(target.region_name, set()).update(target_packages.keys())
+
+    # Build once for all regions, then upload to every regional bucket.
+    builds = build_packages(
+        all_packages, sorted(set(cf.bucket for cf in deployers.values()))
+    )
+    upload_packages(deployers, packages, builds, plan_only=plan_only)
+    logger.info(f"Packaged and uploaded in {perf_counter() - started:.2f}s.")
+
+    deploy_targets(targets, deployers, plan_only=plan_only)
+
+    seconds = perf_counter() - started
+    logger.info(format_report(targets, seconds))
+    with open(args.get("-output", "deploy_report.json"), "w") as f:
+        json.dump(
+            {
+                "seconds": seconds,
+                "targets": [
+                    {
+                        "stack": target.stack,
+                        "region_name": target.region_name,
+                        "status": target.status,
+                        "seconds": target.seconds,
+                        "error": target.error,
+                    }
+                    for target in targets
+                ],
+            },
+            f,
+            indent=4,
+        )
+    if any(target.status not in SUCCEEDED for target in targets):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Encode and decode DynamoDB items as JSON.
+
+Two modes share one reader:
+
+plain     {"id": "a", "price": 1.50, "tags": ["x", "y"]}
+          Numbers are written with the digits of their Decimal (no float
+          round trip), sets as sorted lists, binary as base64 strings and
+          datetimes as "%Y-%m-%d %H:%M:%S". Sets, binary and datetimes come
+          back as lists and strings.
+lossless  {"$format": "dynamodb-json", "Item": {"id": {"S": "a"}, ...}}
+          The DynamoDB JSON of the item in the line format of the DynamoDB
+          export to S3, marked with "$format"; every type comes back as it
+          was.
+
+decode_item() tells the two apart by the "$format" marker alone, so a file of
+either mode loads the same way and a plain item that happens to hold a single
+"Item" map is never taken for an envelope.
+
+Flat items (only strings, numbers, booleans and nulls) are encoded with one
+dict lookup per attribute; anything else falls back to the recursive encoder.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOSSLESS_KEY = "Item"
+FORMAT_KEY = "$format"
+LOSSLESS_FORMAT = "dynamodb-json"
+
+_encode_string = json.encoder.encode_basestring
+
+
+def _encode_bool(value):
+    return "true" if value else "false"
+
+
+def _encode_null(value):
+    return "null"
+
+
+def _encode_binary(value):
+    data = bytes(getattr(value, "value", value))
+    return '"' + base64.b64encode(data).decode("utf-8") + '"'
+
+
+def _encode_datetime(value):
+    return '"' + value.strftime(DATETIME_FORMAT) + '"'
+
+
+# Keyed by the exact type: bool is an int subclass and must not hit int.
+_SCALARS = {
+    str: _encode_string,
+    Decimal: Decimal.__str__,
+    int: int.__repr__,
+    float: float.__repr__,
+    bool: _encode_bool,
+    type(None): _encode_null,
+}
+
+
+def _encode_map(value):
+    try:
+        members = [
+            _encode_string(k) + ":" + _SCALARS[type(v)](v) for k, v in value.items()
+        ]
+    except KeyError:
+        members = [_encode_string(k) + ":" + _encode(v) for k, v in value.items()]
+    return "{" + ",".join(members) + "}"
+
+
+def _encode_list(value):
+    return "[" + ",".join([_encode(v) for v in value]) + "]"
+
+
+def _encode_set(value):
+    return "[" + ",".join(sorted([_encode(v) for v in value])) + "]"
+
+
+_ENCODERS = dict(_SCALARS)
+_ENCODERS.update(
+    {
+        dict: _encode_map,
+        list: _encode_list,
+        tuple: _encode_list,
+        set: _encode_set,
+        frozenset: _encode_set,
+        bytes: _encode_binary,
+        bytearray: _encode_binary,
+        datetime: _encode_datetime,
+        date: _encode_datetime,
+    }
+)
+
+
+def _encode(value):
+    encode = _ENCODERS.get(type(value))
+    if encode is not None:
+        return encode(value)
+    # Subclasses and boto3's Binary.
+    for types, encode in [
+        (bool, _encode_bool),
+        (str, _encode_string),
+        (Decimal, Decimal.__str__),
+        (int, int.__repr__),
+        (float, float.__repr__),
+        (dict, _encode_map),
+        ((list, tuple), _encode_list),
+        ((set, frozenset), _encode_set),
+        ((datetime, date), _encode_datetime),
+        ((bytes, bytearray), _encode_binary),
+    ]:
+        if isinstance(value, types):
+            return encode(value)
+    if hasattr(value, "value"):
+        return _encode_binary(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable.")
+
+
+def to_typed(value):
+    """Encode a python value as JSON-serializable DynamoDB JSON."""
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, (Decimal, int, float)):
+        return {"N": str(value)}
+    if isinstance(value, (bytes, bytearray)) or hasattr(value, "value"):
+        data = bytes(getattr(value, "value", value))
+        return {"B": base64.b64encode(data).decode("utf-8")}
+    if isinstance(value, dict):
+        return {"M": {k: to_typed(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [to_typed(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        values = sorted(value, key=str)
+        if all(isinstance(v, str) for v in values):
+            return {"SS": values}
+        if all(isinstance(v, (Decimal, int, float)) for v in values):
+            return {"NS": [str(v) for v in values]}
+        return {"BS": [to_typed(v)["B"] for v in values]}
+    if isinstance(value, (datetime, date)):
+        return {"S": value.strftime(DATETIME_FORMAT)}
+    raise TypeError(f"{type(value).__name__} is not a DynamoDB type.")
+
+
+def from_typed(typed):
+    (tag, value), = typed.items()
+    if tag == "NULL":
+        return None
+    if tag in ("S", "BOOL"):
+        return value
+    if tag == "N":
+        return Decimal(value)
+    if tag == "B":
+        return base64.b64decode(value)
+    if tag == "M":
+        return {k: from_typed(v) for k, v in value.items()}
+    if tag == "L":
+        return [from_typed(v) for v in value]
+    if tag == "SS":
+        return set(value)
+    if tag == "NS":
+        return set(Decimal(v) for v in value)
+    if tag == "BS":
+        return set(base64.b64decode(v) for v in value)
+    raise ValueError(f"Unknown DynamoDB type ({tag}).")
+
+
+def encode_item(item, lossless=False):
+    """Return the JSON line of an item."""
+    if lossless:
+        return json.dumps(
+            {
+                FORMAT_KEY: LOSSLESS_FORMAT,
+                LOSSLESS_KEY: {k: to_typed(v) for k, v in item.items()},
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    return _encode_map(item)
+
+
+def decode_item(value):
+    """Turn a parsed JSON line of either mode back into an item."""
+    if (
+        len(value) == 2
+        and value.get(FORMAT_KEY) == LOSSLESS_FORMAT
+        and isinstance(value.get(LOSSLESS_KEY), dict)
+    ):
+        return {k: from_typed(v) for k, v in value[LOSSLESS_KEY].items()}
+    return value
+
+
+# Numbers are parsed as Decimal, the type DynamoDB accepts.
+decoder = json.JSONDecoder(parse_float=Decimal)
+
+
+def decode(text):
+    return decode_item(decoder.decode(text))
+
+
+class JSONEncoder(json.JSONEncoder):
+    """For logging API responses and items with json.dumps(..., cls=...)."""
+
+    def default(self, o):  # pylint: disable=method-hidden
+        if isinstance(o, Decimal):
+            return int(o) if o == o.to_integral_value() else float(o)
+        elif isinstance(o, (datetime, date)):
+            return o.strftime(DATETIME_FORMAT)
+        elif isinstance(o, (set, frozenset)):
+            return sorted(o, key=str)
+        elif isinstance(o, (bytes, bytearray)) or hasattr(o, "value"):
+            return base64.b64encode(bytes(getattr(o, "value", o))).decode("utf-8")
+        else:
+            return super(JSONEncoder, self).default(o)
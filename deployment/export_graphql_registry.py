@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Validate the client queries of a module and write its persisted query registry.
+
+    python export_graphql_registry.py -module <module_name>
+        -queries <directory or .graphql files, comma separated>
+        [-output <module_name>.graphql_registry.json]
+
+Like export_graphql_doc.py it imports the graphene schema of the module. Every
+document is validated against it and stored under the sha256 of its text;
+the registry also keeps the hash of the schema and a documents map of
+file name to hash for the clients, which send the hash as the query.
+Ship the registry with the function, e.g. in lambda_config.json:
+
+    "files": {"<module_name>.graphql_registry.json": "."}
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import glob
+import json
+import logging
+import os
+import sys
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "runtime")
+)
+
+from graphql import parse, validate
+
+import silvaengine_graphql_registry
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+
+def getopts(argv):
+    opts = {}  # Empty dictionary to store key-value pairs.
+    while argv:  # While there are arguments left to parse...
+        if argv[0][0] == "-":  # Found a "-name value" pair.
+            opts[argv[0]] = argv[1]  # Add key and value to the dictionary.
+        argv = argv[1:]  # Reduce the argument list by copying it starting from index 1.
+    return opts
+
+
+def query_files(queries):
+    files = []
+    for path in queries.split(","):
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*.graphql")
+            files.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def build_registry(schema, files):
+    """Return the registry of the documents in files and their errors."""
+    registry = {
+        "schema_hash": silvaengine_graphql_registry.schema_hash(schema),
+        "queries": {},
+        "documents": {},
+    }
+    errors = {}
+    for file_name in files:
+        with open(file_name, "r") as f:
+            document_string = f.read()
+        try:
+            document_errors = validate(schema, parse(document_string))
+        except Exception as e:
+            document_errors = [e]
+        if document_errors:
+            errors[file_name] = [str(e) for e in document_errors]
+            continue
+
+        key = silvaengine_graphql_registry.query_hash(document_string)
+        registry["queries"][key] = {"query": document_string}
+        registry["documents"][os.path.basename(file_name)] = key
+    return registry, errors
+
+
+if __name__ == "__main__":
+    args = getopts(sys.argv)
+    if "-module" not in args.keys():
+        logger.error("Please input a module name.")
+        sys.exit()
+    if "-queries" not in args.keys():
+        logger.error("Please input the queries (a directory or .graphql files).")
+        sys.exit()
+
+    module_name = args["-module"]
+    schema = getattr(__import__(module_name), "schema")
+    registry, errors = build_registry(schema, query_files(args["-queries"]))
+    for file_name, messages in errors.items():
+        for message in messages:
+            logger.error(f"{file_name}: {message}")
+    if errors:
+        sys.exit(1)
+
+    output = args.get("-output", f"{module_name}.graphql_registry.json")
+    with open(output, "w") as f:
+        json.dump(registry, f, indent=4)
+    logger.info(f"Registered {len(registry['queries'])} queries in {output}.")
@@ -0,0 +1,414 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Local load test of the Lambda handlers.
+
+    python handler_benchmark.py [-handlers resources,tasks,workers]
+        [-events rest,http,websocket,sqs,invoke] [-invocations 1000]
+        [-concurrency 1,4] [-warmup 20] [-template silvaengine.json]
+        [-area core] [-endpoint_id api] [-proxy graphql] [-body body.json]
+        [-payload payload.json] [-groups 3]
+        [-dynamodb_endpoint http://localhost:8000] [-sqs_endpoint http://localhost:9324]
+        [-baseline handler_benchmark.baseline.json]
+        [-save_baseline false] [-tolerance 0.1] [-output handler_benchmark.json]
+
+The events follow deployment/silvaengine.json: API Gateway REST and HTTP API
+v2 requests on /{area}/{endpoint_id}/{proxy+}, WebSocket messages on its
+routes, and batches of FIFO SQS messages from the task queue (BatchSize of
+the event source mapping, spread over -groups message groups). resources.py
+gets the API events, tasks.py the SQS batches and workers.py the -payload
+of a direct invoke.
+
+Each of the -concurrency workers is a process standing in for one container:
+it imports the handler module (a cold start), runs -warmup invocations and
+then its share of -invocations. The report has the throughput, the
+p50/p95/p99 latency, the error count and the growth of the resident memory
+over the warm invocations. silvaengine_base and the packages of the handlers
+have to be importable (site_packages of .env); DynamoDB and SQS point to local
+stand-ins (e.g. DynamoDB Local, ElasticMQ) through AWS_ENDPOINT_URL_DYNAMODB
+and AWS_ENDPOINT_URL_SQS.
+
+With -save_baseline true the results become the baseline; otherwise a saved
+baseline is compared and a p95 more than -tolerance slower, or a throughput
+that much lower, is reported as a regression (exit code 1).
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import importlib.util
+import json
+import os
+import resource
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLERS = {
+    "resources": ("api/resources.py", ["rest", "http", "websocket"]),
+    "tasks": ("taskqueue/agenttask/tasks.py", ["sqs"]),
+    "workers": ("beehive/microcore/workers.py", ["invoke"]),
+}
+
+
+def getopts(argv):
+    opts = {}  # Empty dictionary to store key-value pairs.
+    while argv:  # While there are arguments left to parse...
+        if argv[0][0] == "-":  # Found a "-name value" pair.
+            opts[argv[0]] = argv[1]  # Add key and value to the dictionary.
+        argv = argv[1:]  # Reduce the argument list by copying it starting from index 1.
+    return opts
+
+
+def load_routes(file_name):
+    """The stages, routes and queue of the template the events are made for."""
+    with open(file_name, "r") as f:
+        resources = json.load(f)["Resources"]
+    routes = {
+        "rest_stage": "beta",
+        "http_route_key": "ANY /{area}/{endpoint_id}/{proxy+}",
+        "http_stage": "beta",
+        "websocket_routes": [],
+        "websocket_stage": "beta",
+        "queue_name": "silvaengine_task_queue.fifo",
+        "batch_size": 10,
+    }
+    apis = {
+        name: value["Properties"].get("ProtocolType", "REST")
+        for name, value in resources.items()
+        if value["Type"] in ("AWS::ApiGateway::RestApi", "AWS::ApiGatewayV2::Api")
+    }
+    for value in resources.values():
+        properties = value["Properties"]
+        api_id = properties.get("ApiId") or properties.get("RestApiId")
+        api = apis.get(api_id.get("Ref")) if isinstance(api_id, dict) else None
+        if value["Type"] in ("AWS::ApiGateway::Stage", "AWS::ApiGatewayV2::Stage"):
+            routes[f"{(api or 'REST').lower()}_stage"] = properties["StageName"]
+        elif value["Type"] == "AWS::ApiGatewayV2::Route":
+            if api == "HTTP":
+                routes["http_route_key"] = properties["RouteKey"]
+            elif api == "WEBSOCKET":
+                routes["websocket_routes"].append(properties["RouteKey"])
+        elif value["Type"] == "AWS::SQS::Queue":
+            routes["queue_name"] = properties.get("QueueName", routes["queue_name"])
+        elif value["Type"] == "AWS::Lambda::EventSourceMapping":
+            routes["batch_size"] = properties.get("BatchSize", routes["batch_size"])
+    routes["websocket_routes"] = [
+        key for key in routes["websocket_routes"] if not key.startswith("$")
+    ] or ["$default"]
+    return routes
+
+
+def make_event(kind, routes, options, i):
+    area, endpoint_id, proxy = options["area"], options["endpoint_id"], options["proxy"]
+    path = f"/{area}/{endpoint_id}/{proxy}"
+    path_parameters = {"area": area, "endpoint_id": endpoint_id, "proxy": proxy}
+    request_id = str(uuid.uuid4())
+    body = options["body"]
+    if kind == "rest":
+        return {
+            "resource": "/{area}/{endpoint_id}/{proxy+}",
+            "path": path,
+            "httpMethod": "POST",
+            "headers": {"Content-Type": "application/json", "x-api-key": "benchmark"},
+            "queryStringParameters": None,
+            "pathParameters": path_parameters,
+            "stageVariables": None,
+            "requestContext": {
+                "resourcePath": "/{area}/{endpoint_id}/{proxy+}",
+                "httpMethod": "POST",
+                "path": f"/{routes['rest_stage']}{path}",
+                "stage": routes["rest_stage"],
+                "requestId": request_id,
+                "identity": {"apiKey": "benchmark", "sourceIp": "127.0.0.1"},
+            },
+            "body": body,
+            "isBase64Encoded": False,
+        }
+    if kind == "http":
+        return {
+            "version": "2.0",
+            "routeKey": routes["http_route_key"],
+            "rawPath": f"/{routes['http_stage']}{path}",
+            "rawQueryString": "",
+            "headers": {"content-type": "application/json"},
+            "pathParameters": path_parameters,
+            "requestContext": {
+                "http": {"method": "POST", "path": path, "sourceIp": "127.0.0.1"},
+                "routeKey": routes["http_route_key"],
+                "stage": routes["http_stage"],
+                "requestId": request_id,
+                "timeEpoch": int(time.time() * 1000),
+            },
+            "body": body,
+            "isBase64Encoded": False,
+        }
+    if kind == "websocket":
+        route_key = routes["websocket_routes"][i % len(routes["websocket_routes"])]
+        return {
+            "requestContext": {
+                "routeKey": route_key,
+                "eventType": "MESSAGE",
+                "connectionId": f"benchmark{i % 100:04d}=",
+                "domainName": "localhost",
+                "stage": routes["websocket_stage"],
+                "requestId": request_id,
+            },
+            "body": body,
+            "isBase64Encoded": False,
+        }
+    if kind == "sqs":
+        return {
+            "Records": [
+                {
+                    "messageId": str(uuid.uuid4()),
+                    "receiptHandle": "benchmark",
+                    "body": body,
+                    "attributes": {
+                        "ApproximateReceiveCount": "1",
+                        "SentTimestamp": str(int(time.time() * 1000)),
+                        "SequenceNumber": str(i * routes["batch_size"] + n),
+                        "MessageGroupId": f"group-{n % options['groups']}",
+                        "MessageDeduplicationId": f"{i}-{n}",
+                    },
+                    "messageAttributes": {},
+                    "eventSource": "aws:sqs",
+                    "eventSourceARN": "arn:aws:sqs:us-west-2:000000000000:"
+                    + routes["queue_name"],
+                    "awsRegion": "us-west-2",
+                }
+                for n in range(routes["batch_size"])
+            ]
+        }
+    return json.loads(options["payload"])
+
+
+class LambdaContext(object):
+    def __init__(self, function_name, timeout=900):
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.memory_limit_in_mb = 512
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.time()) * 1000)
+
+
+def current_rss():
+    """The resident memory in bytes; the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_handler(name):
+    """Import a handler module the way the Lambda runtime does (a cold start)."""
+    os.environ.setdefault("LOGGINGLEVEL", "logging.WARNING")
+    # The handlers print their metrics; keep the cost, drop the lines.
+    sys.stdout = open(os.devnull, "w")
+    sys.path.append(os.path.join(ROOT, "runtime"))
+    spec = importlib.util.spec_from_file_location(
+        f"benchmark_{name}", os.path.join(ROOT, HANDLERS[name][0])
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(spec.origin))
+    spec.loader.exec_module(module)
+    return module.handler
+
+
+def is_error(result):
+    if isinstance(result, dict):
+        return int(result.get("statusCode", 200)) >= 500 or bool(
+            result.get("batchItemFailures")
+        )
+    return False
+
+
+def run_container(name, kind, invocations, warmup, routes, options):
+    """Play one container: import the handler, warm it up and time it."""
+    started = time.perf_counter()
+    handler = load_handler(name)
+    init_seconds = time.perf_counter() - started
+
+    def invoke(i):
+        event = make_event(kind, routes, options, i)
+        try:
+            return is_error(handler(event, LambdaContext(f"benchmark_{name}")))
+        except Exception:
+            return True
+
+    for i in range(warmup):
+        invoke(i)
+    rss = current_rss()
+    latencies, errors = [], 0
+    for i in range(invocations):
+        started = time.perf_counter()
+        errors += invoke(warmup + i)
+        latencies.append(time.perf_counter() - started)
+    return init_seconds, latencies, errors, current_rss() - rss
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def run(name, kind, invocations, concurrency, warmup, routes, options):
+    shares = [
+        invocations // concurrency + (1 if i < invocations % concurrency else 0)
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        containers = list(
+            executor.map(
+                run_container,
+                *zip(
+                    *[
+                        (name, kind, share, warmup, routes, options)
+                        for share in shares
+                    ]
+                ),
+            )
+        )
+    seconds = time.perf_counter() - started
+
+    latencies = sorted(l for c in containers for l in c[1])
+    return {
+        "handler": name,
+        "event": kind,
+        "concurrency": concurrency,
+        "invocations": len(latencies),
+        "errors": sum(c[2] for c in containers),
+        "seconds": seconds,
+        # Without the imports, which every container pays once.
+        "invocations_per_second": len(latencies)
+        / max(seconds - max(c[0] for c in containers), 1e-9),
+        "cold_start_ms": 1000 * max(c[0] for c in containers),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "rss_growth_mb": max(c[3] for c in containers) / 1048576,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the rows of results that regressed against the baseline."""
+    saved = {(r["handler"], r["event"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = saved.get((r["handler"], r["event"], r["concurrency"]))
+        if b is None:
+            continue
+        reasons = []
+        if r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            reasons.append(f"p95 {b['p95_ms']:.1f} -> {r['p95_ms']:.1f} ms")
+        if r["invocations_per_second"] < b["invocations_per_second"] * (1 - tolerance):
+            reasons.append(
+                f"throughput {b['invocations_per_second']:.0f}"
+                f" -> {r['invocations_per_second']:.0f}/s"
+            )
+        if reasons:
+            regressions.append((r, reasons))
+    return regressions
+
+
+def format_results(results):
+    lines = [
+        f"{'handler':<10} {'event':<10} {'conc':>4} {'calls/s':>9} {'cold ms':>8}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} {'RSS +MB':>8}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['handler']:<10} {r['event']:<10} {r['concurrency']:>4}"
+            f" {r['invocations_per_second']:9.1f} {r['cold_start_ms']:8.0f}"
+            f" {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f}"
+            f" {r['errors']:>6} {r['rss_growth_mb']:8.2f}"
+        )
+    return "\n".join(lines)
+
+
+def setup_environment(args):
+    """Load .env, point DynamoDB/SQS to the stand-ins and add site_packages."""
+    dotenv.load_dotenv(args.get("-env", ".env"))
+    if args.get("-dynamodb_endpoint"):
+        os.environ["AWS_ENDPOINT_URL_DYNAMODB"] = args["-dynamodb_endpoint"]
+    if args.get("-sqs_endpoint"):
+        os.environ["AWS_ENDPOINT_URL_SQS"] = args["-sqs_endpoint"]
+    if os.getenv("site_packages"):
+        # Make the handler packages importable in the worker processes too.
+        os.environ["PYTHONPATH"] = os.pathsep.join(
+            [os.path.abspath(os.getenv("site_packages")), os.getenv("PYTHONPATH", "")]
+        )
+        sys.path.append(os.path.abspath(os.getenv("site_packages")))
+
+
+def make_options(args):
+    """The -area, -endpoint_id, -proxy, -groups, -body and -payload of the events."""
+    return {
+        "area": args.get("-area", "core"),
+        "endpoint_id": args.get("-endpoint_id", "api"),
+        "proxy": args.get("-proxy", "graphql"),
+        "groups": int(args.get("-groups", 3)),
+        "body": open(args["-body"], "r").read()
+        if args.get("-body")
+        else json.dumps({"query": "{ ping }"}),
+        "payload": open(args["-payload"], "r").read()
+        if args.get("-payload")
+        else "{}",
+    }
+
+
+def main():
+    args = getopts(sys.argv)
+    setup_environment(args)
+
+    handlers = args.get("-handlers", ",".join(HANDLERS.keys())).split(",")
+    events = args.get("-events", "rest,http,websocket,sqs,invoke").split(",")
+    invocations = int(args.get("-invocations", 1000))
+    concurrencies = [int(n) for n in args.get("-concurrency", "1,4").split(",")]
+    warmup = int(args.get("-warmup", 20))
+    routes = load_routes(args.get("-template", "silvaengine.json"))
+    options = make_options(args)
+
+    results = []
+    for name in handlers:
+        for kind in HANDLERS[name][1]:
+            if kind not in events:
+                continue
+            for concurrency in concurrencies:
+                print(f"Run {invocations} {kind} events on {name} x{concurrency}.")
+                results.append(
+                    run(name, kind, invocations, concurrency, warmup, routes, options)
+                )
+
+    print(format_results(results))
+    with open(args.get("-output", "handler_benchmark.json"), "w") as f:
+        json.dump(results, f, indent=4)
+
+    baseline_file = args.get("-baseline", "handler_benchmark.baseline.json")
+    if args.get("-save_baseline", "false").lower() == "true":
+        with open(baseline_file, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Saved the baseline to {baseline_file}.")
+    elif os.path.exists(baseline_file):
+        with open(baseline_file, "r") as f:
+            regressions = compare(
+                results, json.load(f), float(args.get("-tolerance", 0.1))
+            )
+        for r, reasons in regressions:
+            print(
+                f"Regression {r['handler']} {r['event']} x{r['concurrency']}: "
+                + ", ".join(reasons)
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
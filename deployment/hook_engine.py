@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Run the deploy hooks of the Lambda functions.
+
+Hooks are configured per function in lambda_config.json:
+
+    "hooks": {
+        "packages": ["silvaengine_resource"],
+        "events": {
+            "deploy": [
+                {
+                    "name": "register",
+                    "package_name": "silvaengine_resource",
+                    "class_name": "Resource",
+                    "function_name": "add_resources",
+                    "timeout": 120,
+                    "depends_on": []
+                }
+            ]
+        }
+    }
+
+Every hook is called as function(lambda_function_name, endpoint_id, area,
+packages). name (default package_name.function_name) is what depends_on
+refers to; a hook only starts once the hooks of the same function it depends
+on have succeeded. Hooks without pending dependencies run at the same time on
+up to max_workers daemon threads; a hook still running after its timeout is
+reported as TIMEOUT and no longer waited for.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import importlib
+import importlib.util
+import logging
+import queue
+import threading
+from time import perf_counter
+
+logger = logging.getLogger()
+
+REQUIRES = ["package_name", "function_name"]
+
+
+class HookJob(object):
+    def __init__(self, lambda_function_name, function_config, hook):
+        self.lambda_function_name = lambda_function_name
+        self.function_config = function_config
+        self.hook = hook
+        self.name = hook.get(
+            "name", f"{hook['package_name']}.{hook['function_name']}"
+        )
+        self.depends_on = [
+            f"{lambda_function_name}:{name}" for name in hook.get("depends_on", [])
+        ]
+        self.status = "PENDING"
+        self.started = None
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def id(self):
+        return f"{self.lambda_function_name}:{self.name}"
+
+
+class HookEngine(object):
+    def __init__(self, max_workers=4, timeout=300):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._callables = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, hook):
+        """Import the hook callable once; None when its package is missing."""
+        key = (hook["package_name"], hook.get("class_name"), hook["function_name"])
+        with self._lock:
+            if key not in self._callables:
+                agent = None
+                if importlib.util.find_spec(hook["package_name"]) is not None:
+                    agent = importlib.import_module(hook["package_name"])
+                    if hook.get("class_name"):
+                        agent = getattr(agent, hook["class_name"])
+                    agent = getattr(agent, hook["function_name"])
+                    if not callable(agent):
+                        agent = None
+                self._callables[key] = agent
+            return self._callables[key]
+
+    @staticmethod
+    def collect_jobs(event, function_configs):
+        jobs = []
+        for name, function_config in function_configs.items():
+            hooks = function_config.get("hooks")
+            if not hooks or not function_config.get("endpoint_id"):
+                continue
+            packages = hooks.get("packages")
+            events = hooks.get("events")
+            if type(packages) is not list or len(packages) < 1:
+                continue
+            if type(events) is not dict or type(events.get(event)) is not list:
+                continue
+            for hook in events[event]:
+                if all(key in hook.keys() for key in REQUIRES):
+                    jobs.append(HookJob(name, function_config, hook))
+        return jobs
+
+    def _call(self, job, agent, done):
+        try:
+            agent(
+                str(job.lambda_function_name).strip(),
+                str(job.function_config.get("endpoint_id")).strip(),
+                str(job.function_config.get("area", "core")).strip(),
+                job.function_config["hooks"]["packages"],
+            )
+            done.put((job, "SUCCEEDED", None))
+        except Exception as e:
+            logger.exception(f"The hook {job.id} failed.")
+            done.put((job, "FAILED", str(e)))
+
+    def _start(self, job, done):
+        try:
+            agent = self.resolve(job.hook)
+        except Exception as e:
+            job.status, job.error = "FAILED", f"Cannot import the hook: {e}"
+            return False
+        if agent is None:
+            job.status = "MISSING"
+            return False
+        job.status = "RUNNING"
+        job.started = perf_counter()
+        threading.Thread(
+            target=self._call, args=(job, agent, done), daemon=True
+        ).start()
+        return True
+
+    def _schedule(self, pending, running, by_id, done):
+        # Start or skip the pending jobs whose dependencies are settled;
+        # returns whether any job moved on.
+        progressed = False
+        for job in list(pending):
+            dependencies = [by_id[d] for d in job.depends_on if d in by_id]
+            if any(
+                d.status not in ("PENDING", "RUNNING", "SUCCEEDED")
+                for d in dependencies
+            ):
+                job.status, job.error = "SKIPPED", "A hook it depends on failed."
+                pending.remove(job)
+                progressed = True
+            elif all(d.status == "SUCCEEDED" for d in dependencies):
+                if len(running) >= self.max_workers:
+                    break
+                pending.remove(job)
+                progressed = True
+                if self._start(job, done):
+                    running.append(job)
+        return progressed
+
+    def run(self, event, function_configs):
+        """Run the hooks of event for function_configs ({name: config}) and
+        return the jobs with their status, duration and error."""
+        jobs = self.collect_jobs(event, function_configs)
+        by_id = {job.id: job for job in jobs}
+        pending = list(jobs)
+        running = []
+        done = queue.Queue()
+
+        while pending or running:
+            if not self._schedule(pending, running, by_id, done) and not running:
+                # Whatever is left waits on itself (a depends_on cycle).
+                for job in pending:
+                    job.status, job.error = "SKIPPED", "Cyclic dependencies."
+                break
+            if not running:
+                continue
+
+            deadlines = [
+                job.started + float(job.hook.get("timeout", self.timeout))
+                for job in running
+            ]
+            try:
+                job, status, error = done.get(
+                    timeout=max(min(deadlines) - perf_counter(), 0)
+                )
+                if job in running:
+                    running.remove(job)
+                    job.status, job.error = status, error
+                    job.seconds = perf_counter() - job.started
+            except queue.Empty:
+                now = perf_counter()
+                for job, deadline in zip(list(running), deadlines):
+                    if deadline <= now:
+                        running.remove(job)
+                        job.status = "TIMEOUT"
+                        job.seconds = now - job.started
+                        job.error = f"Still running after {job.seconds:.1f}s."
+        return jobs
+
+    @staticmethod
+    def format_summary(event, jobs):
+        lines = [f"{'hook':<60} {'status':<10} {'seconds':>8}"]
+        for job in jobs:
+            lines.append(
+                f"{job.id:<60} {job.status:<10} {job.seconds:8.2f}"
+                + (f" {job.error}" if job.error else "")
+            )
+        lines.append(f"Executed {len(jobs)} {event} hooks.")
+        return "\n".join(lines)
@@ -0,0 +1,352 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Cold-start import profiler for the Lambda handlers.
+
+Each handler module (resources.handler, tasks.handler, workers.handler) is
+imported in a fresh interpreter with the packaged layer contents on sys.path,
+the way Lambda loads it from /opt. The first pass runs with -X importtime and
+builds the per-module import time tree, the second pass runs with tracemalloc
+and attributes the memory still allocated after the import to each package.
+AWS API calls made while importing are answered by a stub (an empty response,
+or the one recorded for the operation in the -stubs file).
+
+    python import_profiler.py [-stacks silvaengine,silvaengine-microcore]
+        [-functions silvaengine_area_resource] [-layers silvaengine_layer.zip]
+        [-budget 1500] [-rss_budget 256] [-top 20] [-memory true]
+        [-stubs stubs.json] [-output import_profile.json]
+
+The script exits with 1 when a handler imports slower than -budget ms or its
+peak RSS is above -rss_budget MB.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+# Nothing beyond the standard library is imported at module level, so that
+# the child interpreter does not preload packages that the layer ships.
+MARKER = "-- silvaengine handler import --"
+
+
+def getopts(argv):
+    opts = {}  # Empty dictionary to store key-value pairs.
+    while argv:  # While there are arguments left to parse...
+        if argv[0][0] == "-":  # Found a "-name value" pair.
+            opts[argv[0]] = argv[1]  # Add key and value to the dictionary.
+        argv = argv[1:]  # Reduce the argument list by copying it starting from index 1.
+    return opts
+
+
+class StubAwsFinder(object):
+    """Patch botocore right after it is imported so that no API call leaves
+    the process while a handler is being profiled."""
+
+    def __init__(self, stubs):
+        self.stubs = stubs
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != "botocore.client":
+            return None
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                exec_module = spec.loader.exec_module
+                stubs = self.stubs
+
+                def stub_exec_module(module):
+                    exec_module(module)
+
+                    def _make_api_call(client, operation_name, api_params):
+                        return stubs.get(operation_name, {})
+
+                    module.BaseClient._make_api_call = _make_api_call
+
+                spec.loader.exec_module = stub_exec_module
+                return spec
+        return None
+
+
+def run_child(spec_file):
+    with open(spec_file, "r") as f:
+        spec = json.load(f)
+
+    os.environ.update(spec["environment"])
+    sys.path[:0] = spec["sys_path"]
+    sys.meta_path.insert(0, StubAwsFinder(spec["stubs"]))
+    if spec["memory"]:
+        import tracemalloc
+
+        tracemalloc.start()
+
+    sys.stderr.write(f"{MARKER}\n")
+    sys.stderr.flush()
+    started = time.perf_counter()
+    importlib.import_module(spec["module"])
+    result = {"seconds": time.perf_counter() - started}
+
+    import resource
+
+    result["rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if spec["memory"]:
+        files = {
+            getattr(module, "__file__", None): name
+            for name, module in list(sys.modules.items())
+        }
+        memory = {}
+        for stat in tracemalloc.take_snapshot().statistics("filename"):
+            name = files.get(stat.traceback[0].filename)
+            if name is None or name == "__main__":
+                continue
+            memory[name] = memory.get(name, 0) + stat.size
+        result["memory"] = memory
+
+    with open(spec["output"], "w") as f:
+        json.dump(result, f)
+
+
+def parse_importtime(stderr):
+    """Rebuild the import tree from the -X importtime lines after MARKER.
+
+    The lines come in post-order (children before their parent) and the
+    nesting depth is the indentation of the module name.
+    """
+    pending = {}
+    started = False
+    for line in stderr.splitlines():
+        if line == MARKER:
+            started = True
+            continue
+        if not started or not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        node = {
+            "name": name.strip(),
+            "self_us": int(fields[0]),
+            "cumulative_us": int(fields[1]),
+            "children": pending.pop(depth + 1, []),
+        }
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
+
+
+def flatten(nodes, result=None):
+    result = [] if result is None else result
+    for node in nodes:
+        result.append(node)
+        flatten(node["children"], result)
+    return result
+
+
+def group_memory(memory):
+    packages = {}
+    for name, size in memory.items():
+        package = name.split(".", 1)[0]
+        packages[package] = packages.get(package, 0) + size
+    return packages
+
+
+def extract_layers(layer_files, work_dir):
+    paths = []
+    for layer_file in layer_files:
+        if not os.path.exists(layer_file):
+            print(f"Cannot find {layer_file}, use {os.getenv('site_packages')}.")
+            paths.append(os.getenv("site_packages"))
+            continue
+        path = f"{work_dir}/{os.path.basename(layer_file)[:-4]}"
+        with zipfile.ZipFile(layer_file, "r") as fzip:
+            fzip.extractall(path)
+        paths.append(os.path.abspath(path))
+    return paths
+
+
+def collect_handlers(stacks):
+    """Map every Lambda function of the templates to its handler module,
+    environment and layer zips."""
+    lambda_config = json.load(
+        open(
+            f"{os.path.abspath(os.path.dirname(__file__))}/lambda_config.json",
+            "r",
+        )
+    )
+    handlers = {}
+    for stack in stacks:
+        with open(f"{stack}.json", "r") as f:
+            resources = json.load(f)["Resources"]
+        for key, value in resources.items():
+            if value["Type"] != "AWS::Lambda::Function":
+                continue
+            properties = value["Properties"]
+            name = properties["FunctionName"]
+            if name not in lambda_config["functions"]:
+                continue
+            layers = []
+            for layer in properties.get("Layers", []):
+                if isinstance(layer, dict) and "Ref" in layer:
+                    layer = resources[layer["Ref"]]["Properties"]["LayerName"]
+                layers.append(f"{layer}.zip")
+            handlers[name] = {
+                "base": os.path.abspath(
+                    f"{os.getenv('root_path', '../')}/"
+                    f"{lambda_config['functions'][name]['base']}"
+                ),
+                "module": properties["Handler"].rsplit(".", 1)[0],
+                "environment": {
+                    k: str(os.getenv(k, v))
+                    for k, v in properties["Environment"]["Variables"].items()
+                },
+                "layers": layers,
+            }
+    return handlers
+
+
+def profile_handler(name, handler, layer_paths, stubs, memory, work_dir):
+    environment = dict(
+        handler["environment"],
+        AWS_ACCESS_KEY_ID="testing",
+        AWS_SECRET_ACCESS_KEY="testing",
+        AWS_DEFAULT_REGION=handler["environment"].get("REGIONNAME", "us-west-2"),
+        AWS_EC2_METADATA_DISABLED="true",
+    )
+    spec = {
+        "module": handler["module"],
+        "sys_path": [handler["base"]] + layer_paths,
+        "environment": environment,
+        "stubs": stubs,
+        "memory": False,
+        "output": f"{work_dir}/{name}.result.json",
+    }
+
+    def run(spec, importtime):
+        spec_file = f"{work_dir}/{name}.spec.json"
+        with open(spec_file, "w") as f:
+            json.dump(spec, f)
+        command = [sys.executable]
+        if importtime:
+            command += ["-X", "importtime"]
+        command += [os.path.abspath(__file__), "-child", spec_file]
+        completed = subprocess.run(
+            command, cwd=work_dir, capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise Exception(f"Cannot import {name}:\n{completed.stderr[-4000:]}")
+        with open(spec["output"], "r") as f:
+            return json.load(f), completed.stderr
+
+    result, stderr = run(spec, True)
+    profile = {
+        "seconds": result["seconds"],
+        "rss_mb": result["rss_kb"] / 1024,
+        "tree": parse_importtime(stderr),
+    }
+    if memory:
+        result, _ = run(dict(spec, memory=True), False)
+        profile["memory"] = group_memory(result["memory"])
+    return profile
+
+
+def format_profile(name, profile, top):
+    lines = [
+        f"{name}: imported in {profile['seconds'] * 1000:.0f} ms,"
+        f" peak RSS {profile['rss_mb']:.1f} MB"
+    ]
+    modules = sorted(
+        flatten(profile["tree"]), key=lambda node: node["self_us"], reverse=True
+    )
+    lines.append(f"  {'module':<50} {'self ms':>10} {'cumulative ms':>14}")
+    for node in modules[:top]:
+        lines.append(
+            f"  {node['name']:<50} {node['self_us'] / 1000:10.1f}"
+            f" {node['cumulative_us'] / 1000:14.1f}"
+        )
+    if profile.get("memory"):
+        lines.append(f"  {'package':<50} {'memory MB':>10}")
+        for package, size in sorted(
+            profile["memory"].items(), key=lambda item: item[1], reverse=True
+        )[:top]:
+            lines.append(f"  {package:<50} {size / 1048576:10.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    args = getopts(sys.argv)
+    if "-child" in args.keys():
+        run_child(args["-child"])
+        return
+
+    import dotenv
+
+    # Look for a .env file
+    if os.path.exists(".env"):
+        dotenv.load_dotenv(".env")
+
+    stacks = args.get("-stacks", "silvaengine,silvaengine-microcore").split(",")
+    handlers = collect_handlers(stacks)
+    if "-functions" in args.keys():
+        handlers = {
+            name: handler
+            for name, handler in handlers.items()
+            if name in args["-functions"].split(",")
+        }
+    budget = float(args["-budget"]) if "-budget" in args.keys() else None
+    rss_budget = float(args["-rss_budget"]) if "-rss_budget" in args.keys() else None
+    top = int(args.get("-top", 20))
+    memory = args.get("-memory", "true").lower() == "true"
+    stubs = {}
+    if "-stubs" in args.keys():
+        with open(args["-stubs"], "r") as f:
+            stubs = json.load(f)
+
+    profiles = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        layer_paths = {}
+        for name, handler in handlers.items():
+            layers = handler["layers"]
+            if "-layers" in args.keys():
+                layers = args["-layers"].split(",")
+            paths = []
+            for layer in layers:
+                if layer not in layer_paths:
+                    layer_paths[layer] = extract_layers([layer], work_dir)[0]
+                paths.append(layer_paths[layer])
+
+            profile = profile_handler(name, handler, paths, stubs, memory, work_dir)
+            profiles[name] = profile
+            print(format_profile(name, profile, top))
+
+            if budget is not None and profile["seconds"] * 1000 > budget:
+                failures.append(
+                    f"{name} imported in {profile['seconds'] * 1000:.0f} ms"
+                    f" (budget {budget:.0f} ms)."
+                )
+            if rss_budget is not None and profile["rss_mb"] > rss_budget:
+                failures.append(
+                    f"{name} peaked at {profile['rss_mb']:.1f} MB"
+                    f" (budget {rss_budget:.0f} MB)."
+                )
+
+    with open(args.get("-output", "import_profile.json"), "w") as f:
+        json.dump(profiles, f, indent=4)
+
+    for failure in failures:
+        print(f"Cold-start budget exceeded: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
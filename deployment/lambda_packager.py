@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import zipfile
+
+import layer_slimmer
+
+logger = logging.getLogger()
+
+CHUNK_SIZE = 1024 * 1024
+# Every entry is stamped with the same date so that a package is byte-identical
+# no matter when, where or by which worker it was built.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+LAZY_IMPORTS_MODULE = "silvaengine_lazy_imports.py"
+LAZY_IMPORTS_TEMPLATE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "runtime", LAZY_IMPORTS_MODULE
+)
+
+
+def walk_dir(dirpath, is_package=True):
+    """Yield (path, arcname) for every file under dirpath in a stable order.
+
+    Packages keep their directory name as the archive prefix; a function base
+    (is_package=False) is flattened into the root of the archive.
+    """
+    basedir = os.path.dirname(dirpath) + "/"
+    for root, dirs, files in os.walk(dirpath):
+        dirs.sort()
+        dirname = root.replace(basedir, "") if is_package else ""
+        for f in sorted(files):
+            yield f"{root}/{f}", f"{dirname}/{f}".lstrip("/")
+
+
+def collect_entries(site_packages, base=None, packages=[], package_files=[], files={}):
+    entries = []
+    if base is not None:
+        entries.extend(walk_dir(base, is_package=False))
+    for package in packages:
+        entries.extend(walk_dir(f"{site_packages}/{package}"))
+    for f in package_files:
+        entries.append((f"{site_packages}/{f}", f))
+    for f, path in files.items():
+        entries.append((f"{path}/{f}", f))
+    return entries
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# The fixed part of a local file header (APPNOTE.TXT 4.3.7): signature,
+# versions, flags, method, time, date, crc, sizes, name and extra lengths.
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\003\004"
+
+
+def read_raw_entry(src, info):
+    """Return the compressed bytes of an entry of src as they are stored."""
+    with open(src.filename, "rb") as f:
+        f.seek(info.header_offset)
+        header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local header for {info.filename}.")
+        f.seek(header[-2] + header[-1], 1)
+        data = f.read(info.compress_size)
+    if len(data) != info.compress_size:
+        raise zipfile.BadZipFile(f"Truncated entry {info.filename}.")
+    return data
+
+
+def copy_zip_entry(src, info, dst):
+    """Copy an already compressed entry from src into dst without recompressing.
+
+    zipfile has no public API to add raw compressed data, so the entry goes
+    in through the attributes ZipFile.write() itself keeps up to date;
+    tests/test_lambda_packager.py pins this against the running CPython.
+    """
+    data = read_raw_entry(src, info)
+    zinfo = zipfile.ZipInfo(info.filename, ZIP_DATE_TIME)
+    for attr in (
+        "compress_type",
+        "create_system",
+        "external_attr",
+        "CRC",
+        "compress_size",
+        "file_size",
+    ):
+        setattr(zinfo, attr, getattr(info, attr))
+    zinfo.header_offset = dst.fp.tell()
+    dst.fp.write(zinfo.FileHeader())
+    dst.fp.write(data)
+    dst.filelist.append(zinfo)
+    dst.NameToInfo[zinfo.filename] = zinfo
+    dst.start_dir = dst.fp.tell()
+
+
+COMMIT_LOCK = threading.Lock()
+
+
+class BuildCache(object):
+    """Content-addressed cache of the zip packages built for a deployment.
+
+    Every artifact keeps a manifest under cache_dir with the sha256 of each
+    entry (keyed by its archive path), the digest of the whole artifact and
+    the S3 version it was uploaded as to each bucket, so one build serves the
+    buckets of several regions.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _manifest_path(self, package_file):
+        return f"{self.cache_dir}/{package_file}.json"
+
+    def load(self, package_file):
+        try:
+            with open(self._manifest_path(package_file), "r") as f:
+                record = json.load(f)
+        except (IOError, ValueError):
+            record = {"digest": None, "bucket": None, "version_id": None, "entries": {}}
+        if "uploads" not in record:
+            record["uploads"] = (
+                {record["bucket"]: record["version_id"]} if record["version_id"] else {}
+            )
+        return record
+
+    def save(self, package_file, record):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = f"{self._manifest_path(package_file)}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(record, f, indent=4, sort_keys=True)
+        os.replace(tmp_file, self._manifest_path(package_file))
+
+    @staticmethod
+    def hash_entries(entries, previous):
+        # Every entry is addressed by the sha256 of its content. A file keeps
+        # its recorded hash only while size, mtime, ctime and inode are all
+        # unchanged: mtime alone can be carried over (pip, cp -p, tar), ctime
+        # cannot, as the kernel moves it on every write.
+        hashed = {}
+        for path, arcname in entries:
+            stat = os.stat(path)
+            signature = [stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino]
+            cached = previous.get(arcname)
+            if cached and cached[:2] + cached[3:] == signature:
+                hashed[arcname] = cached
+            else:
+                hashed[arcname] = signature[:2] + [hash_file(path)] + signature[2:]
+        return hashed
+
+    @staticmethod
+    def digest(hashed, options=None):
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        for arcname in sorted(hashed.keys()):
+            sha256.update(f"{arcname}\0{hashed[arcname][2]}\n".encode("utf-8"))
+        return sha256.hexdigest()
+
+    @staticmethod
+    def version_of(record, bucket):
+        return record["uploads"].get(bucket)
+
+    def is_fresh(self, record, digest, bucket):
+        # bucket may be a list: fresh only once uploaded to all of them.
+        buckets = bucket if isinstance(bucket, list) else [bucket]
+        return record["digest"] == digest and all(
+            self.version_of(record, bucket) is not None for bucket in buckets
+        )
+
+    def build(self, package_file, entries, bucket, options=None, compress_level=None):
+        """Build package_file from entries unless the cached upload is current.
+
+        Returns (changed, record). Only the entries whose content hash moved
+        are compressed again; the others are copied from the previous zip.
+        A zip already built for another bucket, or by a run interrupted before
+        its upload, is reused as it is: the record of a new zip is saved as
+        soon as it is written and commit() adds its uploads.
+        """
+        record = self.load(package_file)
+        hashed = self.hash_entries(entries, record["entries"])
+        digest = self.digest(hashed, options)
+        if self.is_fresh(record, digest, bucket):
+            return False, record
+        if record["digest"] == digest and os.path.exists(package_file):
+            return True, record
+
+        previous = (
+            record["entries"]
+            if os.path.exists(package_file) and record.get("options") == options
+            else {}
+        )
+        write_zip(package_file, entries, hashed, previous, compress_level)
+
+        record = {
+            "digest": digest,
+            "options": options,
+            "bucket": None,
+            "version_id": None,
+            "uploads": {},
+            "entries": hashed,
+        }
+        # Saved before the upload: a run interrupted while uploading finds the
+        # zip built and resumes the upload of the same content.
+        self.save(package_file, record)
+        return True, record
+
+    def commit(self, package_file, record, bucket, version_id):
+        # Uploads to several buckets commit concurrently; merge them.
+        with COMMIT_LOCK:
+            current = self.load(package_file)
+            if current["digest"] == record["digest"]:
+                record["uploads"] = dict(current["uploads"], **record["uploads"])
+            record["uploads"][bucket] = version_id
+            record.update({"bucket": bucket, "version_id": version_id})
+            self.save(package_file, record)
+
+
+def write_zip_entry(fzip, path, arcname):
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    zinfo.date_time = ZIP_DATE_TIME
+    zinfo.compress_type = fzip.compression
+    with open(path, "rb") as src, fzip.open(zinfo, "w") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def write_zip(package_file, entries, hashed, previous, compress_level=None):
+    tmp_file = f"{package_file}.tmp"
+    src = zipfile.ZipFile(package_file, "r") if previous else None
+    try:
+        with zipfile.ZipFile(
+            tmp_file, "w", zipfile.ZIP_DEFLATED, compresslevel=compress_level
+        ) as fzip:
+            for path, arcname in entries:
+                if arcname in fzip.NameToInfo:
+                    continue
+                cached = previous.get(arcname)
+                if (
+                    src is not None
+                    and cached is not None
+                    and cached[2] == hashed[arcname][2]
+                    and arcname in src.NameToInfo
+                ):
+                    try:
+                        copy_zip_entry(src, src.NameToInfo[arcname], fzip)
+                        continue
+                    except zipfile.BadZipFile as e:
+                        # Nothing is written before the entry is read back.
+                        logger.warning(f"Recompressing {arcname}: {e}")
+                write_zip_entry(fzip, path, arcname)
+    finally:
+        if src is not None:
+            src.close()
+    os.replace(tmp_file, package_file)
+
+
+def lazy_imports_entry(cache_dir, package_file, lazy):
+    """Render runtime/silvaengine_lazy_imports.py with the lazy packages of a
+    layer and return its (path, arcname) entry."""
+    with open(LAZY_IMPORTS_TEMPLATE, "r") as f:
+        source = f.read().replace(
+            "LAZY_MODULES = []", f"LAZY_MODULES = {json.dumps(sorted(lazy))}", 1
+        )
+    path = f"{cache_dir}/lazy/{package_file}/{LAZY_IMPORTS_MODULE}"
+    # Only rewrite on change so the build cache keeps the recorded hash.
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if f.read() == source:
+                return path, LAZY_IMPORTS_MODULE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(source)
+    return path, LAZY_IMPORTS_MODULE
+
+
+def build_package(
+    cache_dir,
+    package_file,
+    bucket,
+    site_packages,
+    slim=None,
+    runtime=None,
+    lazy=None,
+    **kwargs,
+):
+    """Collect, slim, hash and zip one package; runs inside a packaging worker.
+
+    Returns (package_file, changed, record, seconds, slim_report).
+    """
+    started = time.perf_counter()
+    entries = collect_entries(site_packages, **kwargs)
+    if lazy:
+        entries.append(lazy_imports_entry(cache_dir, package_file, lazy))
+    options, compress_level, report = None, None, None
+    if slim is not None:
+        slimmer = layer_slimmer.LayerSlimmer(
+            slim, runtime, f"{cache_dir}/pyc/{package_file}"
+        )
+        entries, report = slimmer.slim(entries)
+        options, compress_level = slimmer.options, slimmer.compress_level
+
+    changed, record = BuildCache(cache_dir).build(
+        package_file, entries, bucket, options=options, compress_level=compress_level
+    )
+    if report is not None and os.path.exists(package_file):
+        report = layer_slimmer.add_compressed_sizes(report, package_file)
+        layer_slimmer.write_report(report, f"{cache_dir}/{package_file}.slim.json")
+    return package_file, changed, record, time.perf_counter() - started, report
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import fnmatch
+import importlib.util
+import json
+import logging
+import os
+import py_compile
+import sys
+import zipfile
+
+logger = logging.getLogger()
+
+# Lambda rejects a function whose code and layers unzip to more than 250 MB.
+UNZIPPED_SIZE_LIMIT = 250 * 1024 * 1024
+
+DEFAULT_EXCLUDES = [
+    "*/__pycache__/*",
+    "*.pyc",
+    "*.pyo",
+    "*.pyi",
+    "*/py.typed",
+    "*.dist-info/RECORD",
+    "*.dist-info/INSTALLER",
+    "*.dist-info/REQUESTED",
+    "*.dist-info/direct_url.json",
+]
+
+
+def host_runtime():
+    return f"python{sys.version_info.major}.{sys.version_info.minor}"
+
+
+class LayerSlimmer(object):
+    """Prune and precompile the entries of a layer before it is zipped.
+
+    It only runs for a layer with a "slim" block in lambda_config.json; none
+    of the shipped layers has one, so they are zipped as they are:
+
+        "slim": {
+            "exclude": ["*/tests/*", "*/docs/*"],
+            "include": [],
+            "packages": {"pandas": {"exclude": ["pandas/tests/*"]}},
+            "precompile": true,
+            "compress_level": 9
+        }
+
+    exclude/include are fnmatch patterns on the archive path, applied on top
+    of DEFAULT_EXCLUDES; include wins over exclude. Precompiled .pyc files
+    use unchecked hash validation so they are deterministic and are never
+    rewritten on the read-only /opt mount; they can only be built when the
+    host interpreter matches the target runtime. Check every exclude against
+    the packages of the layer before enabling it: some import modules from
+    their tests/, docs/ or examples/ directories at runtime.
+    """
+
+    def __init__(self, config, runtime, work_dir):
+        self.config = config
+        self.runtime = runtime
+        self.work_dir = work_dir
+        self.excludes = DEFAULT_EXCLUDES + config.get("exclude", [])
+        self.includes = config.get("include", [])
+        self.packages = config.get("packages", {})
+        self.precompile = config.get("precompile", False)
+        if self.precompile and runtime != host_runtime():
+            logger.warning(
+                f"Skip precompiling for {runtime}, "
+                f"the build host runs {host_runtime()}."
+            )
+            self.precompile = False
+
+    @property
+    def compress_level(self):
+        return self.config.get("compress_level")
+
+    @property
+    def options(self):
+        # Anything that changes the bytes of the zip is part of the cache key.
+        return {
+            "slim": self.config,
+            "runtime": self.runtime if self.precompile else None,
+        }
+
+    @staticmethod
+    def _package_of(arcname):
+        return arcname.split("/", 1)[0]
+
+    def _match(self, arcname, patterns):
+        return any(fnmatch.fnmatchcase(arcname, pattern) for pattern in patterns)
+
+    def is_excluded(self, arcname):
+        if self._match(arcname, self.includes):
+            return False
+        package_config = self.packages.get(self._package_of(arcname), {})
+        if self._match(arcname, package_config.get("include", [])):
+            return False
+        return self._match(arcname, self.excludes) or self._match(
+            arcname, package_config.get("exclude", [])
+        )
+
+    def _compile(self, path, arcname):
+        pyc_arcname = importlib.util.cache_from_source(arcname)
+        pyc_path = f"{self.work_dir}/{pyc_arcname}"
+        if not (
+            os.path.exists(pyc_path)
+            and os.stat(pyc_path).st_mtime_ns >= os.stat(path).st_mtime_ns
+        ):
+            os.makedirs(os.path.dirname(pyc_path), exist_ok=True)
+            try:
+                py_compile.compile(
+                    path,
+                    cfile=pyc_path,
+                    dfile=arcname,
+                    doraise=True,
+                    invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+                )
+            except py_compile.PyCompileError:
+                return None
+        return pyc_path, pyc_arcname
+
+    def slim(self, entries):
+        """Return the slimmed entries and the per-package size report."""
+        report = {}
+        slimmed = []
+        for path, arcname in entries:
+            size = os.path.getsize(path)
+            package = report.setdefault(
+                self._package_of(arcname),
+                {
+                    "files_before": 0,
+                    "bytes_before": 0,
+                    "files_after": 0,
+                    "bytes_after": 0,
+                },
+            )
+            package["files_before"] += 1
+            package["bytes_before"] += size
+            if self.is_excluded(arcname):
+                continue
+
+            slimmed.append((path, arcname))
+            package["files_after"] += 1
+            package["bytes_after"] += size
+
+            if self.precompile and arcname.endswith(".py"):
+                compiled = self._compile(path, arcname)
+                if compiled is not None:
+                    slimmed.append(compiled)
+                    package["files_after"] += 1
+                    package["bytes_after"] += os.path.getsize(compiled[0])
+        return slimmed, report
+
+
+def add_compressed_sizes(report, package_file):
+    with zipfile.ZipFile(package_file, "r") as fzip:
+        for info in fzip.infolist():
+            package = report.get(info.filename.split("/", 1)[0])
+            if package is not None:
+                package["bytes_zipped"] = package.get("bytes_zipped", 0) + (
+                    info.compress_size
+                )
+    return report
+
+
+def write_report(report, report_file):
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+
+
+def format_report(package_file, report):
+    lines = [
+        f"{'package':<40} {'before MB':>10} {'after MB':>10}"
+        f" {'zipped MB':>10} {'files':>13}"
+    ]
+    totals = {"bytes_before": 0, "bytes_after": 0, "bytes_zipped": 0}
+    for name, package in sorted(
+        report.items(), key=lambda item: item[1]["bytes_before"], reverse=True
+    ):
+        for key in totals.keys():
+            totals[key] += package.get(key, 0)
+        lines.append(
+            f"{name:<40} {package['bytes_before'] / 1048576:10.2f}"
+            f" {package['bytes_after'] / 1048576:10.2f}"
+            f" {package.get('bytes_zipped', 0) / 1048576:10.2f}"
+            f" {package['files_before']:>6}/{package['files_after']:<6}"
+        )
+    lines.append(
+        f"{package_file:<40} {totals['bytes_before'] / 1048576:10.2f}"
+        f" {totals['bytes_after'] / 1048576:10.2f}"
+        f" {totals['bytes_zipped'] / 1048576:10.2f}"
+    )
+    if totals["bytes_after"] > UNZIPPED_SIZE_LIMIT:
+        lines.append(
+            f"WARNING: {package_file} unzips to more than the Lambda limit of 250 MB."
+        )
+    return "\n".join(lines)
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Parquet snapshots of DynamoDB tables.
+
+The Arrow schema is inferred from the DynamoDB types of the first row group:
+S -> string, N -> decimal128(38, scale), B -> binary, BOOL -> bool. Sets,
+lists, maps, NULL and attributes whose type varies are stored as DynamoDB
+JSON strings ({"M": {...}}, numbers as strings, binary as base64), so no
+precision is lost. Attributes that do not fit the schema of the file (new
+attributes, wider numbers or other types in later row groups) go to the
+_extra column of their row as DynamoDB JSON and are merged back on load.
+The DynamoDB type of every column is kept in the schema metadata.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import json
+import threading
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dynamodb_codec import from_typed, to_typed
+
+EXTRA_COLUMN = "_extra"
+TYPES_METADATA = b"dynamodb_types"
+MAX_PRECISION = 38
+
+
+def dynamodb_type(value):
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, (Decimal, int)):
+        return "N"
+    if isinstance(value, (bytes, bytearray)) or hasattr(value, "value"):
+        return "B"
+    return "ANY"
+
+
+def _digits(value):
+    # (integer digits, scale) of a Decimal.
+    sign, digits, exponent = Decimal(value).as_tuple()
+    return max(len(digits) + exponent, 0), max(-exponent, 0)
+
+
+class Column(object):
+    def __init__(self, name, tag, scale=0):
+        self.name = name
+        self.tag = tag
+        self.scale = scale
+
+    @property
+    def arrow_type(self):
+        return {
+            "S": pa.string(),
+            "N": pa.decimal128(MAX_PRECISION, self.scale),
+            "B": pa.binary(),
+            "BOOL": pa.bool_(),
+        }.get(self.tag, pa.string())
+
+    def accepts(self, value):
+        if self.tag == "ANY":
+            return True
+        if dynamodb_type(value) != self.tag:
+            return False
+        if self.tag == "N":
+            integer_digits, scale = _digits(value)
+            return (
+                scale <= self.scale
+                and integer_digits <= MAX_PRECISION - self.scale
+            )
+        return True
+
+    def encode(self, value):
+        if self.tag == "ANY":
+            return json.dumps(to_typed(value))
+        if self.tag == "B":
+            return bytes(getattr(value, "value", value))
+        return value
+
+    def decode(self, value):
+        if self.tag == "ANY":
+            return from_typed(json.loads(value))
+        if self.tag == "N":
+            # Drop the padding of the column scale (1.50 -> 1.5, 2.00 -> 2).
+            if value == value.to_integral():
+                return Decimal(int(value))
+            return value.normalize()
+        return value
+
+
+def infer_columns(items):
+    tags = {}
+    scales = {}
+    integer_digits = {}
+    for item in items:
+        for name, value in item.items():
+            tag = dynamodb_type(value)
+            if tags.setdefault(name, tag) != tag:
+                tags[name] = "ANY"
+            if tag == "N":
+                digits, scale = _digits(value)
+                scales[name] = max(scales.get(name, 0), scale)
+                integer_digits[name] = max(integer_digits.get(name, 0), digits)
+
+    columns = []
+    for name in sorted(tags.keys()):
+        tag = tags[name]
+        if tag == "N" and integer_digits[name] + scales[name] > MAX_PRECISION:
+            tag = "ANY"
+        columns.append(Column(name, tag, scales.get(name, 0)))
+    return columns
+
+
+class ParquetItemWriter(object):
+    """Stream DynamoDB items to a Parquet file in row groups of row_group_size.
+
+    Has the write(items)/close() interface of table_jobs.JsonItemWriter and is
+    safe to share between the threads of a parallel scan.
+    """
+
+    def __init__(self, file_name, row_group_size=10000):
+        self.file_name = file_name
+        self.row_group_size = row_group_size
+        self.count = 0
+        self.columns = None
+        self._rows = []
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        self.columns = infer_columns(self._rows)
+        fields = [pa.field(c.name, c.arrow_type) for c in self.columns]
+        fields.append(pa.field(EXTRA_COLUMN, pa.string()))
+        metadata = {
+            TYPES_METADATA: json.dumps(
+                {c.name: [c.tag, c.scale] for c in self.columns}
+            ).encode("utf-8")
+        }
+        self._writer = pq.ParquetWriter(
+            self.file_name, pa.schema(fields, metadata=metadata)
+        )
+
+    def _flush(self):
+        if len(self._rows) == 0:
+            return
+        if self._writer is None:
+            self._open()
+
+        data = {c.name: [] for c in self.columns}
+        extras = []
+        for item in self._rows:
+            extra = {}
+            for column in self.columns:
+                value = item.get(column.name)
+                if column.name in item and column.accepts(value):
+                    data[column.name].append(column.encode(value))
+                else:
+                    data[column.name].append(None)
+                    if column.name in item:
+                        extra[column.name] = to_typed(value)
+            for name, value in item.items():
+                if name not in data:
+                    extra[name] = to_typed(value)
+            extras.append(json.dumps(extra) if extra else None)
+
+        arrays = [pa.array(data[c.name], type=c.arrow_type) for c in self.columns]
+        arrays.append(pa.array(extras, type=pa.string()))
+        self._writer.write_table(
+            pa.Table.from_arrays(arrays, schema=self._writer.schema)
+        )
+        self._rows = []
+
+    def write(self, items):
+        with self._lock:
+            self._rows.extend(items)
+            self.count += len(items)
+            if len(self._rows) >= self.row_group_size:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._writer is None:
+                # An empty table still gets a readable file.
+                self._open()
+            self._writer.close()
+
+
+def iter_parquet_items(file_name, batch_size=10000):
+    """Yield the DynamoDB items of a Parquet file written by ParquetItemWriter."""
+    parquet_file = pq.ParquetFile(file_name)
+    metadata = parquet_file.schema_arrow.metadata or {}
+    columns = {
+        name: Column(name, tag, scale)
+        for name, (tag, scale) in json.loads(
+            metadata.get(TYPES_METADATA, b"{}").decode("utf-8")
+        ).items()
+    }
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        for row in batch.to_pylist():
+            extra = row.pop(EXTRA_COLUMN, None)
+            item = {
+                name: columns[name].decode(value) if name in columns else value
+                for name, value in row.items()
+                if value is not None
+            }
+            if extra:
+                item.update(
+                    {k: from_typed(v) for k, v in json.loads(extra).items()}
+                )
+            yield item
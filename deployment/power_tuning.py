@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Pick the MemorySize and Timeout of the Lambda functions from measurements.
+
+    python power_tuning.py [-functions silvaengine_area_resource,...]
+        [-mode local|recorded] [-memory 128,256,512,1024,1769,3008]
+        [-strategy balanced|cost|speed] [-repeat 20] [-warmup 5]
+        [-events events.json] [-recorded logs] [-cpu_scale 1]
+        [-price_gb_second 0.0000166667] [-price_request 0.0000002]
+        [-timeout_factor 3] [-headroom 1.25] [-write false]
+        [-output power_tuning.json]
+
+local replays an event set on the handler of every function (the events of
+handler_benchmark.py, or the lists of -events, {function: [event, ...]}) and
+splits each duration into CPU and waiting time. The functions are replayed
+one after the other, each in a fresh process, so they do not contend for
+the CPU and inflate each other's waiting time. Lambda gives a function a
+share of a vCPU proportional to its memory, a full one at 1769 MB, so the CPU
+time is scaled by 1769/memory below that (and by -cpu_scale, the speed of
+the local CPU against a Lambda vCPU) while the waiting time stays the same.
+
+recorded reads the REPORT lines of the function logs, -recorded/<function>.log,
+and uses the durations measured at each memory size found there.
+
+For every memory size the report has the p50/p95/max duration and the cost of
+a million invocations. The recommended size is the cheapest (cost), the
+fastest (speed) or the one with the lowest cost x p95 (balanced) among the
+sizes above the peak memory used times -headroom; the timeout is the slowest
+invocation at that size times -timeout_factor. Only with -write true do both
+go into lambda_config.json as memory_size and timeout, which the deployment applies
+to the functions in the template.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import json
+import logging
+import math
+import os
+import re
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import handler_benchmark
+from handler_benchmark import getopts
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+LAMBDA_CONFIG = f"{os.path.abspath(os.path.dirname(__file__))}/lambda_config.json"
+FUNCTIONS = {
+    "silvaengine_area_resource": ("resources", "rest"),
+    "silvaengine_area_resource_http": ("resources", "http"),
+    "silvaengine_agenttask": ("tasks", "sqs"),
+    "silvaengine_microcore": ("workers", "invoke"),
+}
+FULL_CPU_MB = 1769
+MIN_MEMORY_MB = 128
+MAX_TIMEOUT = 900
+REPORT_LINE = re.compile(
+    r"REPORT .*?\bDuration: ([\d.]+) ms.*?Memory Size: (\d+) MB"
+    r".*?Max Memory Used: (\d+) MB"
+)
+
+
+def replay(function_name, events, repeat, warmup):
+    """Run the events on the handler of the function in this process and
+    return the (wall, cpu) seconds of every invocation and the peak RSS."""
+    handler = handler_benchmark.load_handler(FUNCTIONS[function_name][0])
+    context = handler_benchmark.LambdaContext(function_name)
+    for i in range(warmup):
+        handler(events[i % len(events)], context)
+
+    samples, errors = [], 0
+    for i in range(repeat):
+        for event in events:
+            started, cpu_started = time.perf_counter(), time.process_time()
+            try:
+                errors += handler_benchmark.is_error(handler(event, context))
+            except Exception:
+                errors += 1
+            samples.append(
+                (time.perf_counter() - started, time.process_time() - cpu_started)
+            )
+    # ru_maxrss is in KB on Linux.
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return samples, peak_mb, errors
+
+
+def model_durations(samples, memory, cpu_scale=1.0):
+    """The durations in ms the samples would take with memory MB."""
+    share = cpu_scale * max(1.0, FULL_CPU_MB / memory)
+    return [1000 * (wall - cpu + cpu * share) for wall, cpu in samples]
+
+
+def read_recorded(file_name):
+    """Return ({memory: [duration ms]}, peak MB) of the REPORT lines of a log."""
+    durations, peak_mb = {}, 0
+    with open(file_name, "r") as f:
+        for line in f:
+            match = REPORT_LINE.search(line)
+            if match is None:
+                continue
+            durations.setdefault(int(match.group(2)), []).append(float(match.group(1)))
+            peak_mb = max(peak_mb, int(match.group(3)))
+    return durations, peak_mb
+
+
+def build_curve(durations, price_gb_second, price_request):
+    curve = []
+    for memory in sorted(durations):
+        values = sorted(durations[memory])
+        # Billed per started millisecond.
+        billed = sum(math.ceil(d) for d in values) / len(values)
+        curve.append(
+            {
+                "memory": memory,
+                "p50_ms": handler_benchmark.percentile(values, 50),
+                "p95_ms": handler_benchmark.percentile(values, 95),
+                "max_ms": values[-1],
+                "cost_per_million": 1000000
+                * (billed / 1000 * memory / 1024 * price_gb_second + price_request),
+            }
+        )
+    return curve
+
+
+def recommend(curve, strategy, min_memory, timeout_factor):
+    candidates = [point for point in curve if point["memory"] >= min_memory] or [
+        curve[-1]
+    ]
+    if strategy == "cost":
+        best = min(candidates, key=lambda p: (p["cost_per_million"], p["p95_ms"]))
+    elif strategy == "speed":
+        best = min(candidates, key=lambda p: (p["p95_ms"], p["cost_per_million"]))
+    else:
+        best = min(candidates, key=lambda p: p["cost_per_million"] * p["p95_ms"])
+    timeout = math.ceil(best["max_ms"] * timeout_factor / 1000)
+    return best["memory"], min(max(timeout, 3), MAX_TIMEOUT)
+
+
+def load_events(args, function_name):
+    if args.get("-events"):
+        with open(args["-events"], "r") as f:
+            events = json.load(f).get(function_name)
+        if events:
+            return events
+    kind = FUNCTIONS[function_name][1]
+    routes = handler_benchmark.load_routes(args.get("-template", "silvaengine.json"))
+    options = handler_benchmark.make_options(args)
+    return [handler_benchmark.make_event(kind, routes, options, i) for i in range(5)]
+
+
+def format_results(results):
+    lines = [
+        f"{'function':<32} {'memory':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"
+        f" {'$/1M':>9}"
+    ]
+    for function_name, result in results.items():
+        for point in result["curve"]:
+            chosen = "*" if point["memory"] == result["memory_size"] else ""
+            lines.append(
+                f"{function_name:<32} {point['memory']:>6} {point['p50_ms']:9.1f}"
+                f" {point['p95_ms']:9.1f} {point['max_ms']:9.1f}"
+                f" {point['cost_per_million']:9.2f} {chosen}"
+            )
+        lines.append(
+            f"{function_name}: MemorySize {result['memory_size']},"
+            f" Timeout {result['timeout']} (peak {result['peak_mb']:.0f} MB)."
+        )
+    return "\n".join(lines)
+
+
+def main():
+    args = getopts(sys.argv)
+    handler_benchmark.setup_environment(args)
+    with open(LAMBDA_CONFIG, "r") as f:
+        lambda_config = json.load(f)
+
+    functions = args.get("-functions", ",".join(FUNCTIONS.keys())).split(",")
+    mode = args.get("-mode", "local")
+    memories = [
+        int(m) for m in args.get("-memory", "128,256,512,1024,1769,3008").split(",")
+    ]
+    strategy = args.get("-strategy", "balanced")
+    price_gb_second = float(args.get("-price_gb_second", 0.0000166667))
+    price_request = float(args.get("-price_request", 0.0000002))
+    headroom = float(args.get("-headroom", 1.25))
+    timeout_factor = float(args.get("-timeout_factor", 3))
+
+    measurements = {}
+    if mode == "recorded":
+        for function_name in functions:
+            file_name = f"{args.get('-recorded', 'logs')}/{function_name}.log"
+            if not os.path.exists(file_name):
+                logger.warning(f"No recorded durations for {function_name}.")
+                continue
+            measurements[function_name] = read_recorded(file_name)
+    else:
+        cpu_scale = float(args.get("-cpu_scale", 1))
+        for function_name in functions:
+            # A process of its own, so every replay starts from a cold import,
+            # and one at a time, so no other replay competes for the CPU.
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                samples, peak_mb, errors = executor.submit(
+                    replay,
+                    function_name,
+                    load_events(args, function_name),
+                    int(args.get("-repeat", 20)),
+                    int(args.get("-warmup", 5)),
+                ).result()
+                if errors:
+                    logger.warning(f"{function_name}: {errors} invocations failed.")
+                measurements[function_name] = (
+                    {m: model_durations(samples, m, cpu_scale) for m in memories},
+                    peak_mb,
+                )
+
+    results = {}
+    for function_name, (durations, peak_mb) in measurements.items():
+        curve = build_curve(durations, price_gb_second, price_request)
+        memory_size, timeout = recommend(
+            curve,
+            strategy,
+            max(MIN_MEMORY_MB, peak_mb * headroom),
+            timeout_factor,
+        )
+        results[function_name] = {
+            "memory_size": memory_size,
+            "timeout": timeout,
+            "peak_mb": peak_mb,
+            "strategy": strategy,
+            "curve": curve,
+        }
+        if function_name in lambda_config["functions"]:
+            lambda_config["functions"][function_name]["memory_size"] = memory_size
+            lambda_config["functions"][function_name]["timeout"] = timeout
+
+    logger.info(format_results(results))
+    with open(args.get("-output", "power_tuning.json"), "w") as f:
+        json.dump(results, f, indent=4)
+    if args.get("-write", "false").lower() == "true":
+        with open(LAMBDA_CONFIG, "w", newline="\r\n") as f:
+            f.write(json.dumps(lambda_config, indent=4))
+        logger.info(f"Wrote the recommendations to {LAMBDA_CONFIG}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import base64
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB  # The smallest part size S3 accepts (except the last part).
+MAX_PARTS = 10000
+
+
+class MultipartUploader(object):
+    """Upload a file to S3 in concurrent, checksummed parts.
+
+    Each part is read from its own file handle and sent with its Content-MD5,
+    so S3 rejects a corrupted part instead of the whole object. The upload id
+    and acknowledged parts are kept in a state file next to the build cache,
+    saved as each part completes. The upload is tied to the content of the
+    file (the build digest, or its sha256), so an interrupted upload resumes
+    from the parts S3 already holds even when the zip was written again; a
+    part S3 lists but the state missed is kept when its ETag is the MD5 of
+    the local part. Files smaller than one part go out with put_object.
+    """
+
+    def __init__(self, s3_client, part_size=16 * MB, max_concurrency=8, state_dir="."):
+        self.s3_client = s3_client
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max(1, max_concurrency)
+        self.state_dir = state_dir
+
+    @staticmethod
+    def _md5(data):
+        return hashlib.md5(data).digest()
+
+    @staticmethod
+    def _sha256(file_name):
+        sha256 = hashlib.sha256()
+        with open(file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(MB), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _state_path(self, bucket, key):
+        return f"{self.state_dir}/{bucket}.{key.replace('/', '_')}.upload.json"
+
+    def _load_state(self, bucket, key, fingerprint):
+        try:
+            with open(self._state_path(bucket, key), "r") as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if state.get("fingerprint") != fingerprint:
+            self._abort(bucket, key, state.get("upload_id"))
+            return None
+        return state
+
+    def _save_state(self, bucket, key, state):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_file = f"{self._state_path(bucket, key)}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp_file, self._state_path(bucket, key))
+
+    def _clear_state(self, bucket, key):
+        if os.path.exists(self._state_path(bucket, key)):
+            os.remove(self._state_path(bucket, key))
+
+    def _abort(self, bucket, key, upload_id):
+        if upload_id is None:
+            return
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id
+            )
+        except ClientError:
+            pass
+
+    def _read_part(self, file_name, part_number, part_size):
+        with open(file_name, "rb") as f:
+            f.seek((part_number - 1) * part_size)
+            return f.read(part_size)
+
+    def _uploaded_parts(self, bucket, key, upload_id):
+        parts = {}
+        try:
+            paginator = self.s3_client.get_paginator("list_parts")
+            for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+                for part in page.get("Parts", []):
+                    parts[part["PartNumber"]] = part["ETag"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchUpload":
+                return None
+            raise
+        return parts
+
+    def _resumed_parts(self, file_name, part_size, state, uploaded):
+        """The parts of state that S3 still holds, and the parts S3 lists that
+        match the local file although the state did not record them."""
+        done = {}
+        for part_number, etag in uploaded.items():
+            part = state["parts"].get(str(part_number))
+            if part is not None and part["ETag"] == etag:
+                done[part_number] = part
+                continue
+            md5 = self._md5(self._read_part(file_name, part_number, part_size)).hex()
+            if etag.strip('"') == md5:
+                done[part_number] = {"ETag": etag, "MD5": md5}
+        return done
+
+    def _upload_part(self, file_name, bucket, key, upload_id, part_number, part_size):
+        data = self._read_part(file_name, part_number, part_size)
+        md5 = self._md5(data)
+        response = self.s3_client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ContentMD5=base64.b64encode(md5).decode("utf-8"),
+        )
+        return part_number, response["ETag"], md5.hex()
+
+    def upload(self, file_name, bucket, key, digest=None):
+        """Upload file_name to bucket/key and return the VersionId (or None
+        when the bucket is not versioned). digest identifies the content of
+        the file; without it the file is hashed to resume an upload."""
+        size = os.path.getsize(file_name)
+        if size <= self.part_size:
+            with open(file_name, "rb") as f:
+                data = f.read()
+            response = self.s3_client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=data,
+                ContentMD5=base64.b64encode(self._md5(data)).decode("utf-8"),
+            )
+            return response.get("VersionId")
+
+        part_size = max(self.part_size, -(-size // MAX_PARTS))
+        part_count = -(-size // part_size)
+        fingerprint = [digest or self._sha256(file_name), size, part_size]
+
+        state = self._load_state(bucket, key, fingerprint)
+        done = {}
+        if state is not None:
+            uploaded = self._uploaded_parts(bucket, key, state["upload_id"])
+            if uploaded is None:
+                state = None
+            else:
+                done = self._resumed_parts(file_name, part_size, state, uploaded)
+                logger.info(
+                    f"Resume the upload of {key} with {len(done)}/{part_count} parts."
+                )
+        if state is None:
+            upload_id = self.s3_client.create_multipart_upload(Bucket=bucket, Key=key)[
+                "UploadId"
+            ]
+            state = {"upload_id": upload_id, "fingerprint": fingerprint, "parts": {}}
+        upload_id = state["upload_id"]
+        state["parts"] = {str(n): part for n, part in done.items()}
+        self._save_state(bucket, key, state)
+
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [
+                executor.submit(
+                    self._upload_part,
+                    file_name,
+                    bucket,
+                    key,
+                    upload_id,
+                    part_number,
+                    part_size,
+                )
+                for part_number in range(1, part_count + 1)
+                if part_number not in done
+            ]
+            try:
+                for future in as_completed(futures):
+                    try:
+                        part_number, etag, md5 = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    done[part_number] = {"ETag": etag, "MD5": md5}
+                    # Every acknowledged part survives a kill from here on.
+                    state["parts"][str(part_number)] = done[part_number]
+                    self._save_state(bucket, key, state)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        if error is not None:
+            raise error
+
+        response = self.s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": n, "ETag": done[n]["ETag"]} for n in sorted(done)
+                ]
+            },
+        )
+        self._clear_state(bucket, key)
+        return response.get("VersionId")
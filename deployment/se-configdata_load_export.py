@@ -1,6 +1,7 @@
-import json, boto3, sys, os, logging, dotenv, csv, traceback
-from datetime import datetime, timedelta, date
-from decimal import Decimal
+import json, sys, os, logging, dotenv, csv, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import table_jobs
 
 
 # Look for a .env file
@@ -10,7 +11,9 @@ if os.path.exists(".env"):
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger()
 
-actions = ["load", "export"]
+actions = ["load", "export", "sync"]
+key_names = ["setting_id", "variable"]
+formats = ["csv", "parquet"]
 
 
 def Write_dict_to_csv(csv_file, csv_columns, dict_data):
@@ -37,6 +40,169 @@ def getopts(argv):
     return opts
 
 
+# Copy the rows listed in the CSV from the source to the target region; the
+# batched reads and the batched writes run at the same time. The rows are
+# copied in steps of step_size in the order of the CSV and the checkpoint only
+# keeps the watermark of the steps done, -resume true starts after it.
+def copy_configdata(src, tgt, file, max_workers=8, resume=False, step_size=1000):
+    checkpoint = table_jobs.Checkpoint(
+        "se-configdata.load.checkpoint.json",
+        {"src": src, "tgt": tgt, "file": file},
+        resume=resume,
+    )
+    getter = table_jobs.BatchGetter(
+        "se-configdata",
+        dynamodb_factory=lambda: table_jobs.new_dynamodb(src),
+        max_workers=max_workers,
+    )
+    writer = table_jobs.BatchWriter(
+        "se-configdata",
+        dynamodb_factory=lambda: table_jobs.new_dynamodb(tgt),
+        max_workers=max_workers,
+    )
+    requested = 0
+    with open(file, "r") as csv_file:
+        keys = (
+            {"setting_id": row["setting_id"], "variable": row["variable"]}
+            for row in csv.DictReader(csv_file)
+        )
+        for step, step_keys in enumerate(table_jobs.batched(keys, step_size)):
+            if checkpoint.is_acked("steps", step):
+                continue
+            writer.write(
+                {"PutRequest": {"Item": item}} for item in getter.get(step_keys)
+            )
+            requested += getter.requested
+            checkpoint.ack("steps", step)
+    checkpoint.remove()
+
+    logger.info(getter.meter.report())
+    logger.info(writer.meter.report())
+    if writer.meter.items < requested:
+        logger.warning(
+            f"{requested - writer.meter.items} rows of {file} are not found"
+            f" in se-configdata ({src})."
+        )
+
+
+# Snapshot the whole se-configdata of the source region, values included.
+def export_configdata(src, file_name, total_segments=4):
+    meter = table_jobs.ThroughputMeter("Export se-configdata")
+    writer = table_jobs.item_writer(file_name)
+    try:
+        table_jobs.parallel_scan(
+            lambda: table_jobs.new_dynamodb(src).Table("se-configdata"),
+            total_segments,
+            lambda segment, items, last_evaluated_key: writer.write(items),
+            meter=meter,
+        )
+    finally:
+        writer.close()
+    logger.info(meter.report())
+    logger.info(f"{file_name} is exported ({writer.count} items).")
+
+
+# Load a snapshot written by export_configdata into the target region.
+def load_configdata(tgt, file_name, max_workers=8, resume=False):
+    checkpoint = table_jobs.Checkpoint(
+        "se-configdata.load.checkpoint.json",
+        {"tgt": tgt, "file": file_name},
+        resume=resume,
+    )
+    writer = table_jobs.BatchWriter(
+        "se-configdata",
+        dynamodb_factory=lambda: table_jobs.new_dynamodb(tgt),
+        max_workers=max_workers,
+    )
+    writer.write(
+        ({"PutRequest": {"Item": item}} for item in table_jobs.iter_items(file_name)),
+        on_batch=lambda batch_number, batch: checkpoint.ack("batches", batch_number),
+        skip_batch=lambda batch_number: checkpoint.is_acked("batches", batch_number),
+    )
+    checkpoint.remove()
+    logger.info(writer.meter.report())
+
+
+# Make the target region match the source region: both tables are scanned in
+# parallel into {key: item hash}, only the rows that differ are read from the
+# source and written (or deleted) in the target. -dry_run true only writes the
+# diff report.
+def sync_configdata(
+    src, tgt, report_file, max_workers=8, total_segments=4, delete=True, dry_run=False
+):
+    hashes = {}
+
+    def scan(region_name):
+        return table_jobs.scan_hashes(
+            lambda: table_jobs.new_dynamodb(region_name).Table("se-configdata"),
+            key_names,
+            total_segments=total_segments,
+            meter=table_jobs.ThroughputMeter(f"Scan se-configdata ({region_name})"),
+        )
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {
+            region_name: executor.submit(scan, region_name)
+            for region_name in [src, tgt]
+        }
+        for region_name, future in futures.items():
+            hashes[region_name] = future.result()
+
+    inserts, updates, deletes = table_jobs.diff_hashes(hashes[src], hashes[tgt])
+    if not delete:
+        deletes = []
+    report = {
+        "src": src,
+        "tgt": tgt,
+        "src_items": len(hashes[src]),
+        "tgt_items": len(hashes[tgt]),
+        "unchanged": len(hashes[src]) - len(inserts) - len(updates),
+        "inserts": [list(key) for key in inserts],
+        "updates": [list(key) for key in updates],
+        "deletes": [list(key) for key in deletes],
+        "dry_run": dry_run,
+    }
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=4)
+
+    for action, keys in [
+        ("insert", inserts),
+        ("update", updates),
+        ("delete", deletes),
+    ]:
+        for setting_id, variable in keys:
+            logger.info(f"{action}: setting_id: {setting_id}/variable: {variable}")
+    logger.info(
+        f"{len(inserts)} inserts, {len(updates)} updates, {len(deletes)} deletes,"
+        f" {report['unchanged']} unchanged ({report_file})."
+    )
+    if dry_run:
+        return report
+
+    getter = table_jobs.BatchGetter(
+        "se-configdata",
+        dynamodb_factory=lambda: table_jobs.new_dynamodb(src),
+        max_workers=max_workers,
+    )
+    writer = table_jobs.BatchWriter(
+        "se-configdata",
+        dynamodb_factory=lambda: table_jobs.new_dynamodb(tgt),
+        max_workers=max_workers,
+    )
+
+    def requests():
+        keys = (dict(zip(key_names, key)) for key in inserts + updates)
+        for item in getter.get(keys):
+            yield {"PutRequest": {"Item": item}}
+        for key in deletes:
+            yield {"DeleteRequest": {"Key": dict(zip(key_names, key))}}
+
+    writer.write(requests())
+    logger.info(getter.meter.report())
+    logger.info(writer.meter.report())
+    return report
+
+
 def main():
     args = getopts(sys.argv)
     action = None
@@ -48,47 +214,45 @@ def main():
 
     src = args["-src"]
     tgt = args["-tgt"]
-    file = args["-file"]
-
-    src_dynamodb = boto3.resource(
-        "dynamodb",
-        region_name=src,
-        aws_access_key_id=os.getenv("aws_access_key_id"),
-        aws_secret_access_key=os.getenv("aws_secret_access_key"),
-    )
-
-    tgt_dynamodb = boto3.resource(
-        "dynamodb",
-        region_name=tgt,
-        aws_access_key_id=os.getenv("aws_access_key_id"),
-        aws_secret_access_key=os.getenv("aws_secret_access_key"),
-    )
-
-    if action == "export":
-        response = src_dynamodb.Table("se-configdata").scan()
-        items = response["Items"]
+    file = args.get("-file")
+    output_format = args.get("-format", "csv")
+    if output_format not in formats:
+        logger.error("Please input a format ({}).".format(formats))
+        sys.exit()
+    resume = args.get("-resume", "false").lower() == "true"
 
-        while "LastEvaluatedKey" in response:
-            response = src_dynamodb.Table("se-configdata").scan(
-                ExclusiveStartKey=response["LastEvaluatedKey"]
-            )
-            items = response["Items"]
+    if action == "export" and output_format == "parquet":
+        export_configdata(src, "se-configdata.parquet")
+    elif action == "export":
+        items = []
+        table_jobs.parallel_scan(
+            lambda: table_jobs.new_dynamodb(src).Table("se-configdata"),
+            4,
+            lambda segment, page, last_evaluated_key: items.extend(page),
+        )
 
         for item in items:
             item.pop("value")
 
         Write_dict_to_csv("se-configdata.csv", items[0].keys(), items)
+    elif action == "load" and output_format == "parquet":
+        load_configdata(
+            tgt, file, max_workers=int(args.get("-workers", 8)), resume=resume
+        )
     elif action == "load":
-        with open(file, "r") as csv_file:
-            for row in csv.DictReader(csv_file):
-                item = src_dynamodb.Table("se-configdata").get_item(
-                    Key={"setting_id": row["setting_id"], "variable": row["variable"]}
-                )
-                data = item["Item"]
-                tgt_dynamodb.Table("se-configdata").put_item(Item=data)
-                logger.info(
-                    f"setting_id: {data['setting_id']}/variable: {data['variable']}"
-                )
+        copy_configdata(
+            src, tgt, file, max_workers=int(args.get("-workers", 8)), resume=resume
+        )
+    elif action == "sync":
+        sync_configdata(
+            src,
+            tgt,
+            args.get("-report", "se-configdata.sync.json"),
+            max_workers=int(args.get("-workers", 8)),
+            total_segments=int(args.get("-segments", 4)),
+            delete=args.get("-delete", "true").lower() == "true",
+            dry_run=args.get("-dry_run", "false").lower() == "true",
+        )
     else:
         logger.info("The action ({action}) is not supported.".format(action=action))
 
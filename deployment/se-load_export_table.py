@@ -1,6 +1,6 @@
-import json, boto3, sys, os, logging, dotenv
-from datetime import datetime, timedelta, date
-from decimal import Decimal
+import sys, os, logging, dotenv
+
+import table_jobs
 
 
 # Look for a .env file
@@ -11,6 +11,7 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger()
 
 actions = ["load", "export"]
+formats = ["json", "ndjson", "parquet"]
 tables = [
     "se-endpoints",
     "se-connections",
@@ -18,28 +19,6 @@ tables = [
     "dw-product_metadata",
 ]
 
-dynamodb = boto3.resource(
-    "dynamodb",
-    region_name=os.getenv("region_name"),
-    aws_access_key_id=os.getenv("aws_access_key_id"),
-    aws_secret_access_key=os.getenv("aws_secret_access_key"),
-)
-
-# Helper class to convert a DynamoDB item to JSON.
-class JSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, Decimal):
-            if o % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
-        elif isinstance(o, (datetime, date)):
-            return o.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(o, (bytes, bytearray)):
-            return str(o)
-        else:
-            return super(JSONEncoder, self).default(o)
-
 
 def getopts(argv):
     opts = {}  # Empty dictionary to store key-value pairs.
@@ -50,6 +29,120 @@ def getopts(argv):
     return opts
 
 
+# Load a JSON array, NDJSON or Parquet file with batched writes from a worker pool.
+# Acknowledged batches are checkpointed, -resume true skips them on a rerun.
+def load_table(table, file_name, max_workers=8, resume=False):
+    checkpoint = table_jobs.Checkpoint(
+        f"{table}.load.checkpoint.json",
+        {"table": table, "file": file_name},
+        resume=resume,
+    )
+    writer = table_jobs.BatchWriter(table, max_workers=max_workers)
+    batches = writer.write(
+        ({"PutRequest": {"Item": item}} for item in table_jobs.iter_items(file_name)),
+        on_batch=lambda batch_number, batch: checkpoint.ack("batches", batch_number),
+        skip_batch=lambda batch_number: checkpoint.is_acked("batches", batch_number),
+    )
+    checkpoint.remove()
+    logger.info(writer.meter.report())
+    logger.info(
+        f"{file_name} is imported ({batches} batches, {writer.retries} retries,"
+        f" {writer.throttle.throttled} throttled requests)."
+    )
+
+
+# Export the table with a parallel scan, streaming every page to the output.
+# With shards each segment writes its own {table}.{segment}.{format} file
+# (json shards are written as ndjson). The LastEvaluatedKey of every segment
+# and the offset of every file are checkpointed together, -resume true
+# truncates the files to the checkpoint and continues each segment from there.
+def export_table(
+    table,
+    output_format="json",
+    total_segments=8,
+    max_workers=None,
+    shards=False,
+    row_group_size=10000,
+    lossless=False,
+    resume=False,
+):
+    meter = table_jobs.ThroughputMeter(f"Export {table}")
+    if shards:
+        extension = "ndjson" if output_format == "json" else output_format
+        file_names = [
+            f"{table}.{segment:04d}.{extension}" for segment in range(total_segments)
+        ]
+    else:
+        file_names = [f"{table}.{output_format}"]
+    if resume and output_format == "parquet":
+        logger.error("A Parquet export cannot be resumed.")
+        sys.exit()
+
+    checkpoint = table_jobs.Checkpoint(
+        f"{table}.export.checkpoint.json",
+        {"table": table, "files": file_names, "segments": total_segments},
+        resume=resume,
+    )
+    writers = [
+        table_jobs.item_writer(
+            file_name,
+            lossless=lossless,
+            row_group_size=row_group_size,
+            resume=checkpoint.get("files", file_name),
+        )
+        for file_name in file_names
+    ]
+    start_keys = {}
+    for segment in range(total_segments):
+        progress = checkpoint.get("segments", segment)
+        if progress is None:
+            start_keys[segment] = None
+        elif not progress["done"]:
+            start_keys[segment] = checkpoint.decode_key(progress["last_evaluated_key"])
+
+    def on_page(segment, items, last_evaluated_key):
+        writer = writers[segment if shards else 0]
+
+        def on_written(offset, count):
+            checkpoint.update(
+                "files",
+                writer.file_name,
+                {"offset": offset, "count": count},
+                save=False,
+            )
+            checkpoint.update(
+                "segments",
+                segment,
+                {
+                    "last_evaluated_key": checkpoint.encode_key(last_evaluated_key),
+                    "done": last_evaluated_key is None,
+                },
+            )
+
+        if output_format == "parquet":
+            writer.write(items)
+        else:
+            writer.write(items, on_written=on_written)
+
+    try:
+        table_jobs.parallel_scan(
+            lambda: table_jobs.new_dynamodb().Table(table),
+            total_segments,
+            on_page,
+            max_workers=max_workers,
+            meter=meter,
+            start_keys=start_keys,
+        )
+    finally:
+        for writer in writers:
+            writer.close()
+    checkpoint.remove()
+
+    logger.info(meter.report())
+    for writer in writers:
+        logger.info(f"{writer.file_name} is exported ({writer.count} items).")
+
+
 def main():
     args = getopts(sys.argv)
     action = None
@@ -65,26 +158,31 @@ def main():
     else:
         table = args["-table"]
 
-    if action == "load":
-        with open("{table}.json".format(table=table)) as f:
-            for item in json.load(f):
-                logger.info(item)
-                response = dynamodb.Table(table).put_item(Item=item)
-                logger.info(response)
-            logger.info("{table}.json is imported.".format(table=table))
-    elif action == "export":
-        response = dynamodb.Table(table).scan()
-        items = response["Items"]
+    output_format = args.get("-format", "json")
+    if output_format not in formats:
+        logger.error("Please input a format ({}).".format(formats))
+        sys.exit()
 
-        while "LastEvaluatedKey" in response:
-            response = dynamodb.Table(table).scan(
-                ExclusiveStartKey=response["LastEvaluatedKey"]
-            )
-            items = response["Items"]
+    resume = args.get("-resume", "false").lower() == "true"
 
-        with open("{table}.json".format(table=table), "w") as outfile:
-            json.dump(items, outfile, indent=4, cls=JSONEncoder)
-            logger.info("{table}.json is exported.".format(table=table))
+    if action == "load":
+        load_table(
+            table,
+            args.get("-file", f"{table}.{output_format}"),
+            max_workers=int(args.get("-workers", 8)),
+            resume=resume,
+        )
+    elif action == "export":
+        export_table(
+            table,
+            output_format=output_format,
+            total_segments=int(args.get("-segments", 8)),
+            max_workers=int(args["-workers"]) if "-workers" in args.keys() else None,
+            shards=args.get("-shards", "false").lower() == "true",
+            row_group_size=int(args.get("-row_group_size", 10000)),
+            lossless=args.get("-lossless", "false").lower() == "true",
+            resume=resume,
+        )
     else:
         logger.info("The action ({action}) is not supported.".format(action=action))
 
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging
+from time import sleep
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+THROTTLING_ERRORS = ["Throttling", "ThrottlingException", "RequestLimitExceeded"]
+
+
+class StackMonitor(object):
+    """Follow a stack operation through describe_stack_events.
+
+    Only the events after last_event_id are fetched on every poll (events come
+    newest first, so paging stops at the last one seen). The poll interval
+    starts at min_interval, grows by backoff while nothing happens and drops
+    back as soon as a new event arrives.
+    """
+
+    def __init__(
+        self,
+        cloudformation,
+        stack_name,
+        min_interval=1.0,
+        max_interval=15.0,
+        label=None,
+    ):
+        self.cloudformation = cloudformation
+        self.stack_name = stack_name
+        # Tells the events of concurrent stacks apart in the log.
+        self.label = label or stack_name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = 1.5
+        self.last_event_id = None
+        self.api_calls = 0
+        self.events = []
+        self.resources = {}
+
+    def _describe_stack_events(self, **kwargs):
+        self.api_calls += 1
+        return self.cloudformation.describe_stack_events(
+            StackName=self.stack_name, **kwargs
+        )
+
+    def mark(self):
+        """Remember the latest event of the stack; call it right before the
+        update so that the events of earlier operations are skipped."""
+        try:
+            events = self._describe_stack_events()["StackEvents"]
+        except ClientError as e:
+            if "does not exist" in e.response["Error"]["Message"]:
+                self.last_event_id = None
+                return None
+            raise
+        self.last_event_id = events[0]["EventId"] if events else None
+        return self.last_event_id
+
+    def poll(self):
+        """Return the events since the last poll, oldest first."""
+        events = []
+        kwargs = {}
+        while True:
+            response = self._describe_stack_events(**kwargs)
+            for event in response["StackEvents"]:
+                if event["EventId"] == self.last_event_id:
+                    break
+                events.append(event)
+            else:
+                if response.get("NextToken"):
+                    kwargs["NextToken"] = response["NextToken"]
+                    continue
+            break
+
+        if events:
+            self.last_event_id = events[0]["EventId"]
+        events.reverse()
+        return events
+
+    def _track(self, event):
+        resource = self.resources.setdefault(
+            event["LogicalResourceId"],
+            {
+                "type": event["ResourceType"],
+                "started": None,
+                "finished": None,
+                "status": None,
+                "reason": None,
+            },
+        )
+        status = event["ResourceStatus"]
+        if status.endswith("_IN_PROGRESS") and resource["started"] is None:
+            resource["started"] = event["Timestamp"]
+        elif not status.endswith("_IN_PROGRESS"):
+            resource["finished"] = event["Timestamp"]
+        resource["status"] = status
+        if event.get("ResourceStatusReason"):
+            resource["reason"] = event["ResourceStatusReason"]
+
+    def _is_stack_done(self, event):
+        return (
+            event["ResourceType"] == "AWS::CloudFormation::Stack"
+            and event["LogicalResourceId"] == self.stack_name
+            and not event["ResourceStatus"].endswith("_IN_PROGRESS")
+        )
+
+    def wait(self):
+        """Log every resource event as it happens until the stack operation
+        ends and return the final stack status."""
+        interval = self.min_interval
+        while True:
+            try:
+                events = self.poll()
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                    raise
+                events = []
+
+            status = None
+            for event in events:
+                self.events.append(event)
+                self._track(event)
+                reason = event.get("ResourceStatusReason") or ""
+                logger.info(
+                    f"{self.label} {event['Timestamp']:%H:%M:%S}"
+                    f" {event['LogicalResourceId']:<40}"
+                    f" {event['ResourceType']:<35} {event['ResourceStatus']} {reason}"
+                )
+                if self._is_stack_done(event):
+                    status = event["ResourceStatus"]
+            if status is not None:
+                return status
+
+            interval = (
+                self.min_interval
+                if events
+                else min(interval * self.backoff, self.max_interval)
+            )
+            sleep(interval)
+
+    def failures(self):
+        return [
+            (name, resource["status"], resource["reason"])
+            for name, resource in self.resources.items()
+            if resource["status"] is not None
+            and "FAILED" in resource["status"]
+            and resource["reason"]
+        ]
+
+    def timeline(self, width=40):
+        """One line per resource: its duration and a bar placed on the time
+        axis of the whole operation, in start order."""
+        resources = [
+            (name, resource)
+            for name, resource in self.resources.items()
+            if resource["started"] is not None
+        ]
+        if not resources:
+            return ""
+        origin = min(resource["started"] for name, resource in resources)
+        end = max(
+            resource["finished"] or resource["started"] for name, resource in resources
+        )
+        total = max((end - origin).total_seconds(), 1)
+
+        lines = [f"{'resource':<40} {'type':<35} {'seconds':>8}"]
+        for name, resource in sorted(resources, key=lambda item: item[1]["started"]):
+            finished = resource["finished"] or resource["started"]
+            offset = (resource["started"] - origin).total_seconds()
+            seconds = (finished - resource["started"]).total_seconds()
+            start = min(int(offset / total * width), width - 1)
+            length = min(max(int(seconds / total * width), 1), width - start)
+            lines.append(
+                f"{name:<40} {resource['type']:<35} {seconds:8.0f}"
+                f" |{' ' * start}{'#' * length}{' ' * (width - start - length)}|"
+            )
+        lines.append(
+            f"{self.label} took {total:.0f}s,"
+            f" {self.api_calls} describe_stack_events calls."
+        )
+        return "\n".join(lines)
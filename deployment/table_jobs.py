@@ -0,0 +1,637 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+
+import boto3
+import dynamodb_codec
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+
+def new_dynamodb(region_name=None):
+    """A DynamoDB resource on its own session; boto3 resources must not be
+    shared between threads. endpoint_url points it at a local stand-in such as
+    DynamoDB Local or moto server."""
+    return boto3.session.Session().resource(
+        "dynamodb",
+        region_name=region_name or os.getenv("region_name"),
+        aws_access_key_id=os.getenv("aws_access_key_id"),
+        aws_secret_access_key=os.getenv("aws_secret_access_key"),
+        endpoint_url=os.getenv("endpoint_url"),
+    )
+
+
+class ThroughputMeter(object):
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.capacity_units = 0.0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, items, consumed_capacity=None):
+        with self._lock:
+            self.items += items
+            if consumed_capacity:
+                self.capacity_units += consumed_capacity.get("CapacityUnits", 0)
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.name}: {self.items} items in {elapsed:.2f}s"
+            f" ({self.items / elapsed:.1f} items/s),"
+            f" {self.capacity_units:.1f} capacity units"
+            f" ({self.capacity_units / elapsed:.1f} units/s)."
+        )
+
+
+class JsonItemWriter(object):
+    """Stream items to a file as they arrive instead of holding the table in
+    memory. ndjson writes one item per line; json writes a JSON array that the
+    load action reads back. lossless writes DynamoDB JSON (see dynamodb_codec).
+    Writers are safe to share between threads.
+
+    resume={"offset": ..., "count": ...} reopens a file written by an
+    interrupted job and truncates it to the last checkpointed offset.
+    """
+
+    def __init__(self, file_name, lossless=False, ndjson=True, resume=None):
+        self.file_name = file_name
+        self.lossless = lossless
+        self.ndjson = ndjson
+        self._lock = threading.Lock()
+        if resume is not None:
+            self.count = resume["count"]
+            self._file = open(file_name, "r+b")
+            self._file.truncate(resume["offset"])
+            self._file.seek(resume["offset"])
+        else:
+            self.count = 0
+            self._file = open(file_name, "wb")
+            if not ndjson:
+                self._file.write(b"[")
+
+    def write(self, items, on_written=None):
+        """Append items; on_written(offset, count) is called under the writer
+        lock once they are flushed, so a checkpoint never runs ahead of the
+        file."""
+        lines = [dynamodb_codec.encode_item(item, self.lossless) for item in items]
+        with self._lock:
+            if lines:
+                if self.ndjson:
+                    data = "\n".join(lines) + "\n"
+                else:
+                    data = ("," if self.count else "") + "\n" + ",\n".join(lines)
+                self._file.write(data.encode("utf-8"))
+                self._file.flush()
+                self.count += len(lines)
+            if on_written is not None:
+                on_written(self._file.tell(), self.count)
+
+    def close(self):
+        if not self.ndjson:
+            self._file.write(b"\n]\n")
+        self._file.close()
+
+
+class Checkpoint(object):
+    """State of an export or load job, saved to a local JSON file after every
+    acknowledged step so that the job can be resumed with -resume true.
+
+    params describe the job; a checkpoint is only resumed by the same job.
+    Numbered steps (batches) are tracked as a contiguous watermark plus the
+    few acknowledged out of order.
+    """
+
+    def __init__(self, file_name, params, resume=False):
+        self.file_name = file_name
+        self.resumed = resume
+        self._lock = threading.RLock()
+        if resume:
+            with open(file_name, "r") as f:
+                self.state = json.load(f)
+            if self.state["params"] != params:
+                raise Exception(
+                    f"{file_name} was written for another job"
+                    f" ({self.state['params']})."
+                )
+        else:
+            self.state = {"params": params}
+
+    def save(self):
+        with self._lock:
+            tmp_file = f"{self.file_name}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_file, self.file_name)
+
+    def update(self, section, key, value, save=True):
+        with self._lock:
+            self.state.setdefault(section, {})[str(key)] = value
+            if save:
+                self.save()
+
+    def get(self, section, key=None, default=None):
+        with self._lock:
+            values = self.state.get(section, {})
+            return values if key is None else values.get(str(key), default)
+
+    def ack(self, section, number):
+        with self._lock:
+            steps = self.state.setdefault(section, {"watermark": -1, "acked": []})
+            acked = set(steps["acked"])
+            acked.add(number)
+            while steps["watermark"] + 1 in acked:
+                steps["watermark"] += 1
+                acked.remove(steps["watermark"])
+            steps["acked"] = sorted(acked)
+            self.save()
+
+    def is_acked(self, section, number):
+        with self._lock:
+            steps = self.state.get(section, {"watermark": -1, "acked": []})
+            return number <= steps["watermark"] or number in steps["acked"]
+
+    def remove(self):
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    @staticmethod
+    def encode_key(key):
+        if key is None:
+            return None
+        return {name: dynamodb_codec.to_typed(value) for name, value in key.items()}
+
+    @staticmethod
+    def decode_key(key):
+        if key is None:
+            return None
+        return {name: dynamodb_codec.from_typed(value) for name, value in key.items()}
+
+
+def item_writer(file_name, lossless=False, row_group_size=10000, resume=None):
+    """Open the writer for the format given by the extension of file_name
+    (.json, .ndjson or .parquet)."""
+    if file_name.endswith(".parquet"):
+        if resume is not None:
+            raise Exception(
+                f"{file_name} cannot be resumed, Parquet files are not appendable."
+            )
+        import parquet_format
+
+        return parquet_format.ParquetItemWriter(
+            file_name, row_group_size=row_group_size
+        )
+    return JsonItemWriter(
+        file_name, lossless, ndjson=file_name.endswith(".ndjson"), resume=resume
+    )
+
+
+def iter_items(file_name):
+    if file_name.endswith(".parquet"):
+        import parquet_format
+
+        return parquet_format.iter_parquet_items(file_name)
+    return iter_json_items(file_name)
+
+
+def parallel_scan(
+    table_factory,
+    total_segments,
+    on_page,
+    max_workers=None,
+    meter=None,
+    start_keys=None,
+    **kwargs,
+):
+    """Scan a table with total_segments parallel segments.
+
+    table_factory() returns the Table for the calling worker thread; every
+    page of items is handed to on_page(segment, items, last_evaluated_key)
+    as soon as it is read. start_keys resumes the scan: it maps a segment to
+    the ExclusiveStartKey to continue from, segments missing from it are
+    considered finished.
+    """
+    if start_keys is None:
+        start_keys = {segment: None for segment in range(total_segments)}
+
+    def scan_segment(segment):
+        table = table_factory()
+        scan_kwargs = dict(
+            kwargs,
+            Segment=segment,
+            TotalSegments=total_segments,
+            ReturnConsumedCapacity="TOTAL",
+        )
+        if start_keys[segment] is not None:
+            scan_kwargs["ExclusiveStartKey"] = start_keys[segment]
+        while True:
+            response = table.scan(**scan_kwargs)
+            if meter is not None:
+                meter.add(len(response["Items"]), response.get("ConsumedCapacity"))
+            on_page(segment, response["Items"], response.get("LastEvaluatedKey"))
+            if "LastEvaluatedKey" not in response:
+                return
+            scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    if len(start_keys) == 0:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers or len(start_keys)) as executor:
+        futures = [executor.submit(scan_segment, segment) for segment in start_keys]
+        for future in as_completed(futures):
+            future.result()
+
+
+# Whitespace and the commas between the items of a JSON array.
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_json_items(file_name, chunk_size=1024 * 1024):
+    """Yield the items of an NDJSON file or a JSON array file one at a time,
+    in either mode of dynamodb_codec."""
+    with open(file_name, "r") as f:
+        head = f.read(chunk_size)
+        while head.isspace():
+            chunk = f.read(chunk_size)
+            if chunk == "":
+                break
+            head += chunk
+        if not head.lstrip().startswith("["):
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield dynamodb_codec.decode(line)
+            return
+        for item in iter_json_array(f, head, chunk_size):
+            yield dynamodb_codec.decode_item(item)
+
+
+def iter_json_array(f, buffer, chunk_size):
+    # Decode in place from an index into the buffer, which is only cut down
+    # to its undecoded tail when the next chunk is appended.
+    decoder = dynamodb_codec.decoder
+    idx, eof = buffer.index("[") + 1, False
+    while True:
+        idx = SEPARATORS.match(buffer, idx).end()
+        if idx < len(buffer):
+            if buffer[idx] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, idx)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number at the end of the buffer may still be cut off.
+                if end < len(buffer) or eof or isinstance(item, dict):
+                    yield item
+                    idx = end
+                    continue
+        elif eof:
+            raise ValueError(f"Unterminated JSON array in {f.name}.")
+        chunk = f.read(chunk_size)
+        eof = chunk == ""
+        buffer, idx = buffer[idx:] + chunk, 0
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class AdaptiveThrottle(object):
+    """Bound the number of requests in flight; halve the bound when DynamoDB
+    throttles and grow it back by one after every `recovery` clean requests."""
+
+    def __init__(self, max_concurrency, recovery=20):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.recovery = recovery
+        self.in_flight = 0
+        self.throttled = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self._successes = 0
+                self.limit = max(1, self.limit // 2)
+            else:
+                self._successes += 1
+                if (
+                    self._successes >= self.recovery
+                    and self.limit < self.max_concurrency
+                ):
+                    self._successes = 0
+                    self.limit += 1
+            self._condition.notify_all()
+
+
+THROTTLING_ERRORS = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+)
+
+
+def backoff(attempt, base=0.05, cap=20.0):
+    # Full jitter exponential backoff.
+    time.sleep(random.uniform(0, min(cap, base * 2**attempt)))
+
+
+class BatchWriter(object):
+    """Write items with 25-item BatchWriteItem requests from a worker pool.
+
+    UnprocessedItems are retried with jittered exponential backoff and every
+    throttled request narrows the concurrency through AdaptiveThrottle.
+    """
+
+    BATCH_SIZE = 25
+
+    def __init__(
+        self,
+        table_name,
+        dynamodb_factory=new_dynamodb,
+        max_workers=8,
+        max_retries=10,
+        meter=None,
+    ):
+        self.table_name = table_name
+        self.dynamodb_factory = dynamodb_factory
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.meter = meter or ThroughputMeter(f"Load {table_name}")
+        self.throttle = AdaptiveThrottle(max_workers)
+        self.retries = 0
+        self._local = threading.local()
+
+    def _dynamodb(self):
+        if not hasattr(self._local, "dynamodb"):
+            self._local.dynamodb = self.dynamodb_factory()
+        return self._local.dynamodb
+
+    def write_batch(self, requests):
+        """Send one batch of write requests ({"PutRequest": ...} or
+        {"DeleteRequest": ...}) until DynamoDB has processed all of them."""
+        request_items = {self.table_name: requests}
+        attempt = 0
+        while request_items:
+            unprocessed = {}
+            self.throttle.acquire()
+            try:
+                try:
+                    response = self._dynamodb().batch_write_item(
+                        RequestItems=request_items, ReturnConsumedCapacity="TOTAL"
+                    )
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                        raise
+                    response = {"UnprocessedItems": request_items}
+                # Unprocessed items are DynamoDB pushing back as well.
+                unprocessed = response.get("UnprocessedItems") or {}
+            finally:
+                # Whatever was raised, the slot goes back to the pool.
+                self.throttle.release(throttled=bool(unprocessed))
+
+            processed = len(request_items[self.table_name]) - len(
+                unprocessed.get(self.table_name, [])
+            )
+            for consumed_capacity in response.get("ConsumedCapacity", []):
+                self.meter.add(0, consumed_capacity)
+            self.meter.add(processed)
+
+            request_items = unprocessed
+            if request_items:
+                if attempt >= self.max_retries:
+                    raise Exception(
+                        f"{len(request_items[self.table_name])} items of "
+                        f"{self.table_name} are still unprocessed after "
+                        f"{attempt} retries."
+                    )
+                self.retries += 1
+                backoff(attempt)
+                attempt += 1
+
+    def write(self, requests, on_batch=None, skip_batch=None, progress_every=100):
+        """Write all requests and return the number of batches sent.
+
+        on_batch(batch_number, batch) is called after each batch is
+        acknowledged; batches for which skip_batch(batch_number) is true are
+        counted but not sent again (used to resume a job).
+        """
+        futures = {}
+        batch_number = -1
+        sent = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch in batched(requests, self.BATCH_SIZE):
+                batch_number += 1
+                if skip_batch is not None and skip_batch(batch_number):
+                    continue
+                # Keep the queue short so the input is parsed as it is written.
+                while len(futures) >= self.max_workers * 2:
+                    done = next(as_completed(futures))
+                    self._finish(done, futures, on_batch, progress_every)
+                futures[executor.submit(self.write_batch, batch)] = (
+                    batch_number,
+                    batch,
+                )
+                sent += 1
+            while futures:
+                done = next(as_completed(futures))
+                self._finish(done, futures, on_batch, progress_every)
+        return sent
+
+    def _finish(self, future, futures, on_batch, progress_every):
+        batch_number, batch = futures.pop(future)
+        future.result()
+        if on_batch is not None:
+            on_batch(batch_number, batch)
+        if (batch_number + 1) % progress_every == 0:
+            logger.info(self.meter.report())
+
+
+class BatchGetter(object):
+    """Read items by key with 100-key BatchGetItem requests from a worker pool.
+
+    get() returns a generator fed through a bounded queue, so the caller can
+    write the items while later batches are still being read.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(
+        self,
+        table_name,
+        dynamodb_factory=new_dynamodb,
+        max_workers=4,
+        max_retries=10,
+        queue_size=1000,
+        meter=None,
+    ):
+        self.table_name = table_name
+        self.dynamodb_factory = dynamodb_factory
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.queue_size = queue_size
+        self.meter = meter or ThroughputMeter(f"Read {table_name}")
+        self.requested = 0
+        self.retries = 0
+        self._local = threading.local()
+
+    def _dynamodb(self):
+        if not hasattr(self._local, "dynamodb"):
+            self._local.dynamodb = self.dynamodb_factory()
+        return self._local.dynamodb
+
+    def get_batch(self, keys):
+        request_items = {self.table_name: {"Keys": keys}}
+        items = []
+        attempt = 0
+        while request_items:
+            try:
+                response = self._dynamodb().batch_get_item(
+                    RequestItems=request_items, ReturnConsumedCapacity="TOTAL"
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in THROTTLING_ERRORS:
+                    raise
+                response = {"UnprocessedKeys": request_items}
+
+            found = response.get("Responses", {}).get(self.table_name, [])
+            items.extend(found)
+            consumed_capacity = response.get("ConsumedCapacity", [])
+            self.meter.add(
+                len(found), consumed_capacity[0] if consumed_capacity else None
+            )
+
+            request_items = response.get("UnprocessedKeys") or {}
+            if request_items:
+                if attempt >= self.max_retries:
+                    raise Exception(
+                        f"{len(request_items[self.table_name]['Keys'])} keys of "
+                        f"{self.table_name} are still unprocessed after "
+                        f"{attempt} retries."
+                    )
+                self.retries += 1
+                backoff(attempt)
+                attempt += 1
+        return items
+
+    def _unique_batches(self, keys):
+        seen = set()
+        unique = []
+        for key in keys:
+            marker = tuple(sorted(key.items()))
+            if marker in seen:
+                continue
+            seen.add(marker)
+            unique.append(key)
+        self.requested = len(unique)
+        return batched(unique, self.BATCH_SIZE)
+
+    def get(self, keys):
+        results = queue.Queue(maxsize=self.queue_size)
+        done = object()
+
+        def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = [
+                        executor.submit(self.get_batch, batch)
+                        for batch in self._unique_batches(keys)
+                    ]
+                    for future in as_completed(futures):
+                        for item in future.result():
+                            results.put(item)
+                results.put(done)
+            except Exception as e:
+                results.put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        producer.join()
+
+
+def _canonical(value):
+    if isinstance(value, Decimal):
+        return {"N": str(value.normalize())}
+    if isinstance(value, (bytes, bytearray)) or hasattr(value, "value"):
+        data = bytes(getattr(value, "value", value))
+        return {"B": base64.b64encode(data).decode("utf-8")}
+    if isinstance(value, (set, frozenset)):
+        return {"SET": sorted(json.dumps(_canonical(v)) for v in value)}
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def item_hash(item):
+    """A hash of the canonical form of an item: equal items hash the same
+    regardless of attribute order, set order or number formatting."""
+    canonical = json.dumps(_canonical(item), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def scan_hashes(table_factory, key_names, total_segments=4, meter=None):
+    """Map the key of every item of a table to its item_hash with a parallel
+    scan, without keeping the items themselves."""
+    hashes = {}
+    lock = threading.Lock()
+
+    def on_page(segment, items, last_evaluated_key):
+        page = {tuple(item[k] for k in key_names): item_hash(item) for item in items}
+        with lock:
+            hashes.update(page)
+
+    parallel_scan(table_factory, total_segments, on_page, meter=meter)
+    return hashes
+
+
+def diff_hashes(source, target):
+    """Return the keys to insert, update and delete to turn target into source."""
+    inserts = sorted(key for key in source if key not in target)
+    updates = sorted(
+        key for key in source if key in target and source[key] != target[key]
+    )
+    deletes = sorted(key for key in target if key not in source)
+    return inserts, updates, deletes
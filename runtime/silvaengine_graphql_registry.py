@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Persisted queries and a cache of validated documents for graphene 2.
+
+install() makes RegistryBackend the default backend of graphql-core, which
+every schema.execute() goes through:
+
+- a query that is the sha256 (64 hex digits) of a document registered with
+  deployment/export_graphql_registry.py is served from the registry files
+  (*.graphql_registry.json in GRAPHQLREGISTRYPATH, by default the function
+  and layer roots); it was validated at deploy time against the same schema,
+  so it is parsed once per container and never validated;
+- any other query is parsed and validated once and kept, with its schema, in
+  an LRU of GRAPHQLDOCUMENTCACHESIZE documents; invalid queries are not kept.
+
+GRAPHQLREGISTRY=off leaves the default backend alone.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from functools import partial
+
+logger = logging.getLogger()
+
+QUERY_HASH = re.compile(r"^[0-9a-f]{64}$")
+REGISTRY_SUFFIX = ".graphql_registry.json"
+
+
+def query_hash(document_string):
+    return hashlib.sha256(document_string.encode("utf-8")).hexdigest()
+
+
+def schema_hash(schema):
+    """The sha256 of the printed schema, what the registry was validated on."""
+    return hashlib.sha256(str(schema).encode("utf-8")).hexdigest()
+
+
+def load_registry(paths):
+    """Merge the queries of the registry files found in paths."""
+    queries = {}
+    for path in paths:
+        pattern = os.path.join(path, f"*{REGISTRY_SUFFIX}")
+        for file_name in sorted(glob.glob(pattern)):
+            with open(file_name, "r") as f:
+                registry = json.load(f)
+            for key, query in registry["queries"].items():
+                queries[key] = dict(query, schema_hash=registry["schema_hash"])
+    return queries
+
+
+try:
+    from graphql import parse, validate
+    from graphql.backend import GraphQLCoreBackend, GraphQLDocument
+    from graphql.execution import ExecutionResult, execute
+    from graphql.error import GraphQLError
+except ImportError:
+    GraphQLCoreBackend = object
+
+
+class RegistryBackend(GraphQLCoreBackend):
+    def __init__(self, paths, max_size=256, executor=None):
+        super(RegistryBackend, self).__init__(executor=executor)
+        self.paths = paths
+        self.max_size = max_size
+        self._queries = None
+        # Keyed by the schema itself: an id() can be reused by a new schema
+        # once the old one is collected, and must never match its entries.
+        self._schema_hashes = weakref.WeakKeyDictionary()
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "persisted_hits": 0,
+            "persisted_misses": 0,
+            "invalid": 0,
+        }
+
+    @property
+    def queries(self):
+        if self._queries is None:
+            self._queries = load_registry(self.paths)
+            logger.info(f"Loaded {len(self._queries)} persisted GraphQL queries.")
+        return self._queries
+
+    def _schema_hash(self, schema):
+        with self._lock:
+            value = self._schema_hashes.get(schema)
+        if value is None:
+            value = schema_hash(schema)
+            with self._lock:
+                self._schema_hashes[schema] = value
+        return value
+
+    def _error(self, message):
+        return GraphQLDocument(
+            schema=None,
+            document_string=None,
+            document_ast=None,
+            execute=lambda *args, **kwargs: ExecutionResult(
+                errors=[GraphQLError(message)], invalid=True
+            ),
+        )
+
+    def _compile(self, schema, document_string, validated):
+        document_ast = parse(document_string)
+        if not validated:
+            errors = validate(schema, document_ast)
+            if errors:
+                return None, ExecutionResult(errors=errors, invalid=True)
+        return (
+            GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=partial(
+                    execute, schema, document_ast, **self.execute_params
+                ),
+            ),
+            None,
+        )
+
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super(RegistryBackend, self).document_from_string(
+                schema, document_string
+            )
+
+        persisted = QUERY_HASH.match(document_string) is not None
+        key = (
+            id(schema),
+            document_string if persisted else query_hash(document_string),
+        )
+        with self._lock:
+            document = self._documents.get(key)
+            # The key holds the id() of the schema; the document holds the
+            # schema itself, which tells a reused id() apart.
+            if document is not None and document.schema is not schema:
+                del self._documents[key]
+                document = None
+            if document is not None:
+                self._documents.move_to_end(key)
+                self.counters["persisted_hits" if persisted else "hits"] += 1
+                return document
+
+        validated = False
+        if persisted:
+            query = self.queries.get(document_string)
+            if query is None:
+                return self._error(f"Unknown persisted query {document_string}.")
+            # A registry built on another schema is validated here once more.
+            validated = query["schema_hash"] == self._schema_hash(schema)
+            document_string = query["query"]
+
+        try:
+            document, invalid = self._compile(schema, document_string, validated)
+        except GraphQLError as e:
+            # A syntax error, reported like the default backend would.
+            invalid = ExecutionResult(errors=[e], invalid=True)
+        if invalid is not None:
+            with self._lock:
+                self.counters["invalid"] += 1
+            return GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=None,
+                execute=lambda *args, **kwargs: invalid,
+            )
+
+        with self._lock:
+            self.counters["persisted_misses" if persisted else "misses"] += 1
+            self._documents[key] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
+
+
+backend = None
+
+
+def install():
+    global backend
+    if os.getenv("GRAPHQLREGISTRY", "on").lower() == "off" or backend is not None:
+        return False
+    if GraphQLCoreBackend is object:
+        return False
+
+    from graphql.backend import set_default_backend
+
+    paths = os.getenv("GRAPHQLREGISTRYPATH") or ",".join(
+        [os.getenv("LAMBDA_TASK_ROOT", "/var/task"), "/opt"]
+    )
+    backend = RegistryBackend(
+        paths.split(","), max_size=int(os.getenv("GRAPHQLDOCUMENTCACHESIZE", 256))
+    )
+    set_default_backend(backend)
+    return True
+
+
+def stats():
+    return {} if backend is None else dict(backend.counters)
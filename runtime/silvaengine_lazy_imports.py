@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Import the packages listed as "lazy" in a layer on first use.
+
+Lazy loading is opt-in per layer. A layer with a non-empty "lazy" list in
+lambda_config.json, e.g.
+
+    "silvaengine_layer": {
+        ...
+        "lazy": ["pandas", "openpyxl"]
+    }
+
+ships this module, filled with the list, and the handlers install it right
+after adding /opt to sys.path; with an empty list it is left out. Before
+listing a package, compare its import time and memory with
+deployment/import_profiler.py and run the functions that use it: a package
+that relies on import-time side effects (registering plugins, patching
+other modules) or whose submodules are imported by name before the package
+is touched can break when its execution is deferred.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import importlib.machinery
+import importlib.util
+import sys
+
+# Filled in by the layer builder from the "lazy" packages in lambda_config.json.
+LAZY_MODULES = []
+
+
+class LazyImportFinder(object):
+    """Delay executing the listed top-level packages until an attribute of the
+    module is first accessed.
+
+    `import pandas` only binds a placeholder module; `from pandas import x`
+    or any attribute access runs the real import. Extension modules and
+    namespace packages are imported eagerly as usual.
+    """
+
+    def __init__(self, names):
+        self.names = set(names)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.names:
+            return None
+
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if isinstance(
+            spec.loader,
+            (
+                importlib.machinery.SourceFileLoader,
+                importlib.machinery.SourcelessFileLoader,
+            ),
+        ):
+            spec.loader = importlib.util.LazyLoader(spec.loader)
+        return spec
+
+
+def install(names=LAZY_MODULES):
+    if not any(isinstance(finder, LazyImportFinder) for finder in sys.meta_path):
+        sys.meta_path.insert(0, LazyImportFinder(names))
+
+
+install()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Invocation metrics of a handler in CloudWatch Embedded Metric Format.
+
+instrument(handler) wraps a handler so that every invocation prints one EMF
+line, which CloudWatch Logs turns into metrics without an agent or an API
+call:
+
+- Latency (ms), PayloadSize (bytes of the request body or record bodies),
+  PeakRSS (MB of the process so far), Errors and ColdStart (0/1), plus
+  InitDuration (ms from the start of the process) on a cold start;
+- properties: the outcome (success, client_error, error, partial), the
+  request id and the Proxy path of an API request;
+- dimensions [FunctionName] and [FunctionName, Endpoint], the endpoint being
+  area/endpoint_id of an API request, the route of a WebSocket message or
+  "sqs". The proxy path is left out of the dimension: every distinct value
+  of a dimension is a custom metric of its own.
+
+Namespace METRICSNAMESPACE (default SilvaEngine). METRICSSAMPLERATE (0 to 1,
+default 1) keeps that share of the warm, successful invocations; cold starts
+and errors are always written. The SampleRate property lets a dashboard scale
+the counts back. METRICS=off leaves the handler unwrapped.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import json
+import os
+import random
+import resource
+import time
+
+INIT_STARTED = time.time()
+UNITS = {"Latency": "Milliseconds", "InitDuration": "Milliseconds"}
+
+
+def process_started():
+    """The epoch time the process started, from /proc; the import time elsewhere."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # The fields after the command name; starttime is field 22.
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return INIT_STARTED
+
+
+def put_metrics(namespace, dimensions, metrics, properties=None, units=None):
+    """Print one EMF line; dimensions is {name: value}, metrics {name: value}."""
+    units = dict(UNITS, **(units or {}))
+    print(
+        json.dumps(
+            dict(
+                properties or {},
+                _aws={
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": namespace,
+                            "Dimensions": [
+                                list(dimensions)[: i + 1]
+                                for i in range(len(dimensions))
+                            ],
+                            "Metrics": [
+                                {"Name": name, "Unit": units.get(name, "Count")}
+                                for name in metrics
+                            ],
+                        }
+                    ],
+                },
+                **dimensions,
+                **metrics,
+            ),
+            default=str,
+        ),
+        flush=True,
+    )
+
+
+def endpoint_of(event):
+    if not isinstance(event, dict):
+        return None
+    path_parameters = event.get("pathParameters") or {}
+    if path_parameters.get("endpoint_id"):
+        return "/".join(
+            str(path_parameters.get(key))
+            for key in ("area", "endpoint_id")
+            if path_parameters.get(key)
+        )
+    request_context = event.get("requestContext") or {}
+    if request_context.get("routeKey") and request_context.get("connectionId"):
+        return f"websocket/{request_context['routeKey']}"
+    if event.get("Records"):
+        return event["Records"][0].get("eventSource", "records").split(":")[-1]
+    return None
+
+
+def proxy_of(event):
+    if not isinstance(event, dict):
+        return None
+    return (event.get("pathParameters") or {}).get("proxy")
+
+
+def payload_size(event):
+    if not isinstance(event, dict):
+        return 0
+    if isinstance(event.get("body"), str):
+        return len(event["body"])
+    if isinstance(event.get("Records"), list):
+        return sum(len(str(record.get("body", ""))) for record in event["Records"])
+    return len(json.dumps(event, default=str))
+
+
+def outcome_of(result):
+    if not isinstance(result, dict):
+        return "success"
+    if result.get("batchItemFailures"):
+        return "partial"
+    status_code = int(result.get("statusCode", 200))
+    if status_code >= 500:
+        return "error"
+    return "client_error" if status_code >= 400 else "success"
+
+
+class Instrumented(object):
+    def __init__(self, handler, namespace=None, sample_rate=None):
+        self.handler = handler
+        self.namespace = namespace or os.getenv("METRICSNAMESPACE", "SilvaEngine")
+        self.sample_rate = (
+            sample_rate
+            if sample_rate is not None
+            else float(os.getenv("METRICSSAMPLERATE", 1))
+        )
+        self.cold = True
+
+    def __call__(self, event, context):
+        cold, self.cold = self.cold, False
+        started = time.perf_counter()
+        outcome, error = "error", None
+        try:
+            result = self.handler(event, context)
+            outcome = outcome_of(result)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            latency = (time.perf_counter() - started) * 1000
+            if cold or outcome == "error" or random.random() < self.sample_rate:
+                self.put(event, context, cold, latency, outcome, error)
+
+    def put(self, event, context, cold, latency, outcome, error):
+        # Never let the metrics fail the invocation.
+        try:
+            dimensions = {
+                "FunctionName": getattr(context, "function_name", None)
+                or os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+            }
+            endpoint = endpoint_of(event)
+            if endpoint:
+                dimensions["Endpoint"] = endpoint
+            metrics = {
+                "Latency": round(latency, 3),
+                "PayloadSize": payload_size(event),
+                # ru_maxrss is in KB on Linux.
+                "PeakRSS": round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+                ),
+                "Errors": int(outcome == "error"),
+                "ColdStart": int(cold),
+            }
+            if cold:
+                metrics["InitDuration"] = round(
+                    (time.time() - latency / 1000 - process_started()) * 1000, 3
+                )
+            properties = {
+                "Outcome": outcome,
+                "SampleRate": 1 if cold or outcome == "error" else self.sample_rate,
+                "RequestId": getattr(context, "aws_request_id", None),
+            }
+            proxy = proxy_of(event)
+            if proxy:
+                properties["Proxy"] = proxy
+            if error is not None:
+                properties["Error"] = f"{type(error).__name__}: {error}"
+            put_metrics(
+                self.namespace,
+                dimensions,
+                metrics,
+                properties,
+                units={"PayloadSize": "Bytes", "PeakRSS": "Megabytes"},
+            )
+        except Exception:
+            pass
+
+
+def instrument(handler):
+    if os.getenv("METRICS", "on").lower() == "off":
+        return handler
+    return Instrumented(handler)
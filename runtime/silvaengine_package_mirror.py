@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Mirror the python packages on EFS to the local /tmp of a container.
+
+Importing from EFS costs an NFS round trip for every stat and read of every
+module; the mirror reads the tree once at init and imports from local disk:
+
+- copy: the files that differ from the last mirror in this container are
+  copied to PACKAGEMIRRORPATH (default /tmp/pypackages);
+- zip: the pure python packages come from one archive built next to the
+  packages (a single sequential read) and are imported with zipimport; the
+  packages with native extensions are still copied, zipimport cannot load
+  them.
+
+The source tree is described by a manifest (MANIFEST in its root) with the
+size and sha256 of every file. Write it, and the archive, after installing
+packages to EFS:
+
+    python silvaengine_package_mirror.py -source /mnt/pypackages [-archive true]
+
+Without a manifest the tree is walked and the files compared by size and
+mtime. When /tmp lacks the space (keeping PACKAGEMIRRORRESERVEMB free) or the
+copy fails, the packages are imported from EFS as before.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+MANIFEST = ".silvaengine_manifest.json"
+ARCHIVE = ".silvaengine_packages.zip"
+NATIVE_SUFFIXES = (".so", ".pyd", ".dylib")
+
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def scan(source):
+    """Return {relative path: {"size": .., "mtime": ..}} of the tree."""
+    files = {}
+    for root, dirs, names in os.walk(source):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for name in names:
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, source)
+            if rel_path in (MANIFEST, ARCHIVE):
+                continue
+            stat = os.stat(path)
+            files[rel_path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    return files
+
+
+def top_level(rel_path):
+    return rel_path.split(os.sep, 1)[0]
+
+
+def tree_hash(files):
+    sha256 = hashlib.sha256()
+    for rel_path in sorted(files):
+        signature = PackageMirror._signature(files[rel_path])
+        sha256.update(f"{rel_path}\0{signature}\n".encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def build_manifest(source, archive=False):
+    """Hash every file of source and write MANIFEST (and ARCHIVE) into it."""
+    files = scan(source)
+    for rel_path, entry in files.items():
+        entry["sha256"] = file_hash(os.path.join(source, rel_path))
+    native = sorted(
+        set(top_level(p) for p in files if p.endswith(NATIVE_SUFFIXES))
+    )
+    manifest = {"tree": tree_hash(files), "native": native, "files": files}
+
+    if archive:
+        tmp_file = os.path.join(source, f"{ARCHIVE}.tmp")
+        # Stored, not deflated: the archive is read once, from a local disk.
+        with zipfile.ZipFile(tmp_file, "w", zipfile.ZIP_STORED) as fzip:
+            for rel_path in sorted(files):
+                if top_level(rel_path) not in native:
+                    fzip.write(os.path.join(source, rel_path), rel_path)
+        os.replace(tmp_file, os.path.join(source, ARCHIVE))
+        manifest["archive"] = {"sha256": file_hash(os.path.join(source, ARCHIVE))}
+
+    tmp_file = os.path.join(source, f"{MANIFEST}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, os.path.join(source, MANIFEST))
+    return manifest
+
+
+def load_manifest(source):
+    path = os.path.join(source, MANIFEST)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    files = scan(source)
+    return {"tree": tree_hash(files), "native": None, "files": files}
+
+
+class PackageMirror(object):
+    def __init__(self, source, target, mode="copy", max_workers=16, reserve_mb=64):
+        self.source = source
+        self.target = target
+        self.mode = mode
+        self.max_workers = max_workers
+        self.reserve = reserve_mb * 1024 * 1024
+        self.copied_files = 0
+        self.copied_bytes = 0
+
+    @staticmethod
+    def _signature(entry):
+        return entry.get("sha256") or (entry["size"], entry["mtime"])
+
+    def _local_manifest(self):
+        try:
+            with open(os.path.join(self.target, MANIFEST), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"files": {}}
+
+    def _has_space(self, size):
+        os.makedirs(self.target, exist_ok=True)
+        return shutil.disk_usage(self.target).free - self.reserve >= size
+
+    def _copy(self, rel_path):
+        path = os.path.join(self.target, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(os.path.join(self.source, rel_path), path)
+
+    def _sync_files(self, files, local_files):
+        changed = [
+            rel_path
+            for rel_path, entry in files.items()
+            if rel_path not in local_files
+            or self._signature(local_files[rel_path]) != self._signature(entry)
+        ]
+        size = sum(files[rel_path]["size"] for rel_path in changed)
+        if not self._has_space(size):
+            raise OSError(f"Less than {size} bytes free in {self.target}.")
+
+        for rel_path in set(local_files) - set(files):
+            try:
+                os.remove(os.path.join(self.target, rel_path))
+                # An empty directory left behind would still be a namespace
+                # package shadowing the archive.
+                if os.path.dirname(rel_path):
+                    os.removedirs(os.path.join(self.target, os.path.dirname(rel_path)))
+            except OSError:
+                pass
+        os.makedirs(self.target, exist_ok=True)
+        # Small files on NFS: latency bound, so copy many at a time.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self._copy, changed))
+        self.copied_files += len(changed)
+        self.copied_bytes += size
+
+    def _sync_archive(self, manifest, local):
+        archive = os.path.join(self.target, ARCHIVE)
+        if local.get("archive") != manifest["archive"] or not os.path.exists(
+            archive
+        ):
+            size = os.path.getsize(os.path.join(self.source, ARCHIVE))
+            if not self._has_space(size):
+                raise OSError(f"Less than {size} bytes free in {self.target}.")
+            shutil.copyfile(os.path.join(self.source, ARCHIVE), archive)
+            self.copied_files += 1
+            self.copied_bytes += size
+
+    def sync(self):
+        """Mirror the tree; returns the paths to import the packages from."""
+        manifest = load_manifest(self.source)
+        local = self._local_manifest()
+        if local.get("tree") == manifest["tree"] and local.get("mode") == self.mode:
+            return local["paths"]
+
+        files = manifest["files"]
+        paths = [self.target]
+        use_archive = self.mode == "zip" and manifest.get("archive") is not None
+        # Forget the last mirror until this one is complete.
+        if os.path.exists(os.path.join(self.target, MANIFEST)):
+            os.remove(os.path.join(self.target, MANIFEST))
+        if use_archive:
+            self._sync_archive(manifest, local)
+            files = {
+                rel_path: entry
+                for rel_path, entry in files.items()
+                if top_level(rel_path) in manifest["native"]
+            }
+            paths.append(os.path.join(self.target, ARCHIVE))
+        self._sync_files(files, local.get("files", {}))
+
+        with open(os.path.join(self.target, MANIFEST), "w") as f:
+            json.dump(
+                {
+                    "tree": manifest["tree"],
+                    "mode": self.mode,
+                    "archive": manifest.get("archive") if use_archive else None,
+                    "paths": paths,
+                    "files": files,
+                },
+                f,
+            )
+        return paths
+
+
+def install(source):
+    """Put the mirror of source (or source itself) at the end of sys.path."""
+    mode = os.getenv("PACKAGEMIRROR", "off").lower()
+    if mode not in ("copy", "zip"):
+        sys.path.append(source)
+        return [source]
+
+    started = time.perf_counter()
+    mirror = PackageMirror(
+        source,
+        os.getenv("PACKAGEMIRRORPATH", "/tmp/pypackages"),
+        mode=mode,
+        max_workers=int(os.getenv("PACKAGEMIRRORWORKERS", 16)),
+        reserve_mb=int(os.getenv("PACKAGEMIRRORRESERVEMB", 64)),
+    )
+    try:
+        paths = mirror.sync()
+        logger.info(
+            f"Mirrored {mirror.copied_files} files ({mirror.copied_bytes} bytes)"
+            f" from {source} to {paths} in {time.perf_counter() - started:.2f}s."
+        )
+    except Exception as e:
+        paths = [source]
+        logger.warning(
+            f"Importing from {source}, the mirror failed after"
+            f" {time.perf_counter() - started:.2f}s: {e}"
+        )
+    sys.path.extend(paths)
+    return paths
+
+
+def getopts(argv):
+    opts = {}  # Empty dictionary to store key-value pairs.
+    while argv:  # While there are arguments left to parse...
+        if argv[0][0] == "-":  # Found a "-name value" pair.
+            opts[argv[0]] = argv[1]  # Add key and value to the dictionary.
+        argv = argv[1:]  # Reduce the argument list by copying it starting from index 1.
+    return opts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = getopts(sys.argv)
+    if "-source" not in args.keys():
+        logger.error("Please input a source (the python packages path on EFS).")
+        sys.exit()
+
+    started = time.perf_counter()
+    manifest = build_manifest(
+        args["-source"], archive=args.get("-archive", "false").lower() == "true"
+    )
+    logger.info(
+        f"Wrote the manifest of {len(manifest['files'])} files"
+        f" (native packages {manifest['native']})"
+        f" in {time.perf_counter() - started:.2f}s."
+    )
@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Warm-container cache of the routing lookups of silvaengine_base.
+
+install() wraps the lookups named in ROUTINGCACHETARGETS (module.Class.method,
+comma separated) so that a warm container reads the endpoint, function,
+connection and setting records from memory instead of DynamoDB:
+
+- at most ROUTINGCACHESIZE entries, least recently used evicted first;
+- an entry is fresh for ROUTINGCACHETTL seconds and may then be served stale
+  for ROUTINGCACHESTALETTL more seconds while it is reloaded in a background
+  thread (Lambda freezes the thread between invocations, so the reload may
+  finish on the next one);
+- empty results and pynamodb DoesNotExist errors are cached for
+  ROUTINGCACHENEGATIVETTL seconds, other errors are never cached;
+- ROUTINGCACHEVERSION ("setting_id/variable" of se-configdata) is a version
+  stamp read at most every ROUTINGCACHEVERSIONINTERVAL seconds; the whole
+  cache is dropped when it changes, so bumping it invalidates every warm
+  container.
+
+ROUTINGCACHE=false turns the cache off. stats() returns the counters.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import functools
+import importlib
+import inspect
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+DEFAULT_TARGETS = [
+    "silvaengine_base.LambdaBase.get_endpoint",
+    "silvaengine_base.LambdaBase.get_function",
+    "silvaengine_base.LambdaBase.get_connection",
+    "silvaengine_base.LambdaBase.get_setting",
+]
+NEGATIVE_ERRORS = ["DoesNotExist"]
+CONFIGDATA_TABLE = "se-configdata"
+
+
+def copy_value(value):
+    """Copy the dicts, lists and sets of a cached value so callers can change
+    what they get back; anything else is returned as it is, untouched by the
+    memo bookkeeping of copy.deepcopy on every hit."""
+    value_type = type(value)
+    if value_type is dict:
+        return {key: copy_value(item) for key, item in value.items()}
+    if value_type is list:
+        return [copy_value(item) for item in value]
+    if value_type is set:
+        return set(value)
+    return value
+
+
+class Entry(object):
+    __slots__ = ["value", "error", "fresh_until", "stale_until", "negative"]
+
+    def __init__(self, value, error, fresh_until, stale_until, negative):
+        self.value = value
+        self.error = error
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+        self.negative = negative
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        # Callers may change what they get back; keep the cached copy intact.
+        return copy_value(self.value)
+
+
+class RoutingCache(object):
+    def __init__(
+        self,
+        max_size=512,
+        ttl=300,
+        negative_ttl=30,
+        stale_ttl=600,
+        version_stamp=None,
+        clock=time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.version_stamp = version_stamp
+        self.clock = clock
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "refresh_errors": 0,
+        }
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.RLock()
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    @staticmethod
+    def _is_negative_error(error):
+        return type(error).__name__ in NEGATIVE_ERRORS
+
+    def _store(self, key, value, error):
+        negative = error is not None or value is None or value in ({}, [])
+        now = self.clock()
+        fresh_until = now + (self.negative_ttl if negative else self.ttl)
+        entry = Entry(
+            value,
+            error,
+            fresh_until,
+            fresh_until if negative else fresh_until + self.stale_ttl,
+            negative,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+        return entry
+
+    def _load(self, key, load):
+        try:
+            value = load()
+        except Exception as e:
+            if self._is_negative_error(e):
+                self._store(key, None, e)
+            raise
+        self._store(key, value, None)
+        return value
+
+    def _refresh(self, key, load):
+        try:
+            self._load(key, load)
+        except Exception:
+            self._count("refresh_errors")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, load):
+        """Return the cached result of load() for key, loading it on a miss."""
+        if self.version_stamp is not None and self.version_stamp.changed():
+            self.invalidate()
+
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None and now < entry.fresh_until:
+            self._count("negative_hits" if entry.negative else "hits")
+            return entry.result()
+        if entry is not None and now < entry.stale_until:
+            self._count("stale_hits")
+            with self._lock:
+                refresh = key not in self._refreshing
+                self._refreshing.add(key)
+            if refresh:
+                threading.Thread(
+                    target=self._refresh, args=(key, load), daemon=True
+                ).start()
+            return entry.result()
+
+        self._count("misses")
+        return copy_value(self._load(key, load))
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.counters["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, size=len(self._entries))
+
+
+class VersionStamp(object):
+    """A value in se-configdata that is polled at most every interval seconds;
+    changed() is true when it moved since the previous read."""
+
+    def __init__(self, setting_id, variable, interval=30, clock=time.monotonic):
+        self.key = {"setting_id": {"S": setting_id}, "variable": {"S": variable}}
+        self.interval = interval
+        self.clock = clock
+        self.value = None
+        self.checked_at = None
+        self.read_at = None
+        self._client = None
+
+    def read(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("dynamodb")
+        item = self._client.get_item(
+            TableName=CONFIGDATA_TABLE,
+            Key=self.key,
+            ProjectionExpression="#v",
+            ExpressionAttributeNames={"#v": "value"},
+        ).get("Item")
+        return None if item is None else str(item.get("value"))
+
+    def changed(self):
+        now = self.clock()
+        if self.checked_at is not None and now - self.checked_at < self.interval:
+            return False
+        self.checked_at = now
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.warning(f"Cannot read the routing cache version: {e}")
+            return False
+        changed = self.read_at is not None and value != self.value
+        self.value, self.read_at = value, now
+        return changed
+
+
+def _cache_key(name, args, kwargs):
+    key = (name, args, tuple(sorted(kwargs.items())))
+    hash(key)
+    return key
+
+
+def cached(cache, name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            key = _cache_key(name, args, kwargs)
+        except TypeError:
+            # Unhashable arguments are not cached.
+            return function(*args, **kwargs)
+        return cache.get(key, lambda: function(*args, **kwargs))
+
+    return wrapper
+
+
+def wrap(cache, target):
+    """Wrap module.Class.method (static, class or plain method) in place;
+    returns False, with a warning, when the target cannot be wrapped."""
+    try:
+        module_name, class_name, method_name = target.rsplit(".", 2)
+        owner = getattr(importlib.import_module(module_name), class_name)
+        attribute = inspect.getattr_static(owner, method_name)
+    except (ValueError, ImportError, AttributeError) as e:
+        logger.warning(f"Routing cache skips {target}: {e}")
+        return False
+
+    if isinstance(attribute, staticmethod):
+        setattr(
+            owner,
+            method_name,
+            staticmethod(cached(cache, target, attribute.__func__)),
+        )
+    elif isinstance(attribute, classmethod):
+        function = cached(cache, target, attribute.__func__)
+        setattr(owner, method_name, classmethod(function))
+    elif callable(attribute):
+        # A plain method: each instance is keyed by a token of its own, as
+        # instances may be set up differently. id() would not do, a new
+        # instance can get the id of a collected one.
+        method = attribute
+        tokens = weakref.WeakKeyDictionary()
+        counter = itertools.count()
+        lock = threading.Lock()
+
+        @functools.wraps(method)
+        def instance_method(self, *args, **kwargs):
+            try:
+                with lock:
+                    token = tokens.setdefault(self, next(counter))
+            except TypeError:
+                # Unhashable or not weakly referenceable instances are not cached.
+                return method(self, *args, **kwargs)
+            return cached(
+                cache, (target, token), lambda *a, **k: method(self, *a, **k)
+            )(*args, **kwargs)
+
+        setattr(owner, method_name, instance_method)
+    else:
+        logger.warning(f"Routing cache skips {target}: not a method.")
+        return False
+    return True
+
+
+cache = None
+
+
+def install():
+    global cache
+    if os.getenv("ROUTINGCACHE", "true").lower() == "false" or cache is not None:
+        return []
+
+    version_stamp = None
+    if os.getenv("ROUTINGCACHEVERSION"):
+        setting_id, variable = os.getenv("ROUTINGCACHEVERSION").split("/", 1)
+        version_stamp = VersionStamp(
+            setting_id,
+            variable,
+            interval=float(os.getenv("ROUTINGCACHEVERSIONINTERVAL", 30)),
+        )
+    cache = RoutingCache(
+        max_size=int(os.getenv("ROUTINGCACHESIZE", 512)),
+        ttl=float(os.getenv("ROUTINGCACHETTL", 300)),
+        negative_ttl=float(os.getenv("ROUTINGCACHENEGATIVETTL", 30)),
+        stale_ttl=float(os.getenv("ROUTINGCACHESTALETTL", 600)),
+        version_stamp=version_stamp,
+    )
+
+    targets = os.getenv("ROUTINGCACHETARGETS")
+    targets = targets.split(",") if targets else DEFAULT_TARGETS
+    targets = [target.strip() for target in targets]
+    wrapped = [target for target in targets if wrap(cache, target)]
+    logger.info(f"Routing cache on {wrapped}.")
+    return wrapped
+
+
+def stats():
+    return {} if cache is None else cache.stats()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Partial-batch processing of the SQS events of a handler.
+
+SQSBatchHandler(handler, logger) calls handler once per message, with the
+event reduced to that one record. The messages of a MessageGroupId run one
+after the other in their queue order (messages of a standard queue have no
+group and each one is a group of its own). By default the groups run one
+after the other too; TASKGROUPWORKERS > 1 runs them at the same time on that
+many threads, which is only safe when the wrapped handler is thread-safe:
+the silvaengine_base task handler shares its logger, DynamoDB connections
+and module-level state between calls and is not.
+
+When a message fails, the rest of its group is not started, so the order of
+the group holds on redelivery; the failed and unstarted messages are
+returned as batchItemFailures, which requires "FunctionResponseTypes":
+["ReportBatchItemFailures"] on the event source mapping. Messages are no
+longer started once less than TASKTIMEOUTMARGIN seconds of the invocation
+are left.
+
+Each batch logs one Embedded Metric Format line (namespace METRICSNAMESPACE)
+with its latency, size, failures and retries (messages received before).
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import silvaengine_metrics
+
+
+def is_sqs_event(event):
+    records = event.get("Records") if isinstance(event, dict) else None
+    return bool(records) and all(
+        record.get("eventSource") == "aws:sqs" for record in records
+    )
+
+
+def receive_count(record):
+    return int(record.get("attributes", {}).get("ApproximateReceiveCount", 1))
+
+
+def group_records(records):
+    """Split the records into lists by MessageGroupId, keeping their order."""
+    groups = {}
+    for record in records:
+        group_id = record.get("attributes", {}).get("MessageGroupId")
+        groups.setdefault(group_id or record["messageId"], []).append(record)
+    return list(groups.values())
+
+
+class SQSBatchHandler(object):
+    def __init__(self, handler, logger, max_workers=None, timeout_margin=None):
+        self.handler = handler
+        self.logger = logger
+        self.max_workers = max_workers or int(os.getenv("TASKGROUPWORKERS", 1))
+        self.timeout_margin = (
+            timeout_margin
+            if timeout_margin is not None
+            else float(os.getenv("TASKTIMEOUTMARGIN", 10))
+        )
+        self.namespace = os.getenv("METRICSNAMESPACE", "SilvaEngine")
+
+    def _has_time(self, context):
+        if not hasattr(context, "get_remaining_time_in_millis"):
+            return True
+        return context.get_remaining_time_in_millis() > self.timeout_margin * 1000
+
+    def _process(self, event, record, context):
+        result = self.handler(dict(event, Records=[record]), context)
+        # A handler that reports partial failures itself has the final word.
+        if isinstance(result, dict) and result.get("batchItemFailures"):
+            raise Exception(f"The handler reported {result['batchItemFailures']}.")
+
+    def _process_group(self, event, records, context):
+        """Return the message ids of the group that have to be retried."""
+        for index, record in enumerate(records):
+            if not self._has_time(context):
+                return [r["messageId"] for r in records[index:]]
+            try:
+                self._process(event, record, context)
+            except Exception:
+                self.logger.exception(
+                    f"The message {record['messageId']} failed; "
+                    f"{len(records) - index - 1} messages of its group are retried."
+                )
+                return [r["messageId"] for r in records[index:]]
+        return []
+
+    def __call__(self, event, context):
+        if not is_sqs_event(event):
+            return self.handler(event, context)
+
+        started = time.perf_counter()
+        groups = group_records(event["Records"])
+        if self.max_workers <= 1 or len(groups) == 1:
+            failures = [self._process_group(event, g, context) for g in groups]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(groups))
+            ) as executor:
+                failures = list(
+                    executor.map(
+                        lambda g: self._process_group(event, g, context), groups
+                    )
+                )
+        failures = [message_id for group in failures for message_id in group]
+
+        self.put_metrics(
+            context,
+            latency=(time.perf_counter() - started) * 1000,
+            size=len(event["Records"]),
+            groups=len(groups),
+            failures=len(failures),
+            retries=len([r for r in event["Records"] if receive_count(r) > 1]),
+        )
+        return {
+            "batchItemFailures": [
+                {"itemIdentifier": message_id} for message_id in failures
+            ]
+        }
+
+    def put_metrics(self, context, latency, size, groups, failures, retries):
+        silvaengine_metrics.put_metrics(
+            self.namespace,
+            {"FunctionName": getattr(context, "function_name", "local")},
+            {
+                "BatchLatency": round(latency, 3),
+                "BatchSize": size,
+                "BatchGroups": groups,
+                "BatchFailures": failures,
+                "BatchRetries": retries,
+            },
+            units={"BatchLatency": "Milliseconds"},
+        )
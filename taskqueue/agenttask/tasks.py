@@ -8,6 +8,12 @@ import sys, os
 
 sys.path.append("/opt")
 
+try:
+    # Defer the packages marked as "lazy" in the layer until first use.
+    import silvaengine_lazy_imports
+except ImportError:
+    pass
+
 from silvaengine_base import Tasks
 import logging
 
@@ -15,3 +21,20 @@ logger = logging.getLogger()
 logger.setLevel(eval(os.environ["LOGGINGLEVEL"]))
 
 handler = Tasks.get_handler(logger)  # input values for args and/or kwargs
+
+try:
+    # Retry only the failed messages; TASKGROUPWORKERS > 1 runs the message
+    # groups on threads, for a thread-safe task handler only.
+    import silvaengine_sqs_batch
+
+    handler = silvaengine_sqs_batch.SQSBatchHandler(handler, logger)
+except ImportError:
+    pass
+
+try:
+    # One Embedded Metric Format line per invocation.
+    import silvaengine_metrics
+
+    handler = silvaengine_metrics.instrument(handler)
+except ImportError:
+    pass
@@ -0,0 +1,13 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# The deployment scripts and runtime modules import each other by name.
+for path in ("deployment", "runtime"):
+    sys.path.insert(0, os.path.join(ROOT, path))
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+from decimal import Decimal
+
+import dynamodb_codec
+
+
+def test_lossless_items_come_back_with_their_types():
+    item = {"id": "a", "price": Decimal("1.50"), "tags": {"x", "y"}, "raw": b"\0"}
+    line = dynamodb_codec.encode_item(item, lossless=True)
+    assert dynamodb_codec.decode(line) == item
+
+
+def test_a_plain_item_holding_one_item_map_is_not_an_envelope():
+    item = {"Item": {"S": "not a type tag", "N": Decimal("1")}}
+    line = dynamodb_codec.encode_item(item)
+    assert dynamodb_codec.decode(line) == item
+    # Nor is an envelope without the marker, e.g. a DynamoDB export line.
+    assert dynamodb_codec.decode('{"Item": {"id": {"S": "a"}}}') == {
+        "Item": {"id": {"S": "a"}}
+    }
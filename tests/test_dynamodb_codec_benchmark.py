@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Round-trip benchmarks of dynamodb_codec on synthetic items.
+
+    python -m pytest tests/test_dynamodb_codec_benchmark.py --benchmark-only
+
+Every round streams a batch of items through the encoder to NDJSON lines (the
+way JsonItemWriter does) and reads the lines back with the decoder. legacy is
+json.dumps with the JSONEncoder subclass the table scripts used before
+dynamodb_codec, kept as the point of comparison.
+"""
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import dynamodb_codec
+
+BATCH = 1000
+
+
+class LegacyJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Decimal):
+            if o % 1 > 0:
+                return float(o)
+            else:
+                return int(o)
+        elif isinstance(o, (datetime, date)):
+            return o.strftime("%Y-%m-%d %H:%M:%S")
+        elif isinstance(o, (bytes, bytearray, set)):
+            return str(o)
+        else:
+            return super(LegacyJSONEncoder, self).default(o)
+
+
+ENCODERS = {
+    "legacy": lambda item: json.dumps(item, cls=LegacyJSONEncoder),
+    "plain": lambda item: dynamodb_codec.encode_item(item),
+    "lossless": lambda item: dynamodb_codec.encode_item(item, lossless=True),
+}
+DECODERS = {
+    "legacy": lambda line: json.loads(line, parse_float=Decimal),
+    "plain": dynamodb_codec.decode,
+    "lossless": dynamodb_codec.decode,
+}
+
+
+def generate_items(count, shape):
+    items = []
+    for i in range(count):
+        item = {
+            "id": f"item-{i:08d}",
+            "sort": Decimal(i % 1000),
+            "name": f"Synthetic item {i}",
+            "price": Decimal(i % 100000) / Decimal(100),
+            "quantity": Decimal(i % 37),
+            "active": i % 2 == 0,
+            "note": None,
+        }
+        if shape == "nested":
+            item["attributes"] = {
+                "color": ["red", "green", "blue"][i % 3],
+                "weight": Decimal("0.125") * (i % 8),
+                "dimensions": [Decimal(i % 10), Decimal(i % 20), Decimal(i % 30)],
+            }
+            item["tags"] = {"a", "b", f"t{i % 5}"}
+            item["checksum"] = (i % 65536).to_bytes(2, "big") * 8
+        items.append(item)
+    return items
+
+
+def round_trip(items, encode, decode):
+    data = "\n".join([encode(item) for item in items]) + "\n"
+    return [decode(line) for line in data.splitlines()]
+
+
+@pytest.mark.parametrize("mode", ["legacy", "plain", "lossless"])
+@pytest.mark.parametrize("shape", ["flat", "nested"])
+def test_round_trip(benchmark, shape, mode):
+    benchmark.group = f"round trip {shape}"
+    items = generate_items(BATCH, shape)
+    decoded = benchmark(round_trip, items, ENCODERS[mode], DECODERS[mode])
+
+    assert len(decoded) == BATCH
+    if mode == "lossless":
+        assert decoded == items
+    elif mode == "plain" and shape == "flat":
+        assert decoded == items
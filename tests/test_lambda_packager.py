@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import os
+import zipfile
+
+import lambda_packager
+
+
+def make_tree(tmp_path, files):
+    base = tmp_path / "base"
+    for name, content in files.items():
+        (base / name).parent.mkdir(parents=True, exist_ok=True)
+        (base / name).write_bytes(content)
+    return lambda_packager.collect_entries(str(tmp_path), base=str(base))
+
+
+def test_copy_zip_entry_keeps_the_compressed_bytes(tmp_path):
+    entries = make_tree(
+        tmp_path, {"a.py": b"print('a')\n" * 500, "pkg/b.py": b"\xff" * 4096}
+    )
+    hashed = lambda_packager.BuildCache.hash_entries(entries, {})
+    src_file, dst_file = str(tmp_path / "src.zip"), str(tmp_path / "dst.zip")
+    lambda_packager.write_zip(src_file, entries, hashed, {}, 9)
+
+    with zipfile.ZipFile(src_file) as src, zipfile.ZipFile(
+        dst_file, "w", zipfile.ZIP_DEFLATED
+    ) as dst:
+        for info in src.infolist():
+            lambda_packager.copy_zip_entry(src, info, dst)
+
+    with zipfile.ZipFile(src_file) as src, zipfile.ZipFile(dst_file) as dst:
+        assert dst.testzip() is None
+        assert dst.namelist() == src.namelist()
+        for info in src.infolist():
+            copied = dst.getinfo(info.filename)
+            assert (copied.CRC, copied.compress_size, copied.file_size) == (
+                info.CRC,
+                info.compress_size,
+                info.file_size,
+            )
+            assert lambda_packager.read_raw_entry(
+                dst, copied
+            ) == lambda_packager.read_raw_entry(src, info)
+            assert dst.read(info.filename) == src.read(info.filename)
+
+
+def test_build_recompresses_only_changed_entries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entries = make_tree(tmp_path, {"a.py": b"a = 1\n", "b.py": b"b = 1\n"})
+    package_file = "package.zip"
+    cache = lambda_packager.BuildCache(str(tmp_path / "cache"))
+    changed, record = cache.build(package_file, entries, "bucket")
+    assert changed
+    cache.commit(package_file, record, "bucket", "v1")
+    assert cache.build(package_file, entries, "bucket")[0] is False
+
+    # Same size and mtime, different content: still seen as a change.
+    path = str(tmp_path / "base" / "b.py")
+    stat = os.stat(path)
+    with open(path, "wb") as f:
+        f.write(b"b = 2\n")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    written = []
+    write_zip_entry = lambda_packager.write_zip_entry
+    monkeypatch.setattr(
+        lambda_packager,
+        "write_zip_entry",
+        lambda fzip, path, arcname: written.append(arcname)
+        or write_zip_entry(fzip, path, arcname),
+    )
+    changed, record = cache.build(package_file, entries, "bucket")
+    assert changed and written == ["b.py"]
+    with zipfile.ZipFile(package_file) as fzip:
+        assert fzip.read("a.py") == b"a = 1\n"
+        assert fzip.read("b.py") == b"b = 2\n"
+
+
+def test_a_zip_built_but_not_uploaded_is_not_built_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entries = make_tree(tmp_path, {"a.py": b"a = 1\n"})
+    cache = lambda_packager.BuildCache(str(tmp_path / "cache"))
+    changed, record = cache.build("package.zip", entries, "bucket")
+    mtime = os.stat("package.zip").st_mtime_ns
+
+    # The upload was interrupted: nothing was committed.
+    monkeypatch.setattr(lambda_packager, "write_zip", None)
+    changed, resumed = cache.build("package.zip", entries, "bucket")
+    assert changed and resumed["digest"] == record["digest"]
+    assert os.stat("package.zip").st_mtime_ns == mtime
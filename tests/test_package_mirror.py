@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import os
+import zipfile
+
+import pytest
+
+import silvaengine_package_mirror
+from silvaengine_package_mirror import PackageMirror
+
+
+@pytest.fixture
+def source(tmp_path):
+    files = {
+        "pure/__init__.py": "VALUE = 1\n",
+        "pure/helpers.py": "def helper():\n    return 1\n",
+        "native/__init__.py": "",
+        "native/_speedups.so": "\x7fELF",
+        "single.py": "SINGLE = 1\n",
+    }
+    for rel_path, content in files.items():
+        path = tmp_path / "efs" / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    return str(tmp_path / "efs")
+
+
+def sync(source, target, mode="copy"):
+    mirror = PackageMirror(source, target, mode=mode, max_workers=4, reserve_mb=0)
+    return mirror.sync(), mirror
+
+
+def read(root, rel_path):
+    with open(os.path.join(root, rel_path), "r") as f:
+        return f.read()
+
+
+def change(source, rel_path, content):
+    with open(os.path.join(source, rel_path), "w") as f:
+        f.write(content)
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+def test_copy_mode_only_copies_what_changed(source, tmp_path, manifest):
+    target = str(tmp_path / "mirror")
+    if manifest:
+        silvaengine_package_mirror.build_manifest(source)
+
+    paths, mirror = sync(source, target)
+    assert paths == [target]
+    assert mirror.copied_files == 5
+    assert read(target, "pure/helpers.py") == read(source, "pure/helpers.py")
+
+    # A second sync, e.g. by the next cold start in the same container.
+    paths, mirror = sync(source, target)
+    assert paths == [target] and mirror.copied_files == 0
+
+    change(source, "pure/helpers.py", "def helper():\n    return 2\n")
+    os.remove(os.path.join(source, "single.py"))
+    if manifest:
+        silvaengine_package_mirror.build_manifest(source)
+    paths, mirror = sync(source, target)
+    assert mirror.copied_files == 1
+    assert read(target, "pure/helpers.py") == "def helper():\n    return 2\n"
+    assert not os.path.exists(os.path.join(target, "single.py"))
+
+
+def test_zip_mode_copies_the_archive_and_the_native_packages(source, tmp_path):
+    target = str(tmp_path / "mirror")
+    silvaengine_package_mirror.build_manifest(source, archive=True)
+
+    paths, mirror = sync(source, target, mode="zip")
+    archive = os.path.join(target, silvaengine_package_mirror.ARCHIVE)
+    assert paths == [target, archive]
+    # The archive and the two files of the native package.
+    assert mirror.copied_files == 3
+    assert sorted(os.listdir(os.path.join(target, "native"))) == [
+        "__init__.py",
+        "_speedups.so",
+    ]
+    assert not os.path.exists(os.path.join(target, "pure"))
+    with zipfile.ZipFile(archive) as fzip:
+        assert sorted(fzip.namelist()) == [
+            "pure/__init__.py",
+            "pure/helpers.py",
+            "single.py",
+        ]
+
+    paths, mirror = sync(source, target, mode="zip")
+    assert mirror.copied_files == 0
+
+    change(source, "pure/helpers.py", "def helper():\n    return 2\n")
+    silvaengine_package_mirror.build_manifest(source, archive=True)
+    paths, mirror = sync(source, target, mode="zip")
+    assert mirror.copied_files == 1
+    with zipfile.ZipFile(archive) as fzip:
+        assert fzip.read("pure/helpers.py") == b"def helper():\n    return 2\n"
+
+
+def test_switching_mode_mirrors_again(source, tmp_path):
+    target = str(tmp_path / "mirror")
+    silvaengine_package_mirror.build_manifest(source, archive=True)
+    sync(source, target, mode="zip")
+
+    paths, mirror = sync(source, target, mode="copy")
+    assert paths == [target]
+    # Only the files left out for the archive are copied.
+    assert mirror.copied_files == 3
+    assert read(target, "single.py") == "SINGLE = 1\n"
+
+
+def test_install_falls_back_to_the_source(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(silvaengine_package_mirror.sys, "path", [])
+    monkeypatch.setenv("PACKAGEMIRROR", "copy")
+    monkeypatch.setenv("PACKAGEMIRRORPATH", str(tmp_path / "mirror"))
+    # No room left in the target: import from the source as before.
+    monkeypatch.setenv("PACKAGEMIRRORRESERVEMB", str(1024 * 1024 * 1024))
+    assert silvaengine_package_mirror.install(source) == [source]
+    assert silvaengine_package_mirror.sys.path == [source]
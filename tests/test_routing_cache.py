@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import logging
+import sys
+import types
+
+import pytest
+
+import silvaengine_routing_cache
+from silvaengine_routing_cache import RoutingCache
+
+MODULE = "fake_silvaengine_base"
+
+
+@pytest.fixture
+def base(monkeypatch):
+    """A stand-in for silvaengine_base whose lookups count their calls."""
+    calls = []
+
+    class LambdaBase(object):
+        setting = "a"
+
+        def __init__(self, setting_id="a"):
+            self.setting_id = setting_id
+
+        @staticmethod
+        def get_endpoint(endpoint_id):
+            calls.append(("get_endpoint", endpoint_id))
+            return {"endpoint_id": endpoint_id}
+
+        @classmethod
+        def get_function(cls, endpoint_id, function_name):
+            calls.append(("get_function", function_name))
+            return {"function": function_name, "setting": cls.setting}
+
+        def get_setting(self, variable):
+            calls.append(("get_setting", self.setting_id))
+            return {"setting_id": self.setting_id, "variable": variable}
+
+    LambdaBase.not_a_method = "value"
+    module = types.ModuleType(MODULE)
+    module.LambdaBase = LambdaBase
+    monkeypatch.setitem(sys.modules, MODULE, module)
+    return LambdaBase, calls
+
+
+def wrap(name):
+    return silvaengine_routing_cache.wrap(RoutingCache(), f"{MODULE}.LambdaBase.{name}")
+
+
+def test_wrap_replaces_static_methods(base):
+    LambdaBase, calls = base
+    assert wrap("get_endpoint")
+    assert isinstance(LambdaBase.__dict__["get_endpoint"], staticmethod)
+
+    value = LambdaBase.get_endpoint("api")
+    value["endpoint_id"] = "changed"
+    assert LambdaBase().get_endpoint("api") == {"endpoint_id": "api"}
+    assert calls == [("get_endpoint", "api")]
+
+
+def test_wrap_replaces_class_methods(base):
+    LambdaBase, calls = base
+    assert wrap("get_function")
+    assert isinstance(LambdaBase.__dict__["get_function"], classmethod)
+
+    assert LambdaBase.get_function("api", "graphql")["setting"] == "a"
+    assert LambdaBase().get_function("api", "graphql")["setting"] == "a"
+    assert calls == [("get_function", "graphql")]
+
+
+def test_wrap_keys_plain_methods_per_instance(base):
+    LambdaBase, calls = base
+    assert wrap("get_setting")
+
+    first, second = LambdaBase("a"), LambdaBase("b")
+    assert first.get_setting("x") == {"setting_id": "a", "variable": "x"}
+    assert first.get_setting("x") == {"setting_id": "a", "variable": "x"}
+    assert second.get_setting("x") == {"setting_id": "b", "variable": "x"}
+    assert calls == [("get_setting", "a"), ("get_setting", "b")]
+
+
+@pytest.mark.parametrize(
+    "target",
+    [
+        f"{MODULE}.LambdaBase.get_missing",
+        f"{MODULE}.Missing.get_endpoint",
+        "missing_module.LambdaBase.get_endpoint",
+        f"{MODULE}.LambdaBase.not_a_method",
+        "get_endpoint",
+    ],
+)
+def test_wrap_warns_about_the_targets_it_skips(base, caplog, target):
+    with caplog.at_level(logging.WARNING):
+        assert not silvaengine_routing_cache.wrap(RoutingCache(), target)
+    assert f"Routing cache skips {target}" in caplog.text
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("botocore")
+
+import s3_uploader
+from botocore.exceptions import ClientError
+
+PART_SIZE = 1024
+
+
+class StubS3(object):
+    """Keeps multipart uploads in memory; fail_on maps a part number to the
+    exception its next upload_part raises."""
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+        self.sent = []
+        self.aborted = []
+        self.fail_on = {}
+        self._lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key):
+        with self._lock:
+            upload_id = f"upload-{len(self.uploads)}"
+            self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        with self._lock:
+            error = self.fail_on.pop(PartNumber, None)
+            if error is not None:
+                raise error
+            self.sent.append(PartNumber)
+            etag = f'"{hashlib.md5(Body).hexdigest()}"'
+            self.uploads[UploadId][PartNumber] = (etag, Body)
+        return {"ETag": etag}
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_parts"
+        stub = self
+
+        class Paginator(object):
+            def paginate(self, Bucket, Key, UploadId):
+                if UploadId not in stub.uploads:
+                    raise ClientError({"Error": {"Code": "NoSuchUpload"}}, "ListParts")
+                parts = stub.uploads[UploadId]
+                yield {
+                    "Parts": [
+                        {"PartNumber": n, "ETag": parts[n][0]} for n in sorted(parts)
+                    ]
+                }
+
+        return Paginator()
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        body = b""
+        for part in MultipartUpload["Parts"]:
+            assert parts[part["PartNumber"]][0] == part["ETag"]
+            body += parts[part["PartNumber"]][1]
+        self.objects[(Bucket, Key)] = body
+        return {"VersionId": f"v{len(self.objects)}"}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.uploads.pop(UploadId, None)
+
+    def put_object(self, Bucket, Key, Body, ContentMD5):
+        self.objects[(Bucket, Key)] = Body
+        return {"VersionId": "v0"}
+
+
+@pytest.fixture
+def uploader(tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_uploader, "MIN_PART_SIZE", PART_SIZE)
+    s3 = StubS3()
+
+    def new_uploader():
+        return s3_uploader.MultipartUploader(
+            s3, part_size=PART_SIZE, max_concurrency=1, state_dir=str(tmp_path)
+        )
+
+    return s3, new_uploader
+
+
+def write(path, data):
+    # Like write_zip: a new file replaces the old one, with a new mtime.
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def interrupt(s3, new_uploader, file_name, part_number):
+    s3.fail_on[part_number] = KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        new_uploader().upload(file_name, "bucket", "package.zip", digest="d1")
+
+
+def test_an_interrupted_upload_resumes_with_the_parts_sent(tmp_path, uploader):
+    s3, new_uploader = uploader
+    data = os.urandom(PART_SIZE * 5 + 100)
+    file_name = str(tmp_path / "package.zip")
+    write(file_name, data)
+
+    interrupt(s3, new_uploader, file_name, 4)
+    sent = list(s3.sent)
+    assert sent[:3] == [1, 2, 3] and 4 not in sent
+    # The acknowledged parts were saved as they completed; parts that were
+    # still in flight may be on S3 without being in the state.
+    with open(new_uploader()._state_path("bucket", "package.zip"), "r") as f:
+        saved = sorted(int(n) for n in json.load(f)["parts"])
+    assert saved[:3] == [1, 2, 3] and set(saved) <= set(sent)
+
+    # The next run writes the same zip again before uploading it.
+    write(file_name, data)
+    s3.sent = []
+    version_id = new_uploader().upload(file_name, "bucket", "package.zip", digest="d1")
+
+    assert sorted(s3.sent) == [n for n in range(1, 7) if n not in sent]
+    assert s3.aborted == [] and s3.objects[("bucket", "package.zip")] == data
+    assert version_id == "v1"
+    assert not os.path.exists(new_uploader()._state_path("bucket", "package.zip"))
+
+
+def test_parts_missing_from_the_state_are_kept_when_they_match(tmp_path, uploader):
+    s3, new_uploader = uploader
+    data = os.urandom(PART_SIZE * 4)
+    file_name = str(tmp_path / "package.zip")
+    write(file_name, data)
+    interrupt(s3, new_uploader, file_name, 3)
+
+    # A kill between upload_part and the save of the state.
+    state_path = new_uploader()._state_path("bucket", "package.zip")
+    with open(state_path, "r") as f:
+        state = json.load(f)
+    state["parts"] = {}
+    with open(state_path, "w") as f:
+        json.dump(state, f)
+
+    s3.sent = []
+    new_uploader().upload(file_name, "bucket", "package.zip", digest="d1")
+    assert 1 not in s3.sent and 2 not in s3.sent and 3 in s3.sent
+    assert s3.objects[("bucket", "package.zip")] == data
+
+
+def test_a_changed_file_starts_a_new_upload(tmp_path, uploader):
+    s3, new_uploader = uploader
+    file_name = str(tmp_path / "package.zip")
+    write(file_name, os.urandom(PART_SIZE * 3))
+    interrupt(s3, new_uploader, file_name, 2)
+
+    data = os.urandom(PART_SIZE * 3)
+    write(file_name, data)
+    s3.sent = []
+    new_uploader().upload(file_name, "bucket", "package.zip", digest="d2")
+    assert s3.aborted == ["upload-0"] and sorted(s3.sent) == [1, 2, 3]
+    assert s3.objects[("bucket", "package.zip")] == data
+
+
+def test_without_a_digest_the_upload_is_tied_to_the_content(tmp_path, uploader):
+    s3, new_uploader = uploader
+    data = os.urandom(PART_SIZE * 3)
+    file_name = str(tmp_path / "package.zip")
+    write(file_name, data)
+    s3.fail_on[3] = KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        new_uploader().upload(file_name, "bucket", "package.zip")
+
+    write(file_name, data)
+    s3.sent = []
+    new_uploader().upload(file_name, "bucket", "package.zip")
+    assert s3.sent == [3] and s3.aborted == []
+
+
+def test_a_failed_part_keeps_the_others_for_the_next_run(tmp_path, uploader):
+    s3, new_uploader = uploader
+    data = os.urandom(PART_SIZE * 3)
+    file_name = str(tmp_path / "package.zip")
+    write(file_name, data)
+    s3.fail_on[2] = ClientError({"Error": {"Code": "RequestTimeout"}}, "UploadPart")
+    with pytest.raises(ClientError):
+        new_uploader().upload(file_name, "bucket", "package.zip", digest="d1")
+    assert sorted(s3.sent) == [1, 3]
+
+    s3.sent = []
+    new_uploader().upload(file_name, "bucket", "package.zip", digest="d1")
+    assert s3.sent == [2] and s3.objects[("bucket", "package.zip")] == data
+
+
+def test_small_files_are_put_in_one_request(tmp_path, uploader):
+    s3, new_uploader = uploader
+    file_name = str(tmp_path / "package.zip")
+    write(file_name, b"small")
+    assert new_uploader().upload(file_name, "bucket", "package.zip") == "v0"
+    assert s3.objects[("bucket", "package.zip")] == b"small" and s3.sent == []
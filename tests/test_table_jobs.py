@@ -0,0 +1,267 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+__author__ = "bibow"
+
+import threading
+
+import pytest
+
+pytest.importorskip("boto3")
+
+import table_jobs
+from botocore.exceptions import ClientError
+
+TABLE = "se-endpoints"
+
+
+def throttled():
+    return ClientError(
+        {"Error": {"Code": "ProvisionedThroughputExceededException"}}, "Batch"
+    )
+
+
+class StubDynamoDB(object):
+    """Answers batch_write_item/batch_get_item from a list of scripted steps;
+    each step gets the request and returns the response or raises. Once the
+    steps run out every request is processed in full."""
+
+    def __init__(self, steps=None, items=None):
+        self.steps = list(steps or [])
+        self.items = items or {}
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def _next(self, request_items):
+        with self._lock:
+            self.requests.append(request_items)
+            step = self.steps.pop(0) if self.steps else None
+        return step(request_items) if step is not None else None
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        response = self._next(RequestItems) or {}
+        unprocessed = response.get("UnprocessedItems", {}).get(TABLE, [])
+        with self._lock:
+            for request in RequestItems[TABLE]:
+                if request not in unprocessed:
+                    item = request["PutRequest"]["Item"]
+                    self.items[item["id"]] = item
+        return response
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        response = self._next(RequestItems)
+        if response is None:
+            keys = RequestItems[TABLE]["Keys"]
+            response = {
+                "Responses": {
+                    TABLE: [self.items[k["id"]] for k in keys if k["id"] in self.items]
+                }
+            }
+        return response
+
+
+def first_unprocessed(count):
+    """A step that processes all but the last count requests."""
+
+    def step(request_items):
+        return {"UnprocessedItems": {TABLE: request_items[TABLE][-count:]}}
+
+    return step
+
+
+def raise_error(error):
+    def step(request_items):
+        raise error
+
+    return step
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    attempts = []
+    monkeypatch.setattr(table_jobs, "backoff", attempts.append)
+    return attempts
+
+
+def puts(count):
+    return [{"PutRequest": {"Item": {"id": str(i)}}} for i in range(count)]
+
+
+def test_write_batch_retries_unprocessed_items(backoffs):
+    dynamodb = StubDynamoDB([first_unprocessed(5), first_unprocessed(2)])
+    writer = table_jobs.BatchWriter(TABLE, dynamodb_factory=lambda: dynamodb)
+    writer.write_batch(puts(25))
+
+    # Unprocessed items come back first and nothing else is sent again.
+    assert [len(r[TABLE]) for r in dynamodb.requests] == [25, 5, 2]
+    assert sorted(dynamodb.items) == sorted(str(i) for i in range(25))
+    assert backoffs == [0, 1]
+    assert writer.retries == 2
+    assert writer.meter.items == 25
+    assert writer.throttle.throttled == 2
+
+
+def test_write_batch_retries_throttling_and_raises_other_errors(backoffs):
+    dynamodb = StubDynamoDB([raise_error(throttled())])
+    writer = table_jobs.BatchWriter(TABLE, dynamodb_factory=lambda: dynamodb)
+    writer.write_batch(puts(3))
+    assert len(dynamodb.items) == 3 and backoffs == [0]
+
+    dynamodb = StubDynamoDB(
+        [raise_error(ClientError({"Error": {"Code": "ValidationException"}}, "B"))]
+    )
+    writer = table_jobs.BatchWriter(TABLE, dynamodb_factory=lambda: dynamodb)
+    with pytest.raises(ClientError):
+        writer.write_batch(puts(3))
+    # The slot taken by the failed request is given back.
+    assert writer.throttle.in_flight == 0
+
+
+def test_write_batch_gives_the_slot_back_on_any_error(backoffs):
+    dynamodb = StubDynamoDB([raise_error(RuntimeError("connection reset"))])
+    writer = table_jobs.BatchWriter(TABLE, dynamodb_factory=lambda: dynamodb)
+    with pytest.raises(RuntimeError):
+        writer.write_batch(puts(3))
+    assert writer.throttle.in_flight == 0 and writer.throttle.throttled == 0
+
+    # The writer goes on with the full pool.
+    writer.write_batch(puts(3))
+    assert len(dynamodb.items) == 3 and writer.throttle.in_flight == 0
+
+
+def test_write_batch_gives_up_after_max_retries(backoffs):
+    dynamodb = StubDynamoDB([first_unprocessed(1)] * 10)
+    writer = table_jobs.BatchWriter(
+        TABLE, dynamodb_factory=lambda: dynamodb, max_retries=3
+    )
+    with pytest.raises(Exception, match="still unprocessed after 3 retries"):
+        writer.write_batch(puts(2))
+    assert backoffs == [0, 1, 2]
+
+
+def test_write_batches_and_skips_acknowledged_ones(backoffs):
+    dynamodb = StubDynamoDB()
+    writer = table_jobs.BatchWriter(
+        TABLE, dynamodb_factory=lambda: dynamodb, max_workers=4
+    )
+    acked = []
+    sent = writer.write(
+        iter(puts(260)),
+        on_batch=lambda batch_number, batch: acked.append(batch_number),
+        skip_batch=lambda batch_number: batch_number == 2,
+    )
+    assert sent == 10 and sorted(acked) == [0, 1, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert len(dynamodb.items) == 260 - 25
+
+
+def test_backoff_is_jittered_and_capped(monkeypatch):
+    bounds, sleeps = [], []
+    monkeypatch.setattr(
+        table_jobs.random, "uniform", lambda low, high: bounds.append(high) or high
+    )
+    monkeypatch.setattr(table_jobs.time, "sleep", sleeps.append)
+    for attempt in range(12):
+        table_jobs.backoff(attempt, base=0.05, cap=20.0)
+    assert bounds[:3] == [0.05, 0.1, 0.2]
+    assert max(bounds) == 20.0 and sleeps == bounds
+
+
+def test_adaptive_throttle_halves_and_recovers():
+    throttle = table_jobs.AdaptiveThrottle(8, recovery=2)
+    throttle.acquire()
+    throttle.release(throttled=True)
+    assert throttle.limit == 4
+    for i in range(4):
+        throttle.acquire()
+        throttle.release()
+    assert throttle.limit == 6
+
+
+def test_get_retries_unprocessed_keys_and_dedupes(backoffs):
+    items = {str(i): {"id": str(i), "n": i} for i in range(150)}
+
+    def unprocessed_tail(request_items):
+        keys = request_items[TABLE]["Keys"]
+        return {
+            "Responses": {TABLE: [items[k["id"]] for k in keys[:-10]]},
+            "UnprocessedKeys": {TABLE: {"Keys": keys[-10:]}},
+        }
+
+    dynamodb = StubDynamoDB([unprocessed_tail], items=items)
+    getter = table_jobs.BatchGetter(
+        TABLE, dynamodb_factory=lambda: dynamodb, max_workers=2
+    )
+    keys = [{"id": str(i)} for i in range(150)] + [{"id": "7"}, {"id": "missing"}]
+    found = list(getter.get(iter(keys)))
+
+    assert sorted(item["id"] for item in found) == sorted(items)
+    assert getter.requested == 151
+    assert getter.retries == 1 and backoffs == [0]
+    # 151 unique keys in batches of 100, plus the retry of 10 keys.
+    assert sorted(len(r[TABLE]["Keys"]) for r in dynamodb.requests) == [10, 51, 100]
+
+
+def test_get_raises_the_errors_of_the_workers(backoffs):
+    dynamodb = StubDynamoDB(
+        [raise_error(ClientError({"Error": {"Code": "ValidationException"}}, "B"))]
+    )
+    getter = table_jobs.BatchGetter(TABLE, dynamodb_factory=lambda: dynamodb)
+    with pytest.raises(ClientError):
+        list(getter.get([{"id": "1"}]))
+
+
+class StubTable(object):
+    """A table of pages per segment; a page is read by its ExclusiveStartKey."""
+
+    def __init__(self, total_segments, pages):
+        self.total_segments = total_segments
+        self.pages = pages
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def scan(self, Segment, TotalSegments, ExclusiveStartKey=None, **kwargs):
+        assert TotalSegments == self.total_segments
+        with self._lock:
+            self.calls.append((Segment, ExclusiveStartKey))
+        page = 0 if ExclusiveStartKey is None else ExclusiveStartKey["page"]
+        response = {"Items": [f"{Segment}-{page}-{i}" for i in range(3)]}
+        if page + 1 < self.pages:
+            response["LastEvaluatedKey"] = {"page": page + 1}
+        return response
+
+
+def test_parallel_scan_reads_every_page_of_every_segment():
+    table = StubTable(4, pages=3)
+    items, pages = [], []
+    lock = threading.Lock()
+
+    def on_page(segment, page, last_evaluated_key):
+        with lock:
+            items.extend(page)
+            pages.append((segment, last_evaluated_key))
+
+    table_jobs.parallel_scan(lambda: table, 4, on_page)
+
+    assert len(items) == len(set(items)) == 4 * 3 * 3
+    for segment in range(4):
+        assert [key for s, key in pages if s == segment] == [
+            {"page": 1},
+            {"page": 2},
+            None,
+        ]
+
+
+def test_parallel_scan_resumes_from_start_keys():
+    table = StubTable(4, pages=3)
+    items = []
+    # Segment 1 goes on from its second page; the segments missing from
+    # start_keys are finished and not scanned again.
+    table_jobs.parallel_scan(
+        lambda: table,
+        4,
+        lambda segment, page, last_evaluated_key: items.extend(page),
+        start_keys={1: {"page": 1}},
+    )
+    assert table.calls == [(1, {"page": 1}), (1, {"page": 2})]
+    assert len(items) == 6